@@ -1,148 +1,498 @@
 """Entry point to start OPHI pipeline"""
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from os.path import expanduser, join
-
-from hdx.api.configuration import Configuration
-from hdx.data.user import User
-from hdx.facades.infer_arguments import facade
-from hdx.location.adminlevel import AdminLevel
-from hdx.location.country import Country
-from hdx.utilities.downloader import Download
-from hdx.utilities.easy_logging import setup_logging
-from hdx.utilities.path import (
-    script_dir_plus_file,
-    wheretostart_tempdir_batch,
-)
-from hdx.utilities.retriever import Retrieve
+from resource import RUSAGE_SELF, getrusage
 
 from hdx.scraper.ophi._version import __version__
-from hdx.scraper.ophi.dataset_generator import DatasetGenerator
-from hdx.scraper.ophi.hapi_dataset_generator import HAPIDatasetGenerator
-from hdx.scraper.ophi.hapi_output import HAPIOutput
-from hdx.scraper.ophi.pipeline import Pipeline
+from hdx.scraper.ophi.checkpoint import Checkpoint
+from hdx.scraper.ophi.compression import Compressor
+from hdx.scraper.ophi.delta import RowDelta
+from hdx.scraper.ophi.fingerprints import Fingerprints
+from hdx.scraper.ophi.hashing import hash_files, hash_objects
+from hdx.scraper.ophi.hdx_index import HDXIndex
+from hdx.scraper.ophi.hdx_session import configure_hdx_session
+from hdx.scraper.ophi.http_accounting import HTTPAccounting
+from hdx.scraper.ophi.memory_folder import (
+    get_files_in_folder,
+    get_resource_folder,
+    remove_files,
+)
+from hdx.scraper.ophi.profiler import Profiler
+from hdx.scraper.ophi.rowstore import RowBudget
+from hdx.scraper.ophi.shared_tables import SharedTables, write_tables
+from hdx.scraper.ophi.work_queue import WorkQueue
 
-setup_logging()
 logger = logging.getLogger(__name__)
 
 lookup = "hdx-scraper-ophi"
 updated_by_script = "HDX Scraper: OPHI"
 
 create_country_datasets = True
+tables_filename = "standardised_tables"
+config_filenames = (
+    "project_configuration.yaml",
+    "hdx_dataset_static.yaml",
+    "hdx_hapi_dataset_static.yaml",
+)
 
 
 def main(
     save: bool = False,
     use_saved: bool = False,
+    saved_dir: str = "saved_data",
+    profile: str | None = None,
+    memory_budget: int | None = None,
+    checkpoint_file: str | None = None,
+    parse_cache: str | None = None,
+    sqlite_file: str | None = None,
+    countries: list[str] | None = None,
+    fingerprints_file: str | None = None,
+    compression: str | None = None,
+    call_budget: int | None = None,
+    shard_folder: str | None = None,
+    worker: bool = False,
+    lease_seconds: int = 600,
+    delta_file: str | None = None,
+    in_memory: bool = False,
+    layouts_file: str | None = None,
 ) -> None:
     """Generate datasets and create them in HDX
 
     Args:
         save (bool): Save downloaded data. Defaults to False.
         use_saved (bool): Use saved data. Defaults to False.
+        saved_dir (str): Folder to save data to or use saved data from. Defaults to saved_data.
+        profile (str | None): Folder for profiling output. Defaults to None (don't profile).
+        memory_budget (int | None): Max rows to hold in memory before spilling to disk. Defaults to None (no limit).
+        checkpoint_file (str | None): Journal file used to resume after completed steps. Defaults to None (don't resume).
+        parse_cache (str | None): Folder for cache of parsed data. Defaults to None (don't cache).
+        sqlite_file (str | None): SQLite database to export standardised data to. Defaults to None (don't export).
+        countries (list[str] | None): ISO3 codes of countries to process. Defaults to None (all countries).
+        fingerprints_file (str | None): File of per-country fingerprints used to skip unchanged countries. Defaults to None (update all countries).
+        compression (str | None): Also publish gzip or zstd compressed copies of the global CSVs. Defaults to None (don't compress).
+        call_budget (int | None): Fail the run if it makes more HTTP calls than this. Defaults to None (no limit).
+        shard_folder (str | None): Shared folder for a queue of countries that worker processes publish. Defaults to None (publish countries in this process).
+        worker (bool): Only publish countries claimed from the queue in shard_folder. Defaults to False.
+        lease_seconds (int): Seconds after which a country claimed by a worker that has stopped is claimed by another. Defaults to 600.
+        delta_file (str | None): File of the previous run's global and HAPI rows used to publish the rows that changed. Defaults to None (don't publish changes).
+        in_memory (bool): Write resources to a memory backed folder and remove them once uploaded unless debugging. Defaults to False.
+        layouts_file (str | None): File of the previous run's sheet headers that the preflight compares with. Defaults to None (don't compare).
     Returns:
         None
     """
-    logger.info(f"##### {lookup} version {__version__} ####")
-    configuration = Configuration.read()
-    if not User.check_current_user_organization_access(
-        "00547685-9ded-4d69-9ca5-47d5278ead7c", "create_dataset"
-    ):
-        raise PermissionError("API Token does not give access to OPHI organisation!")
-    with wheretostart_tempdir_batch(lookup) as info:
-        folder = info["folder"]
-        batch = info["batch"]
-
-        def update_dataset(dataset, filename="hdx_dataset_static.yaml"):
-            if dataset:
-                dataset.update_from_yaml(
-                    script_dir_plus_file(join("config", filename), main)
-                )
-                dataset.create_in_hdx(
-                    remove_additional_resources=True,
-                    updated_by_script=updated_by_script,
-                    batch=batch,
-                )
-
-        with Download() as downloader:
-            retriever = Retrieve(
-                downloader, folder, "saved_data", folder, save, use_saved
-            )
-            adminone = AdminLevel(admin_level=1, retriever=retriever)
-            adminone.setup_from_url()
-
-            pipeline = Pipeline(configuration, retriever, adminone)
-            mpi_national_path, mpi_subnational_path, trend_path = pipeline.process()
-            dataset_generator = DatasetGenerator(
-                configuration,
-                mpi_national_path,
-                mpi_subnational_path,
-                trend_path,
-            )
-            standardised_global = pipeline.get_standardised_global()
-            standardised_global_trend = pipeline.get_standardised_global_trend()
-            standardised_countries = pipeline.get_standardised_countries()
-            standardised_countries_trend = pipeline.get_standardised_countries_trend()
-            date_ranges = pipeline.get_date_ranges()
-            global_date_range = date_ranges["global"]
-            countries_with_data = list(standardised_countries.keys())
-
-            dataset = dataset_generator.generate_global_dataset(
-                folder,
-                standardised_global,
-                standardised_global_trend,
-                global_date_range,
+    if worker and not shard_folder:
+        raise ValueError("Workers need a shard folder!")
+    # HDX modules are slow to import so they are only imported when running
+    from hdx.api.configuration import Configuration
+    from hdx.data.user import User
+    from hdx.location.adminlevel import AdminLevel
+    from hdx.location.country import Country
+    from hdx.utilities.downloader import Download
+    from hdx.utilities.path import script_dir_plus_file, wheretostart_tempdir_batch
+    from hdx.utilities.retriever import Retrieve
+
+    from hdx.scraper.ophi.dataset_generator import DatasetGenerator
+    from hdx.scraper.ophi.hapi_dataset_generator import HAPIDatasetGenerator
+    from hdx.scraper.ophi.hapi_output import HAPIOutput
+    from hdx.scraper.ophi.pipeline import Pipeline
+    from hdx.scraper.ophi.sqlite_export import SQLiteExport
+
+    with Profiler(profile) as profiler, HTTPAccounting(call_budget) as accounting:
+
+        def stage(name):
+            profiler.stage(name)
+            accounting.stage(name)
+
+        def run_stage(name, function):
+            # stages run in the background are timed and counted in their thread
+            with profiler.thread_stage(name):
+                accounting.stage(name)
+                return function()
+
+        logger.info(f"##### {lookup} version {__version__} ####")
+        configuration = Configuration.read()
+        configure_hdx_session(configuration)
+        if not User.check_current_user_organization_access(
+            "00547685-9ded-4d69-9ca5-47d5278ead7c", "create_dataset"
+        ):
+            raise PermissionError(
+                "API Token does not give access to OPHI organisation!"
             )
-            dataset.add_country_locations(countries_with_data)
-            update_dataset(dataset)
-
-            dataset_id = dataset["id"]
-            resource_ids = [x["id"] for x in dataset.get_resources()]
-            time_period = dataset.get_time_period()
-
-            hapi_output = HAPIOutput(
-                configuration,
-                adminone,
-                standardised_global,
-                standardised_global_trend,
+        with (
+            wheretostart_tempdir_batch(lookup) as info,
+            get_resource_folder(info["folder"], in_memory, lookup) as resource_folder,
+        ):
+            # downloads, spilled rows and compressed copies stay on disk
+            folder = info["folder"]
+            batch = info["batch"]
+            # files are kept for inspection when debugging
+            remove_uploaded = resource_folder != folder and not logger.isEnabledFor(
+                logging.DEBUG
             )
-            rows = hapi_output.process(dataset_id, resource_ids)
-            hapi_dataset_generator = HAPIDatasetGenerator(configuration, rows)
-            dataset = hapi_dataset_generator.generate_poverty_rate_dataset(folder)
-            dataset.add_country_locations(countries_with_data)
-            dataset.set_time_period(time_period["startdate"], time_period["enddate"])
-            update_dataset(dataset, "hdx_hapi_dataset_static.yaml")
-
-            if create_country_datasets:
-                dataset_generator.load_showcase_links(retriever)
-                for countryiso3 in sorted(standardised_countries):
-                    standardised_country = standardised_countries[countryiso3]
-                    countryname = Country.get_country_name_from_iso3(countryiso3)
-                    standardised_country_trend = standardised_countries_trend.get(
-                        countryiso3, {}
+            if memory_budget:
+                row_budget = RowBudget(memory_budget, folder)
+            else:
+                row_budget = None
+            if compression:
+                compressor = Compressor(compression, folder)
+            else:
+                compressor = None
+
+            def update_dataset(dataset, filename="hdx_dataset_static.yaml"):
+                if dataset:
+                    DatasetGenerator.update_from_static_metadata(
+                        dataset, script_dir_plus_file(join("config", filename), main)
+                    )
+                    if compressor:
+                        compressor.wait(dataset)
+                    if remove_uploaded:
+                        paths = get_files_in_folder(dataset, resource_folder)
+                    dataset.create_in_hdx(
+                        remove_additional_resources=True,
+                        updated_by_script=updated_by_script,
+                        batch=batch,
                     )
+                    if remove_uploaded:
+                        remove_files(paths)
+
+            # publishing that fails in the background stops the run at the next
+            # country rather than once every country has been published
+            background_futures = []
+
+            def publish_country(
+                countryiso3, standardised_rows, standardised_trend_rows, date_range
+            ):
+                for future in background_futures:
+                    if future.done():
+                        future.result()
+                countryname = Country.get_country_name_from_iso3(countryiso3)
+                step = f"dataset {countryiso3}"
+                if checkpoint.is_done(step):
+                    dataset = checkpoint.get(step)["dataset_id"]
+                else:
                     dataset = dataset_generator.generate_dataset(
-                        folder,
-                        standardised_country,
-                        standardised_country_trend,
+                        resource_folder,
+                        standardised_rows,
+                        standardised_trend_rows,
                         countryiso3,
                         countryname,
-                        date_ranges[countryiso3],
+                        date_range,
                     )
                     dataset.add_country_location(countryiso3)
                     dataset.set_expected_update_frequency("As needed")
                     update_dataset(dataset)
+                    checkpoint.done(step, dataset_id=dataset["id"])
+                step = f"showcase {countryiso3}"
+                if not checkpoint.is_done(step):
                     showcase = dataset_generator.generate_showcase(
                         countryiso3, countryname
                     )
                     if showcase:
                         showcase.create_in_hdx()
                         showcase.add_dataset(dataset)
+                    checkpoint.done(step)
+
+            def work_queue(queue):
+                # rows are read from tables shared by all processes publishing
+                with SharedTables(join(shard_folder, tables_filename)) as tables:
+
+                    def publish_item(countryiso3, payload):
+                        date_range, fingerprint = payload
+                        publish_country(
+                            countryiso3,
+                            tables.get_rows("standardised_mpi", countryiso3),
+                            tables.get_rows("standardised_trends", countryiso3),
+                            date_range,
+                        )
+                        return {"fingerprint": fingerprint}
+
+                    queue.work(publish_item)
+
+            if worker:
+                queue = WorkQueue(shard_folder, lease_seconds)
+                context = queue.wait_until_ready()
+                # datasets are published in the coordinator's batch
+                batch = context["batch"]
+                dataset_generator = DatasetGenerator(configuration, None)
+                dataset_generator.set_showcase_links(context["showcase_links"])
+                checkpoint = Checkpoint(None, "")
+                stage("country datasets")
+                work_queue(queue)
+            else:
+                with (
+                    Download() as downloader,
+                    HDXIndex(configuration) as hdx_index,
+                    ThreadPoolExecutor(1, "publish") as executor,
+                ):
+                    retriever = Retrieve(
+                        downloader, folder, saved_dir, folder, save, use_saved
+                    )
+                    stage("preflight")
+                    adminone = AdminLevel(admin_level=1, retriever=retriever)
+                    pipeline = Pipeline(
+                        configuration,
+                        retriever,
+                        adminone,
+                        row_budget,
+                        parse_cache,
+                        countries,
+                    )
+                    pipeline.preflight(layouts_file)
+
+                    stage("prefetch")
+                    # existing datasets and showcases are looked up in a few searches
+                    # rather than one at a time as each is published
+                    hdx_index.prefetch(
+                        configuration["prefetch"]["datasets"],
+                        configuration["prefetch"]["showcases"],
+                    )
+
+                    stage("setup")
+                    adminone.setup_from_url()
+
+                    stage("process")
+                    source_paths = pipeline.process()
+                    dataset_generator = DatasetGenerator(
+                        configuration, source_paths, compressor
+                    )
+                    if create_country_datasets:
+                        dataset_generator.load_showcase_links(retriever)
+                    standardised_global = pipeline.get_standardised_global()
+                    standardised_global_trend = pipeline.get_standardised_global_trend()
+                    standardised_countries = pipeline.get_standardised_countries()
+                    standardised_countries_trend = (
+                        pipeline.get_standardised_countries_trend()
+                    )
+                    date_ranges = pipeline.get_date_ranges()
+                    global_date_range = date_ranges["global"]
+                    countries_with_data = list(standardised_countries.keys())
+                    dataset_generator.write_resources(
+                        resource_folder, standardised_global, standardised_global_trend
+                    )
+
+                    inputs_hash = hash_files(pipeline.get_input_paths())
+                    # steps are only skipped if what they publish would be the same
+                    config_hash = hash_files(
+                        script_dir_plus_file(join("config", filename), main)
+                        for filename in config_filenames
+                    )
+                    run_hash = hash_objects(
+                        inputs_hash,
+                        config_hash,
+                        __version__,
+                        sorted(countries) if countries else None,
+                        dataset_generator.get_showcase_links(),
+                    )
+                    checkpoint = Checkpoint(checkpoint_file, run_hash)
+
+                    stage("hapi rows")
+                    if countries:
+                        # the global and HAPI datasets cover all countries so are left
+                        # alone rather than republished with a subset
+                        logger.info("Not updating global and HAPI datasets")
+                        delta = None
+                        hapi_future = None
+                    else:
+                        delta = RowDelta(configuration, delta_file)
+                        if delta_file:
+                            delta.compare("standardised_mpi", standardised_global)
+                            delta.compare(
+                                "standardised_trends", standardised_global_trend
+                            )
+                        hapi_output = HAPIOutput(
+                            configuration,
+                            adminone,
+                            standardised_global,
+                            standardised_global_trend,
+                            row_budget,
+                        )
+
+                        def publish_global():
+                            if checkpoint.is_done("global"):
+                                return checkpoint.get("global")
+                            dataset = dataset_generator.generate_global_dataset(
+                                resource_folder,
+                                standardised_global,
+                                standardised_global_trend,
+                                global_date_range,
+                            )
+                            dataset.add_country_locations(countries_with_data)
+                            if delta.has_previous():
+                                delta.add_changes_resource(
+                                    dataset,
+                                    resource_folder,
+                                    "global",
+                                    configuration["headers"],
+                                )
+                            update_dataset(dataset)
+
+                            time_period = dataset.get_time_period()
+                            info = {
+                                "dataset_id": dataset["id"],
+                                "resource_ids": [
+                                    x["id"] for x in dataset.get_resources()
+                                ],
+                                "startdate": time_period["startdate"].isoformat(),
+                                "enddate": time_period["enddate"].isoformat(),
+                            }
+                            checkpoint.done("global", **info)
+                            return info
+
+                        def publish_hapi():
+                            info = global_future.result()
+                            rows = hapi_output.bind_ids(
+                                info["dataset_id"], info["resource_ids"]
+                            )
+                            if delta_file:
+                                delta.compare("hapi_poverty_rate", rows)
+                            if not checkpoint.is_done("hapi"):
+                                hapi_dataset_generator = HAPIDatasetGenerator(
+                                    configuration, rows, compressor
+                                )
+                                dataset = hapi_dataset_generator.generate_poverty_rate_dataset(
+                                    resource_folder
+                                )
+                                dataset.add_country_locations(countries_with_data)
+                                dataset.set_time_period(
+                                    info["startdate"], info["enddate"]
+                                )
+                                if delta.has_previous():
+                                    delta.add_changes_resource(
+                                        dataset,
+                                        resource_folder,
+                                        "hapi",
+                                        configuration["hapi_dataset"]["resource"][
+                                            "headers"
+                                        ],
+                                    )
+                                update_dataset(dataset, "hdx_hapi_dataset_static.yaml")
+                                checkpoint.done("hapi")
+                            return rows
 
+                        # the global and HAPI datasets are published in the background
+                        # while the HAPI rows are generated and countries published.
+                        # Only the ids in the HAPI rows wait on the global dataset.
+                        global_future = executor.submit(
+                            run_stage, "global dataset", publish_global
+                        )
+                        background_futures.append(global_future)
+                        hapi_output.generate_rows()
+                        hapi_future = executor.submit(
+                            run_stage, "hapi dataset", publish_hapi
+                        )
+                        background_futures.append(hapi_future)
+
+                    stage("country datasets")
+                    if create_country_datasets:
+                        fingerprints = Fingerprints(fingerprints_file)
+                        unchanged = []
+                        changed = {}
+                        for countryiso3 in sorted(standardised_countries):
+                            fingerprint = fingerprints.calculate(
+                                standardised_countries[countryiso3],
+                                standardised_countries_trend.get(countryiso3, {}),
+                                date_ranges[countryiso3],
+                                dataset_generator.get_showcase_url(countryiso3),
+                                config_hash,
+                            )
+                            if fingerprints.is_unchanged(countryiso3, fingerprint):
+                                unchanged.append(countryiso3)
+                            else:
+                                changed[countryiso3] = fingerprint
+                        if shard_folder:
+                            queue = WorkQueue(shard_folder, lease_seconds)
+                            # only an unfinished queue for the same run and the same
+                            # changed countries is resumed
+                            queue_key = hash_objects(run_hash, changed)
+                            if not queue.reset(queue_key):
+                                # the rows are written once for all the workers
+                                write_tables(
+                                    join(shard_folder, tables_filename),
+                                    {
+                                        "standardised_mpi": {
+                                            countryiso3: standardised_countries[
+                                                countryiso3
+                                            ]
+                                            for countryiso3 in changed
+                                        },
+                                        "standardised_trends": {
+                                            countryiso3: standardised_countries_trend[
+                                                countryiso3
+                                            ]
+                                            for countryiso3 in changed
+                                            if countryiso3
+                                            in standardised_countries_trend
+                                        },
+                                    },
+                                )
+                                for countryiso3, fingerprint in changed.items():
+                                    payload = (date_ranges[countryiso3], fingerprint)
+                                    queue.add(countryiso3, payload)
+                                showcase_links = dataset_generator.get_showcase_links()
+                                queue.mark_ready(
+                                    queue_key,
+                                    {"batch": batch, "showcase_links": showcase_links},
+                                )
+                            # the coordinator publishes countries alongside the workers
+                            work_queue(queue)
+                            for countryiso3, result in queue.get_results().items():
+                                fingerprints.update(countryiso3, result["fingerprint"])
+                        else:
+                            for countryiso3, fingerprint in changed.items():
+                                publish_country(
+                                    countryiso3,
+                                    standardised_countries[countryiso3],
+                                    standardised_countries_trend.get(countryiso3, {}),
+                                    date_ranges[countryiso3],
+                                )
+                                fingerprints.update(countryiso3, fingerprint)
+                        if unchanged:
+                            logger.info(
+                                f"Skipped {len(unchanged)} unchanged countries: "
+                                f"{', '.join(unchanged)}"
+                            )
+
+                    if hapi_future:
+                        rows = hapi_future.result()
+                    else:
+                        rows = {}
+                    if sqlite_file and countries:
+                        # the database is for all countries so isn't replaced
+                        # with a subset, as for the global and HAPI datasets
+                        logger.info("Not exporting to SQLite for a subset of countries")
+                    elif sqlite_file:
+                        sqlite_export = SQLiteExport(configuration, sqlite_file)
+                        sqlite_export.write(
+                            standardised_global, standardised_global_trend, rows
+                        )
+                    # rows are only stored once the whole run has succeeded so that
+                    # a failed run is compared with the same rows again
+                    if delta_file and delta:
+                        if delta.has_previous():
+                            logger.info(
+                                f"Rows changed since previous run: {delta.get_summary()}"
+                            )
+                        delta.save()
+                    checkpoint.complete()
+
+            if compressor:
+                compressor.shutdown()
+            if row_budget:
+                logger.info(f"Spilled {row_budget.spills} sorted runs to disk")
+                row_budget.cleanup()
+
+    logger.info(f"Peak RSS: {getrusage(RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
     logger.info("HDX Scraper OPHI pipeline completed!")
 
 
 if __name__ == "__main__":
+    from hdx.facades.infer_arguments import facade
+    from hdx.utilities.easy_logging import setup_logging
+    from hdx.utilities.path import script_dir_plus_file
+
+    setup_logging()
     facade(
         main,
         user_agent_config_yaml=join(expanduser("~"), ".useragents.yaml"),
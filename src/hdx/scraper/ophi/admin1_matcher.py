@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import threading
+from collections import defaultdict
+from collections.abc import Iterable
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from hdx.location.adminlevel import AdminLevel
+
+
+class Admin1Matcher:
+    """Matches admin 1 names to p-codes a country at a time, once for each distinct
+    name rather than for every row it appears in. Matches are kept so that names
+    repeated across sheets and releases are only matched once. Older releases
+    are read in threads that share a matcher, so matching is done under a lock as
+    AdminLevel keeps the names it matched and failed to match."""
+
+    def __init__(self, adminone: AdminLevel) -> None:
+        self._adminone = adminone
+        self._lock = threading.Lock()
+        self._pcodes = {}
+
+    def match(self, names: Iterable[tuple[str, str]]) -> dict[tuple[str, str], str]:
+        names = set(names)
+        with self._lock:
+            country_names = defaultdict(set)
+            for key in names:
+                if key not in self._pcodes:
+                    countryiso3, name = key
+                    country_names[countryiso3].add(name)
+            for countryiso3 in sorted(country_names):
+                for name in sorted(country_names[countryiso3]):
+                    pcode, _ = self._adminone.get_pcode(countryiso3, name)
+                    self._pcodes[(countryiso3, name)] = pcode
+            return {key: self._pcodes[key] for key in names}
+
+    def no_matched(self) -> int:
+        with self._lock:
+            return len(self._pcodes)
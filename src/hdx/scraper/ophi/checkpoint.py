@@ -0,0 +1,70 @@
+import json
+import logging
+import threading
+from os import fsync, remove
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """Journal of completed publishing steps. Entries only count if they were
+    recorded against the same input hash, so changed inputs mean a full run. The
+    journal is emptied once a run completes so that only failed runs resume."""
+
+    def __init__(self, path: str | None, inputs_hash: str) -> None:
+        self._path = path
+        self._inputs_hash = inputs_hash
+        self._steps = {}
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self._path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            lines = []
+        valid_lines = []
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # a partly written last line from a crashed run
+                continue
+            if entry["inputs_hash"] != self._inputs_hash:
+                continue
+            self._steps[entry["step"]] = entry["info"]
+            valid_lines.append(line)
+        if self._steps:
+            logger.info(f"Resuming after {len(self._steps)} completed steps")
+        # rewrite the journal so that it only holds entries for these inputs
+        with open(self._path, "w") as f:
+            f.writelines(valid_lines)
+
+    def is_done(self, step: str) -> bool:
+        return step in self._steps
+
+    def get(self, step: str) -> dict:
+        return self._steps[step]
+
+    def done(self, step: str, **info) -> None:
+        self._steps[step] = info
+        if not self._path:
+            return
+        entry = {"inputs_hash": self._inputs_hash, "step": step, "info": info}
+        # steps can complete in the background while countries are published
+        with self._lock, open(self._path, "a") as f:
+            f.write(f"{json.dumps(entry)}\n")
+            f.flush()
+            fsync(f.fileno())
+
+    def complete(self) -> None:
+        with self._lock:
+            self._steps = {}
+            if not self._path:
+                return
+            try:
+                remove(self._path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import gzip
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from os.path import basename, join
+from shutil import copyfileobj
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from hdx.data.dataset import Dataset
+    from hdx.data.resource import Resource
+
+logger = logging.getLogger(__name__)
+
+# compression: (file suffix, HDX format)
+compressions = {
+    "gzip": (".gz", "gzip"),
+    "zstd": (".zst", "zst"),
+}
+chunk_size = 1024 * 1024
+
+
+def get_compressed_path(path: str, compression: str, folder: str | None = None) -> str:
+    # the copy is written next to the file unless a folder is given
+    suffix, _ = compressions[compression]
+    compressed_path = f"{path}{suffix}"
+    if folder:
+        compressed_path = join(folder, basename(compressed_path))
+    return compressed_path
+
+
+def compress_file(path: str, compression: str, folder: str | None = None) -> str:
+    compressed_path = get_compressed_path(path, compression, folder)
+    with open(path, "rb") as input, open(compressed_path, "wb") as output:
+        if compression == "gzip":
+            # no filename or timestamp in the header so an unchanged file compresses
+            # to the same bytes and HDX can skip uploading it
+            with gzip.GzipFile(
+                filename="", mode="wb", fileobj=output, mtime=0
+            ) as gzip_output:
+                copyfileobj(input, gzip_output, chunk_size)
+        else:
+            import zstandard
+
+            zstandard.ZstdCompressor().copy_stream(
+                input, output, read_size=chunk_size, write_size=chunk_size
+            )
+    return compressed_path
+
+
+class Compressor:
+    """Compresses files in background threads so that compression overlaps with
+    generating the other datasets. A dataset's compressed copies are only waited
+    on just before it is uploaded."""
+
+    def __init__(
+        self, compression: str, folder: str | None = None, max_workers: int = 4
+    ) -> None:
+        if compression not in compressions:
+            raise ValueError(
+                f"Compression must be one of {', '.join(compressions)} not {compression}!"
+            )
+        if compression == "zstd":
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                raise ImportError(
+                    "zstd compression needs the zstd extra to be installed: "
+                    "pip install hdx-scraper-ophi[zstd]"
+                )
+        from hdx.data.resource import Resource
+
+        # checked before any work is done as set_format fails on unknown formats
+        _, format = compressions[compression]
+        self.format = Resource.get_mapped_format(format)
+        if not self.format:
+            raise ValueError(
+                f"HDX does not accept {format} resources so {compression} "
+                f"compression cannot be used!"
+            )
+        self.compression = compression
+        self._folder = folder
+        self._executor = ThreadPoolExecutor(max_workers, "compress")
+        self._futures: dict[str, Future] = {}
+
+    def submit(self, path: str) -> str:
+        compressed_path = get_compressed_path(path, self.compression, self._folder)
+        if compressed_path not in self._futures:
+            self._futures[compressed_path] = self._executor.submit(
+                compress_file, path, self.compression, self._folder
+            )
+        return compressed_path
+
+    def add_compressed_resources(
+        self, dataset: Dataset, resources: list[Resource]
+    ) -> None:
+        from hdx.data.resource import Resource
+
+        # all the copies are compressed at once and waited on by wait
+        for resource in resources:
+            compressed_path = self.submit(resource.get_file_to_upload())
+            resourcedata = {
+                "name": f"{resource['name']} ({self.compression})",
+                "description": resource["description"],
+            }
+            if resource.get("p_coded"):
+                resourcedata["p_coded"] = True
+            compressed_resource = Resource(resourcedata)
+            compressed_resource.set_format(self.format)
+            compressed_resource.set_file_to_upload(compressed_path)
+            dataset.add_update_resource(compressed_resource)
+            logger.info(f"Added {self.compression} copy of {resource['name']}")
+
+    def wait(self, dataset: Dataset) -> None:
+        # raises any error from compressing the dataset's copies
+        for resource in dataset.get_resources():
+            future = self._futures.pop(resource.get_file_to_upload(), None)
+            if future:
+                future.result()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown()
+        self._futures = {}
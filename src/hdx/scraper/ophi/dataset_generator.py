@@ -1,16 +1,32 @@
+from __future__ import annotations
+
 import logging
-from collections.abc import Iterable
+from collections.abc import Mapping
+from copy import deepcopy
+from functools import cache
+from typing import TYPE_CHECKING
+
+from hdx.scraper.ophi.partitioned_writer import write_partitioned
+from hdx.scraper.ophi.rowstore import sorted_rows
+
+if TYPE_CHECKING:
+    from hdx.api.configuration import Configuration
+    from hdx.data.dataset import Dataset
+    from hdx.data.showcase import Showcase
+    from hdx.utilities.retriever import Retrieve
 
-from hdx.api.configuration import Configuration
-from hdx.data.dataset import Dataset
-from hdx.data.resource import Resource
-from hdx.data.showcase import Showcase
-from hdx.utilities.retriever import Retrieve
-from slugify import slugify
+    from hdx.scraper.ophi.compression import Compressor
 
 logger = logging.getLogger(__name__)
 
 
+@cache
+def load_static_metadata(path: str) -> dict:
+    from hdx.utilities.loader import load_yaml
+
+    return load_yaml(path)
+
+
 class DatasetGenerator:
     tags = [
         "development",
@@ -28,16 +44,16 @@ class DatasetGenerator:
     def __init__(
         self,
         configuration: Configuration,
-        mpi_national_path: str,
-        mpi_subnational_path: str,
-        trend_path: str,
+        source_paths: dict[str, str] | None,
+        compressor: Compressor | None = None,
     ) -> None:
         self._configuration = configuration
         self._showcase_links = {}
-        self._mpi_national_path = mpi_national_path
-        self._mpi_subnational_path = mpi_subnational_path
-        self._trend_path = trend_path
+        self._source_paths = source_paths
         self._headers = configuration["headers"]
+        self._manifest = {}
+        self._compressor = compressor
+        self._template = None
 
     def load_showcase_links(self, retriever: Retrieve) -> None:
         url = self._configuration["showcaseinfo"]["urls"]
@@ -45,53 +61,118 @@ class DatasetGenerator:
         for row in iterator:
             self._showcase_links[row["Country code"]] = row["URL"]
 
+    def get_showcase_url(self, countryiso3: str) -> str | None:
+        return self._showcase_links.get(countryiso3)
+
+    def get_showcase_links(self) -> dict[str, str]:
+        return self._showcase_links
+
+    def set_showcase_links(self, showcase_links: dict[str, str]) -> None:
+        self._showcase_links = showcase_links
+
+    def write_resources(
+        self,
+        folder: str,
+        standardised_rows: Mapping,
+        standardised_trend_rows: Mapping,
+    ) -> dict:
+        for table, rows, suffix in (
+            ("standardised_mpi", standardised_rows, "mpi.csv"),
+            ("standardised_trends", standardised_trend_rows, "mpi_trends.csv"),
+        ):
+            self._manifest[table] = write_partitioned(
+                folder, suffix, self._headers, sorted_rows(rows)
+            )
+            logger.info(f"Wrote {len(self._manifest[table])} {table} files")
+            # compress the large global file while the other datasets are generated
+            global_path = self._manifest[table].get(f"global_{suffix}")
+            if self._compressor and global_path:
+                self._compressor.submit(global_path)
+        return self._manifest
+
     def generate_resource(
         self,
         dataset: Dataset,
+        table: str,
         resource_name: str,
-        resource_description: str,
-        rows: Iterable,
+        rows: Mapping,
         folder: str,
         filename: str,
         p_coded: bool = None,
     ) -> bool:
         resourcedata = {
             "name": resource_name,
-            "description": resource_description,
+            "description": self._configuration["resource_descriptions"][table],
         }
         if p_coded:
             resourcedata["p_coded"] = p_coded
 
-        success, results = dataset.generate_resource(
-            folder,
-            filename,
-            rows,
-            resourcedata,
-            self._headers,
-        )
-        return success
+        paths = self._manifest.get(table)
+        if paths is None:
+            success, results = dataset.generate_resource(
+                folder,
+                filename,
+                sorted_rows(rows),
+                resourcedata,
+                self._headers,
+            )
+            return success
+        # already written by write_resources
+        from hdx.data.resource import Resource
+
+        path = paths.get(filename)
+        if path is None:
+            logger.error(f"No data rows in {filename}!")
+            return False
+        resource = Resource(resourcedata)
+        resource.set_format("csv")
+        resource.set_file_to_upload(path)
+        dataset.add_update_resource(resource)
+        return True
 
     def _slugified_name(self, name: str) -> str:
+        from slugify import slugify
+
         return slugify(name).lower()
 
+    def get_template(self) -> dict:
+        # metadata shared by every dataset, with tags only validated once
+        if self._template is None:
+            from hdx.data.dataset import Dataset
+
+            template = Dataset()
+            template.set_maintainer("196196be-6037-4488-8b71-d786adf4c081")
+            template.set_organization("00547685-9ded-4d69-9ca5-47d5278ead7c")
+            template.add_tags(self.tags)
+            template.set_subnational(True)
+            self._template = template.data
+        return self._template
+
     def generate_dataset_metadata(
         self,
         title: str,
         name: str,
     ) -> Dataset | None:
+        from hdx.data.dataset import Dataset
+
         logger.info(f"Creating dataset: {title}")
         dataset = Dataset(
             {
                 "name": self._slugified_name(name),
                 "title": title,
+                **deepcopy(self.get_template()),
             }
         )
-        dataset.set_maintainer("196196be-6037-4488-8b71-d786adf4c081")
-        dataset.set_organization("00547685-9ded-4d69-9ca5-47d5278ead7c")
-        dataset.add_tags(self.tags)
-        dataset.set_subnational(True)
         return dataset
 
+    @staticmethod
+    def update_from_static_metadata(dataset: Dataset, path: str) -> None:
+        # as Dataset.update_from_yaml but each file is only read once per run
+        from hdx.utilities.dictandlist import merge_two_dictionaries
+
+        merge_two_dictionaries(dataset.data, deepcopy(load_static_metadata(path)))
+        dataset.separate_resources()
+
     @staticmethod
     def get_title(countryname: str) -> str:
         return f"{countryname} Multidimensional Poverty Index"
@@ -105,6 +186,8 @@ class DatasetGenerator:
         countryiso3: str,
         countryname: str,
     ) -> Showcase | None:
+        from hdx.data.showcase import Showcase
+
         url = self._showcase_links.get(countryiso3)
         if not url:
             return None
@@ -137,15 +220,14 @@ class DatasetGenerator:
         name = self.get_name(countryname)
         dataset = self.generate_dataset_metadata(title, name)
         dataset.set_time_period(date_range["start"], date_range["end"])
-        resource_descriptions = self._configuration["resource_descriptions"]
 
         resource_name = f"{countryname} MPI and Partial Indices"
         filename = f"{countryiso3}_mpi.csv"
         success = self.generate_resource(
             dataset,
+            "standardised_mpi",
             resource_name,
-            resource_descriptions["standardised_mpi"],
-            (standardised_rows[key] for key in sorted(standardised_rows)),
+            standardised_rows,
             folder,
             filename,
             p_coded=True,
@@ -158,9 +240,9 @@ class DatasetGenerator:
         filename = f"{countryiso3}_mpi_trends.csv"
         success = self.generate_resource(
             dataset,
+            "standardised_trends",
             resource_name,
-            resource_descriptions["standardised_trends"],
-            (standardised_trend_rows[key] for key in sorted(standardised_trend_rows)),
+            standardised_trend_rows,
             folder,
             filename,
             p_coded=True,
@@ -174,6 +256,8 @@ class DatasetGenerator:
         standardised_trend_rows: dict,
         date_range: dict,
     ) -> Dataset | None:
+        from hdx.data.resource import Resource
+
         if not standardised_rows:
             return None
         dataset = self.generate_dataset(
@@ -185,33 +269,19 @@ class DatasetGenerator:
             date_range,
         )
         dataset.set_expected_update_frequency("As needed")
+        csv_resources = list(dataset.get_resources())
 
-        resource_descriptions = self._configuration["resource_descriptions"]
-        resourcedata = {
-            "name": "MPI and Partial Indices National Database",
-            "description": resource_descriptions["mpi_national"],
-        }
-        resource = Resource(resourcedata)
-        resource.set_format("xlsx")
-        resource.set_file_to_upload(self._mpi_national_path)
-        dataset.add_update_resource(resource)
-
-        resourcedata = {
-            "name": "MPI and Partial Indices Subnational Database",
-            "description": resource_descriptions["mpi_subnational"],
-        }
-        resource = Resource(resourcedata)
-        resource.set_format("xlsx")
-        resource.set_file_to_upload(self._mpi_subnational_path)
-        dataset.add_update_resource(resource)
-
-        resourcedata = {
-            "name": "Trends Over Time MPI Database",
-            "description": resource_descriptions["trends"],
-        }
-        resource = Resource(resourcedata)
-        resource.set_format("xlsx")
-        resource.set_file_to_upload(self._trend_path)
-        dataset.add_update_resource(resource)
+        format = self._configuration["datasetinfo"]["format"]
+        for source, resource_config in self._configuration["source_resources"].items():
+            resourcedata = {
+                "name": resource_config["name"],
+                "description": resource_config["description"],
+            }
+            resource = Resource(resourcedata)
+            resource.set_format(format)
+            resource.set_file_to_upload(self._source_paths[source])
+            dataset.add_update_resource(resource)
 
+        if self._compressor:
+            self._compressor.add_compressed_resources(dataset, csv_resources)
         return dataset
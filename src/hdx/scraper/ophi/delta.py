@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import pickle
+import struct
+from collections.abc import Iterator, Mapping, Sequence
+from os import SEEK_END, replace
+from os.path import join
+from typing import TYPE_CHECKING
+
+from hdx.scraper.ophi.partitioned_writer import open_csv
+from hdx.scraper.ophi.rowstore import sorted_items
+
+if TYPE_CHECKING:
+    from hdx.api.configuration import Configuration
+    from hdx.data.dataset import Dataset
+
+logger = logging.getLogger(__name__)
+
+change_types = ("added", "removed", "changed")
+# the offset of the index of row hashes at the end of the file
+trailer = struct.Struct("<Q")
+
+
+def hash_row(row: dict) -> str:
+    return hashlib.sha256(
+        json.dumps(row, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class RowDelta:
+    """Keyed rows of each table kept from the previous run, compared with this
+    run's rows by joining on the key and comparing row hashes to find the rows
+    added, removed and changed since. Only the hashes are held in memory: each
+    table's rows are stored sorted by key and streamed back to find the removed
+    rows. The rows are only stored for the next run when save is called so that
+    a failed run is compared again."""
+
+    def __init__(self, configuration: Configuration, path: str | None) -> None:
+        self._configuration = configuration
+        self._path = path
+        # table to (key to hash, offset of the sorted rows in the file)
+        self._previous = None
+        # table to (key to hash, rows)
+        self._current = {}
+        self.changes = {}
+        if path:
+            try:
+                with open(path, "rb") as f:
+                    f.seek(-trailer.size, SEEK_END)
+                    (offset,) = trailer.unpack(f.read(trailer.size))
+                    f.seek(offset)
+                    self._previous = pickle.load(f)
+            except FileNotFoundError:
+                logger.info(f"No previous rows found in {path}")
+
+    def has_previous(self) -> bool:
+        return self._previous is not None
+
+    def read_previous(self, offset: int) -> Iterator[tuple[tuple, dict]]:
+        with open(self._path, "rb") as f:
+            f.seek(offset)
+            while True:
+                item = pickle.load(f)
+                if item is None:
+                    return
+                yield item
+
+    def compare(self, table: str, rows: Mapping) -> dict[str, list[dict]]:
+        hashes = {}
+        changes = {change_type: [] for change_type in change_types}
+        previous_hashes, offset = (self._previous or {}).get(table, ({}, None))
+        for key, row in sorted_items(rows):
+            digest = hash_row(row)
+            hashes[key] = digest
+            previous_digest = previous_hashes.get(key)
+            if previous_digest is None:
+                changes["added"].append(row)
+            elif previous_digest != digest:
+                changes["changed"].append(row)
+        self._current[table] = (hashes, rows)
+        if offset is not None and previous_hashes.keys() - hashes.keys():
+            for key, row in self.read_previous(offset):
+                if key not in hashes:
+                    changes["removed"].append(row)
+        self.changes[table] = changes
+        return changes
+
+    def get_summary(self) -> str:
+        return "; ".join(
+            f"{table}: "
+            + ", ".join(
+                f"{len(changes[change_type])} {change_type}"
+                for change_type in change_types
+            )
+            for table, changes in self.changes.items()
+        )
+
+    def write_changes(
+        self, path: str, headers: Sequence[str], tables: Sequence[str]
+    ) -> int:
+        """Write the changes to the given tables to one CSV with the table and
+        type of change before the row. Returns the number of rows written."""
+        file, writer = open_csv(path, ["Table", "Change", *headers])
+        no_rows = 0
+        with file:
+            for table in tables:
+                changes = self.changes[table]
+                for change_type in change_types:
+                    for row in changes[change_type]:
+                        writer.writerow(
+                            [table, change_type]
+                            + [row.get(header) for header in headers]
+                        )
+                        no_rows += 1
+        return no_rows
+
+    def add_changes_resource(
+        self, dataset: Dataset, folder: str, name: str, headers: Sequence[str]
+    ) -> None:
+        from hdx.data.resource import Resource
+
+        resource_config = self._configuration["changes_resources"][name]
+        path = join(folder, resource_config["filename"])
+        no_rows = self.write_changes(path, headers, resource_config["tables"])
+        logger.info(f"Wrote {no_rows} changed rows to {resource_config['filename']}")
+        resourcedata = {
+            "name": resource_config["name"],
+            "description": self._configuration["resource_descriptions"]["changes"],
+        }
+        resource = Resource(resourcedata)
+        resource.set_format("csv")
+        resource.set_file_to_upload(path)
+        dataset.add_update_resource(resource)
+
+    def save(self) -> None:
+        if not self._path:
+            return
+        # each table's rows are followed by None and the index of hashes is last
+        temp_path = f"{self._path}.tmp"
+        index = {}
+        with open(temp_path, "wb") as f:
+            for table, (hashes, rows) in self._current.items():
+                index[table] = (hashes, f.tell())
+                for item in sorted_items(rows):
+                    pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(None, f, pickle.HIGHEST_PROTOCOL)
+            offset = f.tell()
+            pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+            f.write(trailer.pack(offset))
+        replace(temp_path, self._path)
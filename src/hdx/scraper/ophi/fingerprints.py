@@ -0,0 +1,55 @@
+import hashlib
+import json
+import logging
+from os import replace
+
+from hdx.scraper.ophi._version import __version__
+from hdx.scraper.ophi.rowstore import sorted_rows
+
+logger = logging.getLogger(__name__)
+
+
+class Fingerprints:
+    """Per-country hashes of everything that goes into a country's dataset and
+    showcase, including the configuration and static metadata files, stored
+    between runs so that unchanged countries can be skipped"""
+
+    def __init__(self, path: str | None) -> None:
+        self._path = path
+        self._fingerprints = {}
+        if path:
+            try:
+                with open(path) as f:
+                    self._fingerprints = json.load(f)
+            except FileNotFoundError:
+                logger.info(f"No fingerprints found in {path}")
+
+    @staticmethod
+    def calculate(
+        standardised_rows: dict,
+        standardised_trend_rows: dict,
+        date_range: dict,
+        showcase_url: str | None,
+        config_hash: str,
+    ) -> str:
+        hasher = hashlib.sha256(__version__.encode())
+        hasher.update(config_hash.encode())
+        for rows in (standardised_rows, standardised_trend_rows):
+            for row in sorted_rows(rows):
+                hasher.update(json.dumps(row, sort_keys=True, default=str).encode())
+            hasher.update(b"\n")
+        hasher.update(json.dumps(date_range, sort_keys=True, default=str).encode())
+        hasher.update((showcase_url or "").encode())
+        return hasher.hexdigest()
+
+    def is_unchanged(self, countryiso3: str, fingerprint: str) -> bool:
+        return self._fingerprints.get(countryiso3) == fingerprint
+
+    def update(self, countryiso3: str, fingerprint: str) -> None:
+        self._fingerprints[countryiso3] = fingerprint
+        if not self._path:
+            return
+        temp_path = f"{self._path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self._fingerprints, f, indent=2, sort_keys=True)
+        replace(temp_path, self._path)
@@ -1,7 +1,15 @@
+from __future__ import annotations
+
 from logging import getLogger
+from typing import TYPE_CHECKING
+
+from hdx.scraper.ophi.rowstore import sorted_rows
 
-from hdx.api.configuration import Configuration
-from hdx.data.dataset import Dataset
+if TYPE_CHECKING:
+    from hdx.api.configuration import Configuration
+    from hdx.data.dataset import Dataset
+
+    from hdx.scraper.ophi.compression import Compressor
 
 logger = getLogger(__name__)
 
@@ -11,12 +19,16 @@ class HAPIDatasetGenerator:
         self,
         configuration: Configuration,
         rows: dict,
+        compressor: Compressor | None = None,
     ) -> None:
         self._configuration = configuration["hapi_dataset"]
         self._rows = rows
+        self._compressor = compressor
         self.slugified_name = self._configuration["name"]
 
     def generate_dataset(self) -> tuple[Dataset, dict]:
+        from hdx.data.dataset import Dataset
+
         title = self._configuration["title"]
         logger.info(f"Creating dataset: {title}")
         dataset = Dataset(
@@ -58,13 +70,15 @@ class HAPIDatasetGenerator:
         success, _ = dataset.generate_resource(
             folder,
             f"{filename}.csv",
-            (self._rows[key] for key in sorted(self._rows)),
+            sorted_rows(self._rows),
             resourcedata,
             headers,
         )
         if success is False:
             logger.warning(f"{resource_name} has no data!")
             return None
+        if self._compressor:
+            self._compressor.add_compressed_resources(dataset, dataset.get_resources())
 
         dataset.preview_off()
         return dataset
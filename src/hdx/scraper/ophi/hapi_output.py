@@ -1,12 +1,60 @@
+from __future__ import annotations
+
+from collections.abc import Iterator, Mapping
 from logging import getLogger
+from typing import TYPE_CHECKING
+
+from hdx.scraper.ophi.rowstore import SortedMapping, sorted_rows
 
-from hdx.api.configuration import Configuration
-from hdx.location.adminlevel import AdminLevel
-from hdx.location.country import Country
+if TYPE_CHECKING:
+    from hdx.api.configuration import Configuration
+    from hdx.location.adminlevel import AdminLevel
+
+    from hdx.scraper.ophi.rowstore import RowBudget
 
 logger = getLogger(__name__)
 
 
+class BoundRows(SortedMapping):
+    """HAPI rows in key order with the dataset and resource ids filled in as each
+    row is read. This lets the rows be generated before the global dataset they
+    refer to has been created."""
+
+    def __init__(self, rows: Mapping, dataset_id: str, resource_ids: list[str]):
+        self._rows = rows
+        self._dataset_id = dataset_id
+        self._resource_ids = resource_ids
+
+    def bind(self, row: dict) -> dict:
+        bound_row = dict(row)
+        bound_row["dataset_hdx_id"] = self._dataset_id
+        bound_row["resource_hdx_id"] = self._resource_ids[row["resource_hdx_id"]]
+        return bound_row
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __iter__(self) -> Iterator[tuple]:
+        if isinstance(self._rows, SortedMapping):
+            return iter(self._rows)
+        return iter(sorted(self._rows))
+
+    def __getitem__(self, key: tuple) -> dict:
+        return self.bind(self._rows[key])
+
+    def items(self) -> Iterator[tuple[tuple, dict]]:
+        if isinstance(self._rows, SortedMapping):
+            for key, row in self._rows.items():
+                yield key, self.bind(row)
+        else:
+            for key in sorted(self._rows):
+                yield key, self.bind(self._rows[key])
+
+    def values(self) -> Iterator[dict]:
+        for row in sorted_rows(self._rows):
+            yield self.bind(row)
+
+
 class HAPIOutput:
     def __init__(
         self,
@@ -14,14 +62,20 @@ class HAPIOutput:
         adminone: AdminLevel,
         standardised_rows: dict,
         standardised_trend_rows: dict,
+        row_budget: RowBudget | None = None,
     ) -> None:
         self._configuration = configuration
         self._adminone = adminone
         self._standardised_rows = standardised_rows
         self._standardised_trend_rows = standardised_trend_rows
-        self._rows = {}
+        if row_budget is None:
+            self._rows = {}
+        else:
+            self._rows = row_budget.new_store()
+
+    def create_rows(self, rows: dict, resource_index: int) -> None:
+        from hdx.location.country import Country
 
-    def create_rows(self, rows: dict, dataset_id: str, resource_id: str) -> None:
         for row in rows.values():
             output_row = {}
             countryiso3 = row["Country ISO3"]
@@ -53,8 +107,9 @@ class HAPIOutput:
             output_row["in_severe_poverty"] = row["In Severe Poverty"]
             output_row["reference_period_start"] = row["Start Date"]
             output_row["reference_period_end"] = row["End Date"]
-            output_row["dataset_hdx_id"] = dataset_id
-            output_row["resource_hdx_id"] = resource_id
+            # the ids are bound once the global dataset has been created
+            output_row["dataset_hdx_id"] = None
+            output_row["resource_hdx_id"] = resource_index
             key = (
                 countryiso3,
                 output_row["provider_admin1_name"],
@@ -63,11 +118,17 @@ class HAPIOutput:
             )
             self._rows[key] = output_row
 
+    def generate_rows(self) -> None:
+        self.create_rows(self._standardised_rows, 0)
+        self.create_rows(self._standardised_trend_rows, 1)
+
+    def bind_ids(self, dataset_id: str, resource_ids: list[str]) -> BoundRows:
+        return BoundRows(self._rows, dataset_id, resource_ids)
+
     def process(
         self,
         dataset_id: str,
         resource_ids: list[str],
-    ) -> dict | None:
-        self.create_rows(self._standardised_rows, dataset_id, resource_ids[0])
-        self.create_rows(self._standardised_trend_rows, dataset_id, resource_ids[1])
-        return self._rows
+    ) -> BoundRows:
+        self.generate_rows()
+        return self.bind_ids(dataset_id, resource_ids)
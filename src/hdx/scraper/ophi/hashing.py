@@ -0,0 +1,20 @@
+import hashlib
+import pickle
+from collections.abc import Iterable
+from typing import Any
+
+
+def hash_files(paths: Iterable[str]) -> str:
+    hasher = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            while chunk := f.read(1048576):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def hash_objects(*objects: Any) -> str:
+    hasher = hashlib.sha256()
+    for obj in objects:
+        hasher.update(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+    return hasher.hexdigest()
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import logging
+import threading
+from collections.abc import Iterator
+from copy import deepcopy
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from hdx.api.configuration import Configuration
+
+logger = logging.getLogger(__name__)
+
+# the reads create_in_hdx makes to find whether a dataset or showcase exists
+read_actions = ("package_show", "ckanext_showcase_show")
+
+
+class HDXIndex:
+    """Existing datasets (with their resources) and showcases fetched from HDX in
+    a few paginated searches at the start of a run. While in use, the reads that
+    create_in_hdx makes to find whether a dataset or showcase exists are answered
+    from it instead of with a call each. An entry only answers one read as it is
+    out of date once the dataset or showcase has been updated."""
+
+    def __init__(self, configuration: Configuration, page_size: int = 1000) -> None:
+        self._configuration = configuration
+        self._page_size = page_size
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.searches = 0
+        self.answered = 0
+
+    def search(self, fq: str) -> Iterator[dict]:
+        # sorted by a field that doesn't change so that pages don't overlap
+        start = 0
+        while True:
+            result = self._configuration.call_remoteckan(
+                "package_search",
+                {
+                    "fq": fq,
+                    "rows": self._page_size,
+                    "start": start,
+                    "sort": "name asc",
+                    "include_private": True,
+                },
+            )
+            self.searches += 1
+            packages = result["results"]
+            yield from packages
+            start += len(packages)
+            if not packages or start >= result["count"]:
+                return
+
+    def add(self, action: str, package: dict) -> None:
+        entry = [package]
+        self._entries[(action, package["id"])] = entry
+        self._entries[(action, package["name"])] = entry
+
+    def prefetch(self, datasets_fq: str, showcases_fq: str) -> None:
+        no_datasets = 0
+        for package in self.search(datasets_fq):
+            self.add("package_show", package)
+            no_datasets += 1
+        no_showcases = 0
+        for package in self.search(f"dataset_type:showcase AND ({showcases_fq})"):
+            self.add("ckanext_showcase_show", package)
+            no_showcases += 1
+        logger.info(
+            f"Prefetched {no_datasets} datasets and {no_showcases} showcases "
+            f"from HDX in {self.searches} searches"
+        )
+
+    def pop(self, action: str, id_or_name: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.pop((action, id_or_name), None)
+            if not entry:
+                return None
+            package = entry.pop()
+            self.answered += 1
+        # the library changes what it reads
+        return deepcopy(package)
+
+    def __enter__(self) -> HDXIndex:
+        call_remoteckan = self._configuration.call_remoteckan
+
+        def call(action, data=None, *args, **kwargs):
+            if action in read_actions and data and "id" in data:
+                package = self.pop(action, data["id"])
+                if package is not None:
+                    return package
+            return call_remoteckan(action, data, *args, **kwargs)
+
+        self._configuration.call_remoteckan = call
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        del self._configuration.call_remoteckan
+        logger.info(f"Answered {self.answered} reads from the prefetched HDX index")
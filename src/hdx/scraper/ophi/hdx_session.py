@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from hdx.api.configuration import Configuration
+
+logger = logging.getLogger(__name__)
+
+# POST is included as HDX actions are all POSTs, as in the HDX library's default
+retry_methods = ("HEAD", "TRACE", "GET", "POST", "PUT", "OPTIONS", "DELETE")
+retry_statuses = (429, 500, 502, 503, 504)
+
+
+def configure_hdx_session(
+    configuration: Configuration,
+    pool_maxsize: int = 4,
+    retry_attempts: int = 5,
+    backoff_factor: float = 1,
+    backoff_jitter: float = 1,
+    backoff_max: float = 60,
+) -> None:
+    """Mount one adapter for all HDX traffic on the session the HDX library's
+    CKAN client uses, so that connections to HDX are kept alive and reused
+    between calls and every call has the same retry policy with jittered
+    backoff"""
+    from requests.adapters import HTTPAdapter
+    from urllib3.util import Retry
+
+    retries = Retry(
+        total=retry_attempts,
+        backoff_factor=backoff_factor,
+        backoff_jitter=backoff_jitter,
+        backoff_max=backoff_max,
+        status_forcelist=retry_statuses,
+        allowed_methods=retry_methods,
+        respect_retry_after_header=True,
+        raise_on_redirect=True,
+        raise_on_status=True,
+    )
+    # calls to HDX are made one at a time so only a few connections are pooled
+    adapter = HTTPAdapter(
+        max_retries=retries, pool_connections=2, pool_maxsize=pool_maxsize
+    )
+    session = configuration.get_session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    logger.info(
+        f"HDX session pools {pool_maxsize} connections and retries {retry_attempts} times"
+    )
@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+def get_endpoint(method: str, url: str) -> str:
+    # query strings are dropped so that calls to the same resource are grouped
+    parts = urlsplit(url)
+    return f"{method} {parts.netloc}{parts.path}"
+
+
+class HTTPAccounting:
+    """Counts and times every HTTP request sent through requests (which Retrieve,
+    AdminLevel and the HDX session all use) by stage and endpoint. A request that
+    urllib3 retries counts once. If given a budget, the first call beyond it raises
+    before it is sent, and the run also fails at the end in case that error was
+    caught."""
+
+    def __init__(self, budget: int | None = None) -> None:
+        self._budget = budget
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._stage = "start"
+        self._local = threading.local()
+        self._original_send = None
+        self.calls = defaultdict(Counter)
+        self.seconds = defaultdict(Counter)
+
+    @property
+    def total(self) -> int:
+        return sum(calls.total() for calls in self.calls.values())
+
+    def __enter__(self) -> "HTTPAccounting":
+        from requests.adapters import HTTPAdapter
+
+        accounting = self
+        original_send = HTTPAdapter.send
+
+        def send(adapter, request, *args, **kwargs):
+            accounting.check_budget()
+            start = time.perf_counter()
+            try:
+                return original_send(adapter, request, *args, **kwargs)
+            finally:
+                accounting.record(
+                    get_endpoint(request.method, request.url),
+                    time.perf_counter() - start,
+                )
+
+        self._original_send = original_send
+        HTTPAdapter.send = send
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        from requests.adapters import HTTPAdapter
+
+        HTTPAdapter.send = self._original_send
+        self.log_summary()
+        if exc_type is None and self._budget is not None and self._sent > self._budget:
+            raise RuntimeError(
+                f"Tried to make {self._sent} HTTP calls which exceeds budget of "
+                f"{self._budget}!"
+            )
+
+    def check_budget(self) -> None:
+        if self._budget is None:
+            return
+        with self._lock:
+            self._sent += 1
+            sent = self._sent
+        if sent > self._budget:
+            raise RuntimeError(f"HTTP call {sent} exceeds budget of {self._budget}!")
+
+    def stage(self, name: str) -> None:
+        # a stage set in another thread only applies to the calls it makes
+        if threading.current_thread() is threading.main_thread():
+            with self._lock:
+                self._stage = name
+        else:
+            self._local.stage = name
+
+    def record(self, endpoint: str, seconds: float) -> None:
+        stage = getattr(self._local, "stage", None)
+        with self._lock:
+            if stage is None:
+                stage = self._stage
+            self.calls[stage][endpoint] += 1
+            self.seconds[stage][endpoint] += seconds
+
+    def log_summary(self) -> None:
+        for stage, calls in self.calls.items():
+            seconds = self.seconds[stage]
+            logger.info(
+                f"{stage}: {calls.total()} HTTP calls taking {seconds.total():.1f}s"
+            )
+            for endpoint, no_calls in calls.most_common():
+                logger.info(f"  {endpoint}: {no_calls} ({seconds[endpoint]:.1f}s)")
+        logger.info(f"Total HTTP calls: {self.total}")
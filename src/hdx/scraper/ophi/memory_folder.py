@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import logging
+from collections.abc import Iterator
+from contextlib import contextmanager
+from os import W_OK, access, remove
+from os.path import isdir
+from pathlib import Path
+from shutil import disk_usage, rmtree
+from tempfile import mkdtemp
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from hdx.data.dataset import Dataset
+
+logger = logging.getLogger(__name__)
+
+memory_root = "/dev/shm"
+min_free_bytes = 128 * 1024 * 1024
+
+
+def get_memory_tempdir(
+    root: str = memory_root, min_free: int = min_free_bytes
+) -> str | None:
+    """Get a memory backed folder (tmpfs) to use as the temporary directory, or
+    None if there isn't one with enough free space so disk should be used"""
+    if not isdir(root) or not access(root, W_OK):
+        logger.warning(f"No memory backed folder at {root} so using disk")
+        return None
+    free = disk_usage(root).free
+    if free < min_free:
+        logger.warning(
+            f"Only {free / 1024 / 1024:.0f} MiB free in {root} so using disk"
+        )
+        return None
+    return root
+
+
+@contextmanager
+def get_resource_folder(
+    folder: str,
+    in_memory: bool,
+    prefix: str = "",
+    root: str = memory_root,
+    min_free: int = min_free_bytes,
+) -> Iterator[str]:
+    """Get the folder that generated resources are written to. In memory, this
+    is a new folder in tmpfs, removed when the run ends even if it fails unless
+    debugging, while downloads and spilled rows stay in folder on disk."""
+    tempdir = get_memory_tempdir(root, min_free) if in_memory else None
+    if tempdir is None:
+        yield folder
+        return
+    resource_folder = mkdtemp(prefix=f"{prefix}-", dir=tempdir)
+    logger.info(f"Writing resources to memory in {resource_folder}")
+    try:
+        yield resource_folder
+    finally:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Keeping resources in {resource_folder}")
+        else:
+            rmtree(resource_folder, ignore_errors=True)
+
+
+def get_files_in_folder(dataset: Dataset, folder: str) -> list[str]:
+    """Get the files to upload of a dataset's resources that were written to
+    folder, leaving out files elsewhere like saved downloads"""
+    folder = Path(folder)
+    paths = []
+    for resource in dataset.get_resources():
+        path = resource.get_file_to_upload()
+        if path and folder in Path(path).parents:
+            paths.append(path)
+    return paths
+
+
+def remove_files(paths: list[str]) -> None:
+    for path in paths:
+        try:
+            remove(path)
+        except FileNotFoundError:
+            pass
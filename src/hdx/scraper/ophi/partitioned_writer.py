@@ -0,0 +1,51 @@
+import csv
+from collections.abc import Iterable, Sequence
+from os import remove
+from os.path import join
+
+buffer_size = 1024 * 1024
+
+
+def open_csv(path: str, headers: Sequence[str]):
+    file = open(path, "w", newline="", encoding="utf-8", buffering=buffer_size)
+    writer = csv.writer(file, lineterminator="\n")
+    writer.writerow(headers)
+    return file, writer
+
+
+def write_partitioned(
+    folder: str, suffix: str, headers: Sequence[str], rows: Iterable[dict]
+) -> dict[str, str]:
+    """Write the global file and a file per country in one pass over rows that are
+    sorted by country, as keys start with the country ISO3. Returns a dictionary of
+    filename to path. Files are only written if they have data rows."""
+    filename = f"global_{suffix}"
+    global_path = join(folder, filename)
+    paths = {}
+    global_file, global_writer = open_csv(global_path, headers)
+    country_file = None
+    countryiso3 = None
+    try:
+        for row in rows:
+            values = [row.get(header) for header in headers]
+            global_writer.writerow(values)
+            if row["Country ISO3"] != countryiso3:
+                if country_file:
+                    country_file.close()
+                countryiso3 = row["Country ISO3"]
+                country_filename = f"{countryiso3}_{suffix}"
+                if country_filename in paths:
+                    raise ValueError(f"Rows for {countryiso3} are not contiguous!")
+                path = join(folder, country_filename)
+                paths[country_filename] = path
+                country_file, country_writer = open_csv(path, headers)
+            country_writer.writerow(values)
+    finally:
+        if country_file:
+            country_file.close()
+        global_file.close()
+    if not paths:
+        remove(global_path)
+        return paths
+    paths[filename] = global_path
+    return paths
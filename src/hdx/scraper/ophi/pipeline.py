@@ -1,40 +1,87 @@
+from __future__ import annotations
+
+import json
 import logging
+import pickle
+from collections.abc import Iterable, Mapping
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from importlib.metadata import version
+from itertools import chain
+from os import makedirs, replace
+from os.path import join
+from typing import TYPE_CHECKING
 
-from hdx.api.configuration import Configuration
-from hdx.location.adminlevel import AdminLevel
 from hdx.utilities.dateparse import parse_date_range
-from hdx.utilities.dictandlist import dict_of_dicts_add
-from hdx.utilities.retriever import Retrieve
 from hdx.utilities.text import number_format
 
+from hdx.scraper.ophi import admin1_matcher, sheet_layout
+from hdx.scraper.ophi.admin1_matcher import Admin1Matcher
+from hdx.scraper.ophi.hashing import hash_files, hash_objects
+from hdx.scraper.ophi.sheet_layout import SheetLayout, hash_labels, iter_header_rows
+
+if TYPE_CHECKING:
+    from hdx.api.configuration import Configuration
+    from hdx.location.adminlevel import AdminLevel
+    from hdx.utilities.retriever import Retrieve
+
+    from hdx.scraper.ophi.rowstore import RowBudget
+
 logger = logging.getLogger(__name__)
 
 
-class Pipeline:
-    headers = (
-        "MPI",
-        "Headcount Ratio",
-        "Intensity of Deprivation",
-        "Vulnerable to Poverty",
-        "In Severe Poverty",
-    )
-    timepoints = ("t0", "t1")
+def get_sources(release: dict) -> dict[str, str]:
+    # every entry of a release other than its name and layouts is a source
+    # workbook's URL
+    return {
+        source: url
+        for source, url in release.items()
+        if source not in ("name", "layouts")
+    }
 
+
+def get_source_path(layout: SheetLayout, source_paths: dict[str, str]) -> str:
+    path = source_paths.get(layout.source)
+    if path is None:
+        raise ValueError(
+            f"Layout {layout.name} reads source {layout.source} which is not in "
+            f"the release!"
+        )
+    return path
+
+
+class Pipeline:
     def __init__(
         self,
         configuration: Configuration,
         retriever: Retrieve,
         adminone: AdminLevel,
+        row_budget: RowBudget | None = None,
+        cache_folder: str | None = None,
+        countries: Iterable[str] | None = None,
     ) -> None:
         self._configuration = configuration
         self._retriever = retriever
         self._adminone = adminone
-        self._standardised_global = {}
-        self._standardised_global_trend = [{}, {}]
+        self._admin1_matcher = Admin1Matcher(adminone)
+        self._row_budget = row_budget
+        self._cache_folder = cache_folder
+        if countries:
+            self._countries = {countryiso3.upper() for countryiso3 in countries}
+        else:
+            self._countries = None
+        self._standardised_global = self.new_rows()
+        self._standardised_global_trend = []
         self._standardised_countries = {}
-        self._standardised_countries_trend = [{}, {}]
+        self._standardised_countries_trend = []
         self._date_ranges = {}
+        self._input_paths = []
+        self._release_paths = None
+
+    def new_rows(self) -> dict:
+        if self._row_budget is None:
+            return {}
+        return self._row_budget.new_store()
 
     def process_date(
         self, countryiso3: str, date_range: str, row: dict
@@ -88,219 +135,351 @@ class Pipeline:
             logger.error(f"Key {key} already exists in {msg}!")
             return
         global_dict[key] = row
-        dict_of_dicts_add(country_dict, countryiso3, key, row)
-
-    @classmethod
-    def set_mpi(cls, inheaders: tuple[str], inrow: dict, row: dict) -> None:
-        for i, inheader in enumerate(inheaders):
-            header = cls.headers[i]
-            row[header] = number_format(inrow[inheader], format="%.4f")
+        country_rows = country_dict.get(countryiso3)
+        if country_rows is None:
+            country_rows = self.new_rows()
+            country_dict[countryiso3] = country_rows
+        country_rows[key] = row
 
-    def read_mpi_national_data(
-        self, path: str, format: str, sheet: str, headers: list[str]
-    ) -> None:
-        inheaders = (
-            "Multidimensional poverty Multidimensional Poverty Index (MPI = H*A) Range 0 to 1",
-            "Multidimensional poverty Headcount ratio: Population in multidimensional poverty (H) % Population",
-            "Multidimensional poverty Intensity of deprivation among the poor (A) Average % of weighted deprivations",
-            "Multidimensional poverty Vulnerable to poverty (who experience 20-33.32% intensity of deprivations) % Population",
-            "Multidimensional poverty In severe poverty (severity 50% or higher) % Population",
-        )
-        _, iterator = self._retriever.downloader.get_tabular_rows(
-            path,
-            format=format,
-            sheet=sheet,
-            headers=headers,
-            dict_form=True,
-        )
-        for inrow in iterator:
-            countryiso3 = inrow["ISO country code"]
-            if not countryiso3:
-                continue
-            row = {
-                "Country ISO3": countryiso3,
-                "Admin 1 PCode": "",
-                "Admin 1 Name": "",
-                "Survey": inrow["MPI data source Survey"],
-            }
-            self.set_mpi(inheaders, inrow, row)
-            date_range = inrow["MPI data source Year"]
-            self.add_row(
-                countryiso3,
-                "",
-                "",
-                date_range,
-                row,
-                self._standardised_global,
-                self._standardised_countries,
-                "mpi_national",
+    def get_outputs(self, layout: SheetLayout) -> list[tuple[dict, dict]]:
+        if layout.output == "standardised":
+            return [(self._standardised_global, self._standardised_countries)] * len(
+                layout.timepoints
             )
+        # each trend timepoint is kept separately until the trends are requested
+        while len(self._standardised_global_trend) < len(layout.timepoints):
+            self._standardised_global_trend.append(self.new_rows())
+            self._standardised_countries_trend.append({})
+        return list(
+            zip(self._standardised_global_trend, self._standardised_countries_trend)
+        )[: len(layout.timepoints)]
 
-    def read_mpi_subnational_data(
-        self, path: str, format: str, sheet: str, headers: list[str]
-    ) -> None:
-        inheaders = (
-            "Multidimensional poverty by region Multidimensional Poverty Index (MPI = H*A) Range 0 to 1",
-            "Multidimensional poverty by region Headcount ratio: Population in multidimensional poverty (H) % Population",
-            "Multidimensional poverty by region Intensity of deprivation among the poor (A) Average % of weighted deprivations",
-            "Multidimensional poverty by region Vulnerable to poverty % Population",
-            "Multidimensional poverty by region In severe poverty % Population",
-        )
+    def read_sheet(self, layout: SheetLayout, path: str, format: str) -> None:
         _, iterator = self._retriever.downloader.get_tabular_rows(
             path,
             format=format,
-            sheet=sheet,
-            headers=headers,
-            dict_form=True,
+            sheet=layout.sheet,
+            has_header=False,
         )
-        for inrow in iterator:
-            countryiso3 = inrow["ISO country code"]
-            if not countryiso3:
-                continue
-            admin1_name = inrow.get("Subnational  region")
-            admin1_code, _ = self._adminone.get_pcode(countryiso3, admin1_name)
-            row = {
-                "Country ISO3": countryiso3,
-                "Admin 1 PCode": admin1_code,
-                "Admin 1 Name": admin1_name,
-                "Survey": inrow["MPI data source Survey"],
-            }
-            self.set_mpi(inheaders, inrow, row)
-            date_range = inrow["MPI data source Year"]
-            self.add_row(
-                countryiso3,
-                admin1_code,
-                admin1_name,
-                date_range,
-                row,
-                self._standardised_global,
-                self._standardised_countries,
-                "mpi_subnational",
-            )
-
-    def read_trends_national_data(
-        self, path: str, format: str, sheet: str, headers: list[str]
-    ) -> None:
-        inheaders_tn = []
-        for timepoint in self.timepoints:
-            inheaders = (
-                f"Multidimensional Poverty Index (MPIT) {timepoint} Range  0 to 1",
-                f"Multidimensional Headcount Ratio (HT) {timepoint} % pop.",
-                f"Intensity of Poverty (AT) {timepoint} Avg % of  weighted deprivations",
-                f"Vulnerable to poverty {timepoint} % pop.",
-                f"In severe poverty {timepoint} % pop.",
-            )
-            inheaders_tn.append(inheaders)
-        _, iterator = self._retriever.downloader.get_tabular_rows(
-            path,
-            format=format,
-            sheet=sheet,
-            headers=headers,
-            dict_form=True,
+        labels, first_row = layout.read_header(iterator)
+        if first_row is None:
+            return
+        layout.compile(labels)
+        country_index = layout.country_index
+        admin1_name_index = layout.admin1_name_index
+        outputs = list(zip(layout.timepoint_columns, self.get_outputs(layout)))
+        inrows = (
+            inrow
+            for inrow in chain((first_row,), iterator)
+            if inrow[country_index]
+            and (not self._countries or inrow[country_index] in self._countries)
         )
-        for inrow in iterator:
-            countryiso3 = inrow["ISO country code"]
-            if not countryiso3:
-                continue
-            for i, timepoint in enumerate(self.timepoints):
-                row = {
-                    "Country ISO3": countryiso3,
-                    "Admin 1 PCode": "",
-                    "Admin 1 Name": "",
-                    "Survey": inrow[f"MPI data source {timepoint} Survey"],
-                }
-                inheaders = inheaders_tn[i]
-                self.set_mpi(inheaders, inrow, row)
-                date_range = inrow[f"MPI data source {timepoint} Year"]
-                self.add_row(
-                    countryiso3,
-                    "",
-                    "",
-                    date_range,
-                    row,
-                    self._standardised_global_trend[i],
-                    self._standardised_countries_trend[i],
-                    "trends_national",
-                )
-
-    def read_trends_subnational_data(
-        self, path: str, format: str, sheet: str, headers: list[str]
-    ) -> None:
-        inheaders_tn = []
-        for timepoint in self.timepoints:
-            inheaders = (
-                f"Multidimensional Poverty Index (MPIT) {timepoint} Range 0 to 1",
-                f"Multidimensional Headcount Ratio (HT) {timepoint} % pop.",
-                f"Intensity of Poverty (AT) {timepoint} Avg % of  weighted deprivations",
-                f"Vulnerable to poverty {timepoint} % pop.",
-                f"In severe poverty {timepoint} % pop.",
+        if admin1_name_index is not None:
+            # subnational sheets are small, so are buffered rather than parsed
+            # again, to match each distinct name once
+            inrows = list(inrows)
+            pcodes = self._admin1_matcher.match(
+                (inrow[country_index], inrow[admin1_name_index]) for inrow in inrows
             )
-            inheaders_tn.append(inheaders)
-        _, iterator = self._retriever.downloader.get_tabular_rows(
-            path,
-            format=format,
-            sheet=sheet,
-            headers=headers,
-            dict_form=True,
-        )
-        for inrow in iterator:
-            countryiso3 = inrow["ISO country code"]
-            if not countryiso3:
-                continue
-            admin1_name = inrow["Region"]
-            admin1_code, _ = self._adminone.get_pcode(countryiso3, admin1_name)
-            for i, timepoint in enumerate(self.timepoints):
+        for inrow in inrows:
+            countryiso3 = inrow[country_index]
+            if admin1_name_index is None:
+                admin1_code = ""
+                admin1_name = ""
+            else:
+                admin1_name = inrow[admin1_name_index]
+                admin1_code = pcodes[(countryiso3, admin1_name)]
+            for columns, (global_dict, country_dict) in outputs:
                 row = {
                     "Country ISO3": countryiso3,
                     "Admin 1 PCode": admin1_code,
                     "Admin 1 Name": admin1_name,
-                    "Survey": inrow[f"MPI data source {timepoint} Survey"],
+                    "Survey": inrow[columns.survey],
                 }
-                inheaders = inheaders_tn[i]
-                self.set_mpi(inheaders, inrow, row)
-                date_range = inrow[f"MPI data source {timepoint} Year"]
+                for header, index in columns.values:
+                    row[header] = number_format(inrow[index], format="%.4f")
                 self.add_row(
                     countryiso3,
                     admin1_code,
                     admin1_name,
-                    date_range,
+                    inrow[columns.date_range],
                     row,
-                    self._standardised_global_trend[i],
-                    self._standardised_countries_trend[i],
-                    "trends_subnational",
+                    global_dict,
+                    country_dict,
+                    layout.name,
                 )
 
-    def process(self) -> tuple[str, str, str]:
-        datasetinfo = self._configuration["datasetinfo"]
-        format = datasetinfo["format"]
-        headers = datasetinfo["headers"]
-
-        mpi_and_partial_indices = datasetinfo["mpi_and_partial_indices"]
-        mpi_national = mpi_and_partial_indices["national"]
-        url = mpi_national["url"]
-        mpi_national_path = self._retriever.download_file(
-            url, "national-results-mpi.xlsx"
+    def get_layouts(self, release: dict) -> dict:
+        # a release can override the layouts if its workbooks are laid out
+        # differently
+        return release.get("layouts", self._configuration["datasetinfo"]["layouts"])
+
+    def get_cache_path(self, paths: tuple[str, ...], layouts: dict) -> str | None:
+        if not self._cache_folder:
+            return None
+        if self._row_budget is not None:
+            logger.info("Not caching parsed data as rows may be spilled to disk")
+            return None
+        key = hash_objects(
+            hash_files(paths),
+            self._adminone.pcode_to_name,
+            self._adminone.name_to_pcode,
+            self._configuration["datasetinfo"]["format"],
+            layouts,
+            sorted(self._countries or ()),
+            hash_files((__file__, admin1_matcher.__file__, sheet_layout.__file__)),
+            # parsing dates, numbers and p-codes depends on these libraries
+            version("hdx-python-utilities"),
+            version("hdx-python-country"),
         )
-        sheet = mpi_national["sheet"]
-        self.read_mpi_national_data(mpi_national_path, format, sheet, headers)
+        return join(self._cache_folder, f"parsed-{key}.pickle")
+
+    def load_cache(self, path: str) -> bool:
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        (
+            self._standardised_global,
+            self._standardised_global_trend,
+            self._standardised_countries,
+            self._standardised_countries_trend,
+            self._date_ranges,
+        ) = state
+        logger.info(f"Loaded parsed data from {path}")
+        return True
 
-        mpi_subnational = mpi_and_partial_indices["subnational"]
-        url = mpi_subnational["url"]
-        mpi_subnational_path = self._retriever.download_file(
-            url, "subnational-results-mpi.xlsx"
+    def save_cache(self, path: str) -> None:
+        state = (
+            self._standardised_global,
+            self._standardised_global_trend,
+            self._standardised_countries,
+            self._standardised_countries_trend,
+            self._date_ranges,
         )
-        sheet = mpi_subnational["sheet"]
-        self.read_mpi_subnational_data(mpi_subnational_path, format, sheet, headers)
+        makedirs(self._cache_folder, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        replace(temp_path, path)
+        logger.info(f"Saved parsed data to {path}")
+
+    def download_release(self, release: dict, prefix: str = "") -> dict[str, str]:
+        datasetinfo = self._configuration["datasetinfo"]
+        filenames = datasetinfo.get("filenames", {})
+        source_paths = {}
+        for source, url in get_sources(release).items():
+            filename = filenames.get(source, f"{source}.{datasetinfo['format']}")
+            source_paths[source] = self._retriever.download_file(
+                url, f"{prefix}{filename}"
+            )
+        self._input_paths.extend(source_paths.values())
+        return source_paths
+
+    def download_releases(self) -> list[dict[str, str]]:
+        # older releases are downloaded with their name as a prefix so that their
+        # files don't overwrite the current release's
+        current_release, *older_releases = self._configuration["datasetinfo"][
+            "releases"
+        ]
+        return [self.download_release(current_release)] + [
+            self.download_release(release, f"{release['name']}-")
+            for release in older_releases
+        ]
+
+    def read_release(self, source_paths: dict[str, str], layouts: dict) -> None:
+        datasetinfo = self._configuration["datasetinfo"]
+        cache_path = self.get_cache_path(tuple(source_paths.values()), layouts)
+        if cache_path and self.load_cache(cache_path):
+            return
+        for name, layout in layouts.items():
+            layout = SheetLayout(name, layout)
+            self.read_sheet(
+                layout, get_source_path(layout, source_paths), datasetinfo["format"]
+            )
+        if cache_path:
+            self.save_cache(cache_path)
+
+    def process_older_release(
+        self, release: dict, source_paths: dict[str, str] | None
+    ) -> Pipeline:
+        from hdx.utilities.downloader import Download
+
+        # Download keeps the last response so each release needs its own
+        with Download() as downloader:
+            pipeline = Pipeline(
+                self._configuration,
+                self._retriever.clone(downloader),
+                self._adminone,
+                self._row_budget,
+                self._cache_folder,
+                self._countries,
+            )
+            pipeline._admin1_matcher = self._admin1_matcher
+            # releases downloaded by preflight are already in the input paths
+            if source_paths is None:
+                source_paths = pipeline.download_release(release, f"{release['name']}-")
+            pipeline.read_release(source_paths, self.get_layouts(release))
+        return pipeline
+
+    def merge_rows(self, rows: Mapping, global_dict: dict, country_dict: dict) -> int:
+        skipped = 0
+        for key, row in rows.items():
+            if key in global_dict:
+                skipped += 1
+                continue
+            global_dict[key] = row
+            countryiso3 = key[0]
+            country_rows = country_dict.get(countryiso3)
+            if country_rows is None:
+                country_rows = self.new_rows()
+                country_dict[countryiso3] = country_rows
+            country_rows[key] = row
+        return skipped
+
+    def merge_release(self, name: str, pipeline: Pipeline) -> None:
+        # a row from an older release is only added if no newer release has a row
+        # with the same key
+        skipped = self.merge_rows(
+            pipeline.get_standardised_global(),
+            self._standardised_global,
+            self._standardised_countries,
+        )
+        self._standardised_global_trend = [self.get_standardised_global_trend()]
+        self._standardised_countries_trend = [self.get_standardised_countries_trend()]
+        skipped += self.merge_rows(
+            pipeline.get_standardised_global_trend(),
+            self._standardised_global_trend[0],
+            self._standardised_countries_trend[0],
+        )
+        for countryiso3, date_range in pipeline.get_date_ranges().items():
+            current_date_range = self._date_ranges.get(countryiso3)
+            if current_date_range is None:
+                self._date_ranges[countryiso3] = dict(date_range)
+                continue
+            if date_range["start"] < current_date_range["start"]:
+                current_date_range["start"] = date_range["start"]
+            if date_range["end"] > current_date_range["end"]:
+                current_date_range["end"] = date_range["end"]
+        self._input_paths.extend(pipeline.get_input_paths())
+        logger.info(
+            f"Merged release {name} skipping {skipped} rows already in newer releases"
+        )
+
+    def preflight(self, layouts_path: str | None = None) -> None:
+        """Download every release and check the header rows of each sheet
+        against its layout before any p-codes are set up or data rows are read.
+        Columns that are missing fail the run listing the closest labels found,
+        while labels that differ from the previous run's are logged."""
+        self._release_paths = self.download_releases()
+        previous = {}
+        if layouts_path:
+            try:
+                with open(layouts_path) as f:
+                    previous = json.load(f)
+            except FileNotFoundError:
+                logger.info(f"No previous layouts found in {layouts_path}")
+        layouts = {}
+        problems = []
+        releases = self._configuration["datasetinfo"]["releases"]
+        for i, (release, source_paths) in enumerate(zip(releases, self._release_paths)):
+            for name, layout in self.get_layouts(release).items():
+                # layouts of older releases are stored under the release's name
+                if i != 0:
+                    name = f"{release['name']}/{name}"
+                try:
+                    layout = SheetLayout(name, layout)
+                    path = get_source_path(layout, source_paths)
+                except ValueError as ex:
+                    problems.append(str(ex))
+                    continue
+                rows = iter_header_rows(path, layout.sheet)
+                try:
+                    labels, _ = layout.read_header(rows)
+                except ValueError as ex:
+                    problems.append(str(ex))
+                    continue
+                finally:
+                    rows.close()
+                fingerprint = hash_labels(labels)
+                layouts[name] = {"fingerprint": fingerprint, "labels": labels}
+                for label, closest in layout.find_missing(labels):
+                    problem = f"Column {label} for layout {name} not found in sheet {layout.sheet}"
+                    if closest:
+                        problem = f"{problem} (closest is {closest})"
+                    problems.append(problem)
+                previous_layout = previous.get(name)
+                if previous_layout and previous_layout["fingerprint"] != fingerprint:
+                    previous_labels = previous_layout["labels"]
+                    added = [x for x in labels if x and x not in previous_labels]
+                    removed = [x for x in previous_labels if x and x not in labels]
+                    logger.warning(
+                        f"Header of sheet {layout.sheet} for layout {name} changed "
+                        f"since previous run. Added: {added}. Removed: {removed}."
+                    )
+        if problems:
+            raise ValueError("Layout preflight failed!\n" + "\n".join(problems))
+        if layouts_path:
+            temp_path = f"{layouts_path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(layouts, f, indent=2)
+            replace(temp_path, layouts_path)
+        logger.info(f"Preflight found all columns in {len(layouts)} sheets")
+
+    def get_current_paths(self, release: dict) -> dict[str, str]:
+        # the releases are already downloaded if preflight was run
+        if self._release_paths is None:
+            return self.download_release(release)
+        return self._release_paths[0]
+
+    def get_older_paths(self) -> list[dict[str, str] | None]:
+        if self._release_paths is None:
+            older_releases = self._configuration["datasetinfo"]["releases"][1:]
+            return [None] * len(older_releases)
+        return self._release_paths[1:]
+
+    def process(self) -> dict[str, str]:
+        """Read every release and return the paths of the current release's
+        workbooks by source"""
+        # releases are listed newest first and the first is the current release
+        # whose workbooks are published
+        current_release, *older_releases = self._configuration["datasetinfo"][
+            "releases"
+        ]
+        older_paths = self.get_older_paths()
+        if self._row_budget is None:
+            with ThreadPoolExecutor(max(len(older_releases), 1)) as executor:
+                futures = [
+                    executor.submit(self.process_older_release, release, paths)
+                    for release, paths in zip(older_releases, older_paths)
+                ]
+                source_paths = self.get_current_paths(current_release)
+                self.read_release(source_paths, self.get_layouts(current_release))
+                older_pipelines = [future.result() for future in futures]
+        else:
+            # the budget spills whichever store holds the most rows so releases are
+            # read one at a time
+            source_paths = self.get_current_paths(current_release)
+            self.read_release(source_paths, self.get_layouts(current_release))
+            older_pipelines = [
+                self.process_older_release(release, paths)
+                for release, paths in zip(older_releases, older_paths)
+            ]
+        for release, pipeline in zip(older_releases, older_pipelines):
+            self.merge_release(release["name"], pipeline)
 
-        trend_over_time = datasetinfo["trend_over_time"]
-        url = trend_over_time["url"]
-        trend_path = self._retriever.download_file(url, "trends-over-time-mpi.xlsx")
-        sheet = trend_over_time["national_sheet"]
-        self.read_trends_national_data(trend_path, format, sheet, headers)
-        sheet = trend_over_time["subnational_sheet"]
-        self.read_trends_subnational_data(trend_path, format, sheet, headers)
+        no_matched = self._admin1_matcher.no_matched()
+        if no_matched:
+            logger.info(f"Matched {no_matched} distinct admin 1 names to p-codes")
+        if self._countries:
+            missing = self._countries.difference(self._standardised_countries)
+            if missing:
+                logger.warning(f"No data for countries: {', '.join(sorted(missing))}")
+        return source_paths
 
-        return mpi_national_path, mpi_subnational_path, trend_path
+    def get_input_paths(self) -> list[str]:
+        return self._input_paths
 
     def get_standardised_global(self) -> dict:
         return self._standardised_global
@@ -309,13 +488,26 @@ class Pipeline:
         return self._standardised_countries
 
     def get_standardised_global_trend(self) -> dict:
-        self._standardised_global_trend[0].update(self._standardised_global_trend[1])
-        return self._standardised_global_trend[0]
+        if not self._standardised_global_trend:
+            return self.new_rows()
+        # later timepoints replace earlier ones with the same key
+        standardised_global_trend = self._standardised_global_trend[0]
+        for later in self._standardised_global_trend[1:]:
+            standardised_global_trend.update(later)
+        return standardised_global_trend
 
     def get_standardised_countries_trend(self) -> dict:
-        for key, value in self._standardised_countries_trend[0].items():
-            value.update(self._standardised_countries_trend[1][key])
-        return self._standardised_countries_trend[0]
+        if not self._standardised_countries_trend:
+            return {}
+        standardised_countries_trend = self._standardised_countries_trend[0]
+        for later in self._standardised_countries_trend[1:]:
+            for countryiso3, rows in later.items():
+                country_rows = standardised_countries_trend.get(countryiso3)
+                if country_rows is None:
+                    standardised_countries_trend[countryiso3] = rows
+                else:
+                    country_rows.update(rows)
+        return standardised_countries_trend
 
     def get_date_ranges(self) -> dict:
         return self._date_ranges
@@ -0,0 +1,170 @@
+import cProfile
+import logging
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from os import makedirs
+from os.path import basename, join
+
+logger = logging.getLogger(__name__)
+
+
+class Profiler:
+    """cProfile and tracemalloc wrapper that is a no-op unless given a folder.
+    Stages of the main thread are snapshotted and timed, while stages run in
+    background threads are only timed, in their own thread, so that they do not
+    cut across the main thread's stages."""
+
+    pstats_filename = "ophi.pstats"
+    allocations_filename = "allocations.txt"
+    collapsed_filename = "ophi.collapsed"
+    stages_filename = "stages.txt"
+
+    def __init__(self, folder: str | None, top: int = 25) -> None:
+        self._folder = folder
+        self._top = top
+        self._profile = None
+        self._stage = None
+        self._snapshot = None
+        self._allocations = []
+        self._lock = threading.Lock()
+        self._started = None
+        self._timings = []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._folder)
+
+    def __enter__(self) -> "Profiler":
+        if self.enabled:
+            makedirs(self._folder, exist_ok=True)
+            tracemalloc.start()
+            self._snapshot = tracemalloc.take_snapshot()
+            self._stage = "start"
+            self._started = get_times()
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if not self.enabled:
+            return
+        self._profile.disable()
+        self._take_snapshot()
+        self._add_timing(threading.current_thread().name, self._stage, self._started)
+        tracemalloc.stop()
+        self.write()
+
+    def _take_snapshot(self) -> None:
+        snapshot = tracemalloc.take_snapshot()
+        statistics = snapshot.compare_to(self._snapshot, "lineno")
+        _, peak = tracemalloc.get_traced_memory()
+        self._allocations.append((self._stage, peak, statistics[: self._top]))
+        tracemalloc.reset_peak()
+        self._snapshot = snapshot
+
+    def _add_timing(self, thread: str, stage: str, started: tuple) -> None:
+        wall, cpu = (end - start for end, start in zip(get_times(), started))
+        with self._lock:
+            self._timings.append((thread, stage, wall, cpu))
+
+    def stage(self, name: str) -> None:
+        if not self.enabled:
+            return
+        self._profile.disable()
+        self._take_snapshot()
+        self._add_timing(threading.current_thread().name, self._stage, self._started)
+        self._stage = name
+        self._started = get_times()
+        self._profile.enable()
+
+    @contextmanager
+    def thread_stage(self, name: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        started = get_times()
+        try:
+            yield
+        finally:
+            self._add_timing(threading.current_thread().name, name, started)
+
+    def write(self) -> None:
+        stats = pstats.Stats(self._profile)
+        path = join(self._folder, self.pstats_filename)
+        stats.dump_stats(path)
+        logger.info(f"Wrote profile statistics to {path}")
+
+        path = join(self._folder, self.allocations_filename)
+        with open(path, "w") as output:
+            for stage, peak, statistics in self._allocations:
+                output.write(f"##### {stage} (peak {peak / 1024 / 1024:.1f} MiB)\n")
+                for statistic in statistics:
+                    output.write(f"{statistic}\n")
+                output.write("\n")
+        logger.info(f"Wrote allocation snapshots to {path}")
+
+        path = join(self._folder, self.stages_filename)
+        with open(path, "w") as output:
+            for thread, stage, wall, cpu in self._timings:
+                output.write(f"{thread} {stage}: {wall:.3f}s wall {cpu:.3f}s CPU\n")
+        logger.info(f"Wrote stage timings to {path}")
+
+        path = join(self._folder, self.collapsed_filename)
+        with open(path, "w") as output:
+            for stack, microseconds in sorted(collapse_stacks(stats).items()):
+                output.write(f"{stack} {microseconds}\n")
+        logger.info(f"Wrote collapsed stacks to {path}")
+
+
+def get_times() -> tuple[float, float]:
+    # CPU time of the calling thread only
+    return time.perf_counter(), time.thread_time()
+
+
+def _label(func: tuple[str, int, str]) -> str:
+    filename, lineno, funcname = func
+    if filename == "~":
+        return funcname
+    return f"{funcname} ({basename(filename)}:{lineno})".replace(";", ",")
+
+
+def collapse_stacks(stats: pstats.Stats, threshold: float = 0.0001) -> Counter:
+    # cProfile only records caller/callee edges so a callee's time is apportioned
+    # down each path by the share of its cumulative time that came from the caller.
+    # Calls made before profiling started in the frame (or, as cProfile records
+    # every thread, in another thread) make roots of functions that also have
+    # callers, so each function is a root for the time its callers don't explain
+    callees = defaultdict(dict)
+    roots = []
+    for func, (_, _, _, ct, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge
+        unexplained = ct - sum(edge[3] for edge in callers.values())
+        if ct and unexplained >= threshold:
+            roots.append((func, unexplained / ct))
+    stacks = Counter()
+
+    def walk(func: tuple, stack: tuple, seen: frozenset, fraction: float) -> None:
+        _, _, tt, ct, _ = stats.stats[func]
+        if ct * fraction < threshold:
+            return
+        stack = stack + (_label(func),)
+        microseconds = int(tt * fraction * 1000000)
+        if microseconds:
+            stacks[";".join(stack)] += microseconds
+        seen = seen | {func}
+        for callee, (_, _, _, edge_ct) in callees[func].items():
+            if callee in seen:
+                continue
+            callee_ct = stats.stats[callee][3]
+            if callee_ct:
+                walk(callee, stack, seen, fraction * edge_ct / callee_ct)
+
+    for root, fraction in roots:
+        walk(root, (), frozenset(), fraction)
+    return stacks
@@ -0,0 +1,163 @@
+import logging
+import pickle
+from collections.abc import Iterator, Mapping
+from heapq import merge
+from operator import itemgetter
+from os import close, remove
+from tempfile import mkstemp
+
+logger = logging.getLogger(__name__)
+
+
+class RowBudget:
+    """Limits the number of rows held in memory across all stores created from it.
+    When the limit is exceeded, the store holding the most rows in memory spills
+    them to disk as a sorted run."""
+
+    def __init__(self, max_rows: int, folder: str) -> None:
+        self._max_rows = max_rows
+        self._folder = folder
+        self._stores = []
+        self._in_memory = 0
+        self.spills = 0
+
+    def new_store(self) -> "RowStore":
+        store = RowStore(self)
+        self._stores.append(store)
+        return store
+
+    def added(self) -> None:
+        self._in_memory += 1
+        if self._in_memory > self._max_rows:
+            store = max(self._stores, key=lambda x: x.no_rows_in_memory())
+            self._in_memory -= store.spill()
+
+    def create_run_file(self) -> str:
+        handle, path = mkstemp(prefix="ophi-run-", suffix=".pickle", dir=self._folder)
+        close(handle)
+        self.spills += 1
+        return path
+
+    def cleanup(self) -> None:
+        for store in self._stores:
+            store.cleanup()
+        self._stores = []
+        self._in_memory = 0
+
+
+def read_run(path: str) -> Iterator[tuple]:
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+class SortedMapping(Mapping):
+    """Mapping of key to row that already iterates in key order, so that its rows
+    need not be sorted"""
+
+
+class RowStore(SortedMapping):
+    """Mapping of key to row that iterates in key order. Rows beyond the budget are
+    spilled to disk in sorted runs and read back with a k-way merge. As with a dict,
+    a later assignment to an existing key replaces the earlier row. Only rows are
+    spilled: every key stays in memory with the run and offset of its latest row
+    so that a spilled row is read back with a single seek."""
+
+    def __init__(self, budget: RowBudget) -> None:
+        self._budget = budget
+        # key to (run index, offset) of its latest spilled row or None if in memory
+        self._locations = {}
+        self._rows = {}
+        self._runs = []
+
+    def __setitem__(self, key: tuple, row: dict) -> None:
+        self._locations[key] = None
+        if key not in self._rows:
+            self._rows[key] = row
+            self._budget.added()
+        else:
+            self._rows[key] = row
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._locations
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def __getitem__(self, key: tuple) -> dict:
+        location = self._locations[key]
+        if location is None:
+            return self._rows[key]
+        run, offset = location
+        with open(self._runs[run], "rb") as f:
+            f.seek(offset)
+            _, row = pickle.load(f)
+        return row
+
+    def no_rows_in_memory(self) -> int:
+        return len(self._rows)
+
+    def spill(self) -> int:
+        no_rows = len(self._rows)
+        if no_rows == 0:
+            return 0
+        path = self._budget.create_run_file()
+        run = len(self._runs)
+        with open(path, "wb") as f:
+            for key in sorted(self._rows):
+                self._locations[key] = (run, f.tell())
+                pickle.dump((key, self._rows[key]), f, pickle.HIGHEST_PROTOCOL)
+        self._runs.append(path)
+        self._rows = {}
+        return no_rows
+
+    def items(self) -> Iterator[tuple[tuple, dict]]:
+        # take references up front in case a spill happens while iterating
+        rows = self._rows
+        runs = list(self._runs)
+        in_memory = ((key, rows[key]) for key in sorted(rows))
+        if not runs:
+            yield from in_memory
+            return
+        # merge keeps the input order for equal keys so the last one is the latest
+        previous = None
+        for item in merge(
+            *(read_run(path) for path in runs), in_memory, key=itemgetter(0)
+        ):
+            if previous is not None and previous[0] != item[0]:
+                yield previous
+            previous = item
+        if previous is not None:
+            yield previous
+
+    def __iter__(self) -> Iterator[tuple]:
+        for key, _ in self.items():
+            yield key
+
+    def values(self) -> Iterator[dict]:
+        for _, row in self.items():
+            yield row
+
+    def update(self, other: Mapping) -> None:
+        for key, row in other.items():
+            self[key] = row
+
+    def cleanup(self) -> None:
+        for path in self._runs:
+            remove(path)
+        self._runs = []
+
+
+def sorted_items(rows: Mapping) -> Iterator[tuple[tuple, dict]]:
+    if isinstance(rows, SortedMapping):
+        return rows.items()
+    return ((key, rows[key]) for key in sorted(rows))
+
+
+def sorted_rows(rows: Mapping) -> Iterator[dict]:
+    if isinstance(rows, SortedMapping):
+        return rows.values()
+    return (rows[key] for key in sorted(rows))
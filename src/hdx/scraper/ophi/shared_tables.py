@@ -0,0 +1,255 @@
+import json
+import mmap
+import pickle
+import struct
+from collections.abc import Callable, Iterator, Mapping
+from datetime import UTC, datetime, timedelta
+from operator import itemgetter
+from os import getpid, replace
+
+from hdx.scraper.ophi.rowstore import SortedMapping
+
+epoch = datetime(1970, 1, 1, tzinfo=UTC)
+# int64 and int32 values standing in for None
+no_time = -(2**63)
+no_string = -1
+
+
+def get_kind(values: list) -> str:
+    present = [value for value in values if value is not None]
+    if all(isinstance(value, str) for value in present):
+        return "s"
+    if all(isinstance(value, datetime) and value.tzinfo is UTC for value in present):
+        return "t"
+    # anything else is pickled so it is not shared but still round trips
+    return "o"
+
+
+class TablesWriter:
+    """Writes tables of keyed rows, split by country, to a file of columns that
+    SharedTables memory-maps. Strings are stored once in a pool and referred to
+    by index and dates are stored as microseconds since the epoch."""
+
+    def __init__(self) -> None:
+        self._strings = {}
+        self._buffers = []
+        self._offset = 0
+        self._tables = {}
+
+    def add_buffer(self, data: bytes) -> int:
+        # buffers are aligned to 8 bytes for the int64 columns
+        offset = self._offset
+        padding = -len(data) % 8
+        self._buffers.append(data + b"\0" * padding)
+        self._offset += len(data) + padding
+        return offset
+
+    def add_column(self, values: list) -> dict:
+        kind = get_kind(values)
+        if kind == "s":
+            indices = [
+                no_string
+                if value is None
+                else self._strings.setdefault(value, len(self._strings))
+                for value in values
+            ]
+            data = struct.pack(f"<{len(indices)}i", *indices)
+        elif kind == "t":
+            data = struct.pack(
+                f"<{len(values)}q",
+                *(
+                    no_time
+                    if value is None
+                    else (value - epoch) // timedelta.resolution
+                    for value in values
+                ),
+            )
+        else:
+            data = pickle.dumps(values, pickle.HIGHEST_PROTOCOL)
+        return {"kind": kind, "offset": self.add_buffer(data), "length": len(data)}
+
+    def add_table(self, name: str, country_rows: Mapping[str, Mapping]) -> None:
+        keys = []
+        rows = []
+        countries = {}
+        for countryiso3 in sorted(country_rows):
+            start = len(keys)
+            for key, row in sorted(
+                country_rows[countryiso3].items(), key=itemgetter(0)
+            ):
+                keys.append(key)
+                rows.append(row)
+            countries[countryiso3] = [start, len(keys)]
+        headers = list(rows[0]) if rows else []
+        if any(list(row) != headers for row in rows):
+            raise ValueError(f"Rows in {name} do not all have the same columns!")
+        key_length = len(keys[0]) if keys else 0
+        self._tables[name] = {
+            "no_rows": len(rows),
+            "countries": countries,
+            "key_columns": [
+                self.add_column([key[i] for key in keys]) for i in range(key_length)
+            ],
+            "columns": {
+                header: self.add_column([row[header] for row in rows])
+                for header in headers
+            },
+        }
+
+    def write(self, path: str) -> None:
+        encoded = [string.encode() for string in self._strings]
+        string_offsets = [0]
+        for string in encoded:
+            string_offsets.append(string_offsets[-1] + len(string))
+        strings = {
+            "count": len(encoded),
+            "offsets": self.add_buffer(
+                struct.pack(f"<{len(string_offsets)}q", *string_offsets)
+            ),
+            "data": self.add_buffer(b"".join(encoded)),
+        }
+        header = json.dumps({"strings": strings, "tables": self._tables}).encode()
+        header += b" " * (-len(header) % 8)
+        # the file only appears once complete for processes waiting on it
+        temp_path = f"{path}.{getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            for buffer in self._buffers:
+                f.write(buffer)
+        replace(temp_path, path)
+
+
+def write_tables(path: str, tables: Mapping[str, Mapping[str, Mapping]]) -> None:
+    writer = TablesWriter()
+    for name, country_rows in tables.items():
+        writer.add_table(name, country_rows)
+    writer.write(path)
+
+
+class SharedTables:
+    """Tables written by write_tables, memory-mapped read-only so that processes
+    on a machine share one copy in the page cache. Rows are only built when they
+    are read from a country's view."""
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = [memoryview(self._mmap)]
+        (header_length,) = struct.unpack_from("<Q", self._mmap, 0)
+        header = json.loads(bytes(self._views[0][8 : 8 + header_length]))
+        self._base = 8 + header_length
+        strings = header["strings"]
+        self._string_offsets = self.get_array(
+            strings["offsets"], "q", strings["count"] + 1
+        )
+        self._string_data = self.get_slice(
+            strings["data"], self._string_offsets[-1] if strings["count"] else 0
+        )
+        self._tables = header["tables"]
+        self._columns = {}
+
+    def get_slice(self, offset: int, length: int) -> memoryview:
+        start = self._base + offset
+        view = self._views[0][start : start + length]
+        self._views.append(view)
+        return view
+
+    def get_array(self, offset: int, format: str, count: int) -> memoryview:
+        view = self.get_slice(offset, count * struct.calcsize(format)).cast(format)
+        self._views.append(view)
+        return view
+
+    def get_string(self, index: int) -> str | None:
+        if index == no_string:
+            return None
+        start = self._string_offsets[index]
+        end = self._string_offsets[index + 1]
+        return str(self._string_data[start:end], "utf-8")
+
+    def get_column(self, column: dict, no_rows: int) -> Callable[[int], object]:
+        kind = column["kind"]
+        if kind == "s":
+            indices = self.get_array(column["offset"], "i", no_rows)
+            return lambda i: self.get_string(indices[i])
+        if kind == "t":
+            times = self.get_array(column["offset"], "q", no_rows)
+            return lambda i: (
+                None
+                if times[i] == no_time
+                else epoch + timedelta(microseconds=times[i])
+            )
+        values = pickle.loads(self.get_slice(column["offset"], column["length"]))
+        return values.__getitem__
+
+    def get_countries(self, table: str) -> list[str]:
+        return list(self._tables[table]["countries"])
+
+    def get_rows(self, table: str, countryiso3: str) -> "RowsView":
+        info = self._tables[table]
+        columns = self._columns.get(table)
+        if columns is None:
+            no_rows = info["no_rows"]
+            key_columns = [
+                self.get_column(column, no_rows) for column in info["key_columns"]
+            ]
+            row_columns = [
+                (header, self.get_column(column, no_rows))
+                for header, column in info["columns"].items()
+            ]
+            columns = key_columns, row_columns
+            self._columns[table] = columns
+        start, stop = info["countries"].get(countryiso3, (0, 0))
+        return RowsView(*columns, start, stop)
+
+    def close(self) -> None:
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._columns = {}
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> "SharedTables":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+class RowsView(SortedMapping):
+    """Mapping of key to row for one country's rows in a shared table, iterating
+    in key order. Each row is built from the columns when it is read."""
+
+    def __init__(self, key_columns: list, columns: list, start: int, stop: int):
+        self._key_columns = key_columns
+        self._columns = columns
+        self._start = start
+        self._stop = stop
+        self._indices = None
+
+    def get_key(self, i: int) -> tuple:
+        return tuple(column(i) for column in self._key_columns)
+
+    def get_row(self, i: int) -> dict:
+        return {header: column(i) for header, column in self._columns}
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def __iter__(self) -> Iterator[tuple]:
+        for i in range(self._start, self._stop):
+            yield self.get_key(i)
+
+    def __getitem__(self, key: tuple) -> dict:
+        if self._indices is None:
+            self._indices = {self.get_key(i): i for i in range(self._start, self._stop)}
+        return self.get_row(self._indices[key])
+
+    def items(self) -> Iterator[tuple[tuple, dict]]:
+        for i in range(self._start, self._stop):
+            yield self.get_key(i), self.get_row(i)
+
+    def values(self) -> Iterator[dict]:
+        for i in range(self._start, self._stop):
+            yield self.get_row(i)
@@ -0,0 +1,230 @@
+import hashlib
+import json
+import posixpath
+from collections.abc import Iterator, Sequence
+from difflib import get_close_matches
+from xml.etree import ElementTree
+from zipfile import ZipFile
+
+main_ns = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+relationships_ns = (
+    "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+)
+package_ns = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+
+# the tables that layouts can be read into
+outputs = ("standardised", "trends")
+
+
+def normalise_label(label: object) -> str:
+    if label is None:
+        return ""
+    return " ".join(str(label).split()).casefold()
+
+
+def merge_header_rows(header_rows: Sequence[Sequence]) -> list[str]:
+    # merged cells are filled, so a label spanning several rows repeats down the
+    # column and is only kept once, as when the header rows are given explicitly
+    labels = []
+    for column in zip(*header_rows):
+        parts = []
+        for cell in column:
+            part = normalise_label(cell)
+            if part and (not parts or parts[-1] != part):
+                parts.append(part)
+        labels.append(" ".join(parts))
+    return labels
+
+
+def get_relationships(archive: ZipFile, part: str) -> dict[str, tuple[str, str]]:
+    # relationship id to (type, path) of the parts a part of the package refers to
+    folder, filename = posixpath.split(part)
+    root = ElementTree.fromstring(
+        archive.read(posixpath.join(folder, "_rels", f"{filename}.rels"))
+    )
+    relationships = {}
+    for relationship in root.iter(f"{package_ns}Relationship"):
+        target = relationship.get("Target")
+        if target.startswith("/"):
+            path = target[1:]
+        else:
+            path = posixpath.normpath(posixpath.join(folder, target))
+        relationships[relationship.get("Id")] = (relationship.get("Type"), path)
+    return relationships
+
+
+def get_worksheet_path(archive: ZipFile, sheet: str) -> str:
+    workbook_path = next(
+        path
+        for type, path in get_relationships(archive, "").values()
+        if type.endswith("/officeDocument")
+    )
+    relationships = get_relationships(archive, workbook_path)
+    workbook = ElementTree.fromstring(archive.read(workbook_path))
+    for element in workbook.iter(f"{main_ns}sheet"):
+        if element.get("name") == sheet:
+            return relationships[element.get(f"{relationships_ns}id")][1]
+    raise KeyError(f"Worksheet {sheet} does not exist.")
+
+
+def get_merged_ranges(workbook_path: str, sheet: str) -> list[tuple]:
+    """Get the merged cell ranges of a worksheet in an xlsx file as (min_col,
+    min_row, max_col, max_row) tuples by streaming the worksheet's XML"""
+    from openpyxl.utils.cell import range_boundaries
+
+    merged_ranges = []
+    with ZipFile(workbook_path) as archive:
+        with archive.open(get_worksheet_path(archive, sheet)) as f:
+            for _, element in ElementTree.iterparse(f):
+                if element.tag == f"{main_ns}mergeCell":
+                    merged_ranges.append(range_boundaries(element.get("ref")))
+                elif element.tag == f"{main_ns}row":
+                    # the cells aren't needed
+                    element.clear()
+    return merged_ranges
+
+
+def iter_header_rows(path: str, sheet: str) -> Iterator[list]:
+    """Stream the rows of an xlsx sheet filling merged cells like a full read
+    does, so that reading only the header rows takes milliseconds"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet]
+        merged_ranges = get_merged_ranges(path, sheet)
+        fills = {}
+        for row_index, values in enumerate(worksheet.iter_rows(values_only=True), 1):
+            row = list(values)
+            for min_col, min_row, max_col, max_row in merged_ranges:
+                if min_row <= row_index <= max_row:
+                    if row_index == min_row:
+                        fills[(min_col, min_row)] = row[min_col - 1]
+                    value = fills.get((min_col, min_row))
+                    for col in range(min_col, min(max_col, len(row)) + 1):
+                        row[col - 1] = value
+            yield row
+    finally:
+        workbook.close()
+
+
+def hash_labels(labels: Sequence[str]) -> str:
+    return hashlib.sha256(json.dumps(list(labels)).encode()).hexdigest()
+
+
+class TimepointColumns:
+    def __init__(self, survey: int, date_range: int, values: list[tuple[str, int]]):
+        self.survey = survey
+        self.date_range = date_range
+        self.values = values
+
+
+class SheetLayout:
+    """Declarative description of an OPHI sheet from the layouts configuration.
+    Once the sheet's header rows have been found, it is compiled to positional
+    column indexes so that data rows can be read as plain lists."""
+
+    def __init__(self, name: str, layout: dict) -> None:
+        self.name = name
+        self.source = layout["source"]
+        self.sheet = layout["sheet"]
+        self.output = layout.get("output", "standardised")
+        if self.output not in outputs:
+            raise ValueError(
+                f"Layout {name} has output {self.output} which is not one of "
+                f"{', '.join(outputs)}!"
+            )
+        self.admin_level = layout.get("admin_level", 0)
+        self.timepoints = layout.get("timepoints") or [None]
+        columns = layout["columns"]
+        self._country = columns["country"]
+        self._admin1_name = columns.get("admin1_name")
+        self._survey = columns["survey"]
+        self._date_range = columns["date_range"]
+        self._values = layout["values"]
+        if self.admin_level == 1 and not self._admin1_name:
+            raise ValueError(f"Layout {name} is admin level 1 but has no admin1_name!")
+        self.country_index = None
+        self.admin1_name_index = None
+        self.timepoint_columns = []
+
+    def read_header(self, rows: Iterator[list]) -> tuple[list[str], list | None]:
+        # the header starts at the row containing the country column's label and
+        # ends at the first row with something else in that column
+        anchor = normalise_label(self._country)
+        header_rows = []
+        anchor_index = None
+        for row in rows:
+            if anchor_index is None:
+                for i, cell in enumerate(row):
+                    if normalise_label(cell) == anchor:
+                        anchor_index = i
+                        header_rows.append(row)
+                        break
+                continue
+            cell = normalise_label(row[anchor_index])
+            if not cell or cell == anchor:
+                header_rows.append(row)
+                continue
+            return merge_header_rows(header_rows), row
+        if anchor_index is None:
+            raise ValueError(
+                f"Header for layout {self.name} not found in sheet {self.sheet}!"
+            )
+        return merge_header_rows(header_rows), None
+
+    def get_expected_labels(self) -> list[str]:
+        labels = [self._country]
+        if self.admin_level == 1:
+            labels.append(self._admin1_name)
+        for timepoint in self.timepoints:
+            for label in (self._survey, self._date_range, *self._values.values()):
+                if timepoint:
+                    label = label.format(timepoint=timepoint)
+                labels.append(label)
+        return labels
+
+    def find_missing(self, labels: Sequence[str]) -> list[tuple[str, str | None]]:
+        """Get the expected labels that are not in the sheet's labels, each with
+        the closest label in the sheet if there is one"""
+        present = set(labels)
+        candidates = [label for label in labels if label]
+        missing = []
+        for label in self.get_expected_labels():
+            normalised = normalise_label(label)
+            if normalised in present:
+                continue
+            closest = get_close_matches(normalised, candidates, n=1, cutoff=0.6)
+            missing.append((label, closest[0] if closest else None))
+        return missing
+
+    def compile(self, labels: Sequence[str]) -> None:
+        indexes = {}
+        for i, label in enumerate(labels):
+            indexes.setdefault(label, i)
+
+        def get_index(label: str, timepoint: str | None = None) -> int:
+            if timepoint:
+                label = label.format(timepoint=timepoint)
+            index = indexes.get(normalise_label(label))
+            if index is None:
+                raise ValueError(
+                    f"Column {label} for layout {self.name} not found in sheet {self.sheet}!"
+                )
+            return index
+
+        self.country_index = get_index(self._country)
+        if self.admin_level == 1:
+            self.admin1_name_index = get_index(self._admin1_name)
+        self.timepoint_columns = [
+            TimepointColumns(
+                get_index(self._survey, timepoint),
+                get_index(self._date_range, timepoint),
+                [
+                    (header, get_index(label, timepoint))
+                    for header, label in self._values.items()
+                ],
+            )
+            for timepoint in self.timepoints
+        ]
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import logging
+import sqlite3
+from collections.abc import Iterable, Sequence
+from datetime import datetime
+from os import remove, replace
+from os.path import exists
+from typing import TYPE_CHECKING
+
+from hdx.scraper.ophi.rowstore import sorted_rows
+
+if TYPE_CHECKING:
+    from hdx.api.configuration import Configuration
+
+logger = logging.getLogger(__name__)
+
+
+def get_column_name(header: str) -> str:
+    return header.lower().replace(" ", "_")
+
+
+def get_value(value: object, column_type: str = "TEXT") -> object:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if column_type != "TEXT":
+        # metrics that are missing are formatted as empty strings
+        if value is None or value == "":
+            return None
+        if column_type == "REAL":
+            return float(value)
+        return int(value)
+    if value is None:
+        return ""
+    return value
+
+
+class SQLiteExport:
+    # columns that aren't listed are TEXT
+    column_types = {
+        "mpi": "REAL",
+        "headcount_ratio": "REAL",
+        "intensity_of_deprivation": "REAL",
+        "vulnerable_to_poverty": "REAL",
+        "in_severe_poverty": "REAL",
+        "admin_level": "INTEGER",
+    }
+    standardised_index = ("country_iso3", "admin_1_pcode", "start_date", "end_date")
+    hapi_index = (
+        "location_code",
+        "admin1_code",
+        "reference_period_start",
+        "reference_period_end",
+    )
+
+    def __init__(self, configuration: Configuration, path: str) -> None:
+        self._configuration = configuration
+        self._path = path
+
+    @classmethod
+    def write_table(
+        cls,
+        connection: sqlite3.Connection,
+        table: str,
+        headers: Sequence[str],
+        rows: Iterable[dict],
+        index_columns: Sequence[str],
+    ) -> int:
+        columns = [get_column_name(header) for header in headers]
+        column_types = [cls.column_types.get(column, "TEXT") for column in columns]
+        column_definitions = ", ".join(
+            f'"{column}" {column_type}'
+            for column, column_type in zip(columns, column_types)
+        )
+        connection.execute(f'CREATE TABLE "{table}" ({column_definitions})')
+        placeholders = ", ".join("?" for _ in columns)
+        cursor = connection.executemany(
+            f'INSERT INTO "{table}" VALUES ({placeholders})',
+            (
+                tuple(
+                    get_value(row.get(header), column_type)
+                    for header, column_type in zip(headers, column_types)
+                )
+                for row in rows
+            ),
+        )
+        index_definition = ", ".join(f'"{column}"' for column in index_columns)
+        connection.execute(
+            f'CREATE INDEX "{table}_index" ON "{table}" ({index_definition})'
+        )
+        return cursor.rowcount
+
+    def write(
+        self,
+        standardised_rows: dict,
+        standardised_trend_rows: dict,
+        hapi_rows: dict,
+    ) -> None:
+        # the database is built beside the existing one, which is only replaced
+        # once the export has succeeded
+        temp_path = f"{self._path}.tmp"
+        if exists(temp_path):
+            remove(temp_path)
+        headers = self._configuration["headers"]
+        hapi_headers = self._configuration["hapi_dataset"]["resource"]["headers"]
+        national_rows = (
+            row for row in sorted_rows(standardised_rows) if not row["Admin 1 Name"]
+        )
+        subnational_rows = (
+            row for row in sorted_rows(standardised_rows) if row["Admin 1 Name"]
+        )
+        connection = sqlite3.connect(temp_path)
+        try:
+            # the connection context manager wraps everything in one transaction
+            with connection:
+                for table, table_headers, rows, index_columns in (
+                    ("mpi_national", headers, national_rows, self.standardised_index),
+                    (
+                        "mpi_subnational",
+                        headers,
+                        subnational_rows,
+                        self.standardised_index,
+                    ),
+                    (
+                        "mpi_trends",
+                        headers,
+                        sorted_rows(standardised_trend_rows),
+                        self.standardised_index,
+                    ),
+                    (
+                        "hapi_poverty_rate",
+                        hapi_headers,
+                        sorted_rows(hapi_rows),
+                        self.hapi_index,
+                    ),
+                ):
+                    no_rows = self.write_table(
+                        connection, table, table_headers, rows, index_columns
+                    )
+                    logger.info(f"Wrote {no_rows} rows to {table} in {self._path}")
+        finally:
+            connection.close()
+        replace(temp_path, self._path)
@@ -0,0 +1,247 @@
+"""Entry point to watch OPHI sources and run the pipeline when they change"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import time
+from collections.abc import Callable, Iterable
+from datetime import UTC, datetime
+from os import replace
+from os.path import expanduser, join
+from typing import TYPE_CHECKING
+
+from hdx.scraper.ophi.__main__ import lookup, main
+from hdx.scraper.ophi.pipeline import get_sources
+
+if TYPE_CHECKING:
+    from requests import Session
+
+logger = logging.getLogger(__name__)
+
+validator_headers = ("ETag", "Last-Modified", "Content-Length")
+
+
+def write_json(path: str, obj: dict) -> None:
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(obj, f, indent=2, sort_keys=True)
+    replace(temp_path, path)
+
+
+def now() -> str:
+    return datetime.now(UTC).isoformat(timespec="seconds")
+
+
+class Watcher:
+    """Checks source URLs with HEAD requests, comparing their validators with
+    those stored after the last successful run, and calls run when any differ.
+    Sources that send neither ETag nor Last-Modified are fetched and hashed.
+    Metrics about checks and runs are written to a JSON file after each check."""
+
+    def __init__(
+        self,
+        session: Session,
+        urls: Iterable[str],
+        run: Callable[[], None],
+        state_path: str,
+        metrics_path: str,
+        timeout: float = 60,
+    ) -> None:
+        self._session = session
+        self._urls = list(urls)
+        self._run = run
+        self._state_path = state_path
+        self._metrics_path = metrics_path
+        self._timeout = timeout
+        try:
+            with open(state_path) as f:
+                self._validators = json.load(f)
+        except FileNotFoundError:
+            self._validators = {}
+        try:
+            with open(metrics_path) as f:
+                self.metrics = json.load(f)
+        except FileNotFoundError:
+            self.metrics = {"checks": 0, "runs": 0, "failed_runs": 0}
+
+    def get_validators(self, url: str) -> dict:
+        response = self._session.head(url, allow_redirects=True, timeout=self._timeout)
+        response.raise_for_status()
+        validators = {
+            header: response.headers[header]
+            for header in validator_headers
+            if header in response.headers
+        }
+        if "ETag" in validators or "Last-Modified" in validators:
+            return validators
+        response = self._session.get(url, timeout=self._timeout)
+        response.raise_for_status()
+        return {"sha256": hashlib.sha256(response.content).hexdigest()}
+
+    def check(self) -> tuple[list[str], dict]:
+        validators = {url: self.get_validators(url) for url in self._urls}
+        changed = [
+            url for url in self._urls if validators[url] != self._validators.get(url)
+        ]
+        return changed, validators
+
+    def check_and_run(self) -> bool:
+        metrics = self.metrics
+        metrics["checks"] += 1
+        metrics["last_check"] = now()
+        start = time.perf_counter()
+        try:
+            changed, validators = self.check()
+        except Exception as ex:
+            logger.exception("Checking sources failed!")
+            metrics["last_check_error"] = str(ex)
+            write_json(self._metrics_path, metrics)
+            return False
+        metrics["last_check_seconds"] = round(time.perf_counter() - start, 3)
+        metrics.pop("last_check_error", None)
+        if not changed:
+            logger.info("No sources have changed")
+            write_json(self._metrics_path, metrics)
+            return False
+        logger.info(f"Sources changed: {', '.join(changed)}")
+        metrics["last_change"] = metrics["last_check"]
+        metrics["changed"] = changed
+        metrics["last_run"] = now()
+        start = time.perf_counter()
+        try:
+            self._run()
+        except Exception as ex:
+            # validators are not stored so the next check runs again
+            logger.exception("Pipeline run failed!")
+            metrics["failed_runs"] += 1
+            metrics["last_run_error"] = str(ex)
+        else:
+            metrics["runs"] += 1
+            metrics.pop("last_run_error", None)
+            self._validators = validators
+            write_json(self._state_path, validators)
+        metrics["last_run_seconds"] = round(time.perf_counter() - start, 3)
+        write_json(self._metrics_path, metrics)
+        return True
+
+    def watch(self, interval: float, max_checks: int | None = None) -> None:
+        checks = 0
+        while True:
+            self.check_and_run()
+            checks += 1
+            if max_checks is not None and checks >= max_checks:
+                return
+            time.sleep(interval)
+
+
+def get_source_urls(configuration: dict) -> list[str]:
+    urls = []
+    for release in configuration["datasetinfo"]["releases"]:
+        urls.extend(get_sources(release).values())
+    urls.append(configuration["showcaseinfo"]["urls"])
+    return urls
+
+
+def watch(
+    interval: int = 3600,
+    state_file: str = "watch_state.json",
+    metrics_file: str = "watch_metrics.json",
+    max_checks: int | None = None,
+    save: bool = False,
+    use_saved: bool = False,
+    saved_dir: str = "saved_data",
+    profile: str | None = None,
+    memory_budget: int | None = None,
+    checkpoint_file: str | None = None,
+    parse_cache: str | None = None,
+    sqlite_file: str | None = None,
+    countries: list[str] | None = None,
+    fingerprints_file: str | None = None,
+    compression: str | None = None,
+    call_budget: int | None = None,
+    shard_folder: str | None = None,
+    worker: bool = False,
+    lease_seconds: int = 600,
+    delta_file: str | None = None,
+    in_memory: bool = False,
+    layouts_file: str | None = None,
+) -> None:
+    """Check OPHI sources on a schedule and run the pipeline when they change,
+    passing the pipeline's options on to each run
+
+    Args:
+        interval (int): Seconds between checks. Defaults to 3600.
+        state_file (str): File of source validators from the last successful run. Defaults to watch_state.json.
+        metrics_file (str): File that check and run metrics are written to. Defaults to watch_metrics.json.
+        max_checks (int | None): Stop after this many checks. Defaults to None (run until stopped).
+        save (bool): Save downloaded data. Defaults to False.
+        use_saved (bool): Use saved data. Defaults to False.
+        saved_dir (str): Folder to save data to or use saved data from. Defaults to saved_data.
+        profile (str | None): Folder for profiling output. Defaults to None (don't profile).
+        memory_budget (int | None): Max rows to hold in memory before spilling to disk. Defaults to None (no limit).
+        checkpoint_file (str | None): Journal file used to resume after completed steps. Defaults to None (don't resume).
+        parse_cache (str | None): Folder for cache of parsed data. Defaults to None (don't cache).
+        sqlite_file (str | None): SQLite database to export standardised data to. Defaults to None (don't export).
+        countries (list[str] | None): ISO3 codes of countries to process. Defaults to None (all countries).
+        fingerprints_file (str | None): File of per-country fingerprints used to skip unchanged countries. Defaults to None (update all countries).
+        compression (str | None): Also publish gzip or zstd compressed copies of the global CSVs. Defaults to None (don't compress).
+        call_budget (int | None): Fail the run if it makes more HTTP calls than this. Defaults to None (no limit).
+        shard_folder (str | None): Shared folder for a queue of countries that worker processes publish. Defaults to None (publish countries in this process).
+        worker (bool): Only publish countries claimed from the queue in shard_folder. Defaults to False.
+        lease_seconds (int): Seconds after which a country claimed by a worker that has stopped is claimed by another. Defaults to 600.
+        delta_file (str | None): File of the previous run's global and HAPI rows used to publish the rows that changed. Defaults to None (don't publish changes).
+        in_memory (bool): Write resources to a memory backed folder and remove them once uploaded unless debugging. Defaults to False.
+        layouts_file (str | None): File of the previous run's sheet headers that the preflight compares with. Defaults to None (don't compare).
+    Returns:
+        None
+    """
+    from hdx.api.configuration import Configuration
+    from hdx.utilities.downloader import Download
+
+    configuration = Configuration.read()
+    with Download() as downloader:
+        watcher = Watcher(
+            downloader.session,
+            get_source_urls(configuration),
+            lambda: main(
+                save=save,
+                use_saved=use_saved,
+                saved_dir=saved_dir,
+                profile=profile,
+                memory_budget=memory_budget,
+                checkpoint_file=checkpoint_file,
+                parse_cache=parse_cache,
+                sqlite_file=sqlite_file,
+                countries=countries,
+                fingerprints_file=fingerprints_file,
+                compression=compression,
+                call_budget=call_budget,
+                shard_folder=shard_folder,
+                worker=worker,
+                lease_seconds=lease_seconds,
+                delta_file=delta_file,
+                in_memory=in_memory,
+                layouts_file=layouts_file,
+            ),
+            state_file,
+            metrics_file,
+        )
+        watcher.watch(interval, max_checks)
+
+
+if __name__ == "__main__":
+    from hdx.facades.infer_arguments import facade
+    from hdx.utilities.easy_logging import setup_logging
+    from hdx.utilities.path import script_dir_plus_file
+
+    setup_logging()
+    facade(
+        watch,
+        user_agent_config_yaml=join(expanduser("~"), ".useragents.yaml"),
+        user_agent_lookup=lookup,
+        project_config_yaml=script_dir_plus_file(
+            join("config", "project_configuration.yaml"), main
+        ),
+    )
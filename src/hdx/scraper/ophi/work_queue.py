@@ -0,0 +1,235 @@
+import json
+import logging
+import os
+import pickle
+import socket
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from os import getpid, listdir, makedirs, remove, rename, replace, utime
+from os.path import exists, getmtime, join
+from shutil import rmtree
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+def write_atomically(path: str, data: bytes) -> None:
+    # the temporary file is unique to the process in case two write the same path
+    temp_path = f"{path}.{socket.gethostname()}-{getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    replace(temp_path, path)
+
+
+class WorkQueue:
+    """Queue of items in a folder that several processes, on one machine or on
+    several sharing a volume, work through. An item is claimed by creating its
+    lease file exclusively. A lease not renewed within lease_seconds is taken
+    over by another worker, so items claimed by a crashed worker are not lost.
+    Workers renew their leases while they work on an item. Workers can start
+    before the coordinator as they wait for a queue that is ready and unfinished,
+    and a queue stops being ready before it is cleared."""
+
+    ready_filename = "ready.json"
+
+    def __init__(
+        self,
+        folder: str,
+        lease_seconds: float = 600,
+        worker_id: str | None = None,
+    ) -> None:
+        self._folder = folder
+        self._items_folder = join(folder, "items")
+        self._leases_folder = join(folder, "leases")
+        self._done_folder = join(folder, "done")
+        self._lease_seconds = lease_seconds
+        if worker_id is None:
+            worker_id = f"{socket.gethostname()}-{getpid()}"
+        self._worker_id = worker_id
+
+    def reset(self, key: str) -> bool:
+        # an unfinished queue for the same key is resumed, keeping completed items
+        try:
+            with open(join(self._folder, self.ready_filename)) as f:
+                if json.load(f)["key"] == key and not self.is_finished():
+                    logger.info(f"Resuming queue in {self._folder}")
+                    return True
+        except FileNotFoundError:
+            pass
+        # workers stop taking the queue as ready before it is cleared
+        ready_path = join(self._folder, self.ready_filename)
+        if exists(ready_path):
+            remove(ready_path)
+        for folder in (self._items_folder, self._leases_folder, self._done_folder):
+            rmtree(folder, ignore_errors=True)
+            makedirs(folder)
+        return False
+
+    def add(self, item_id: str, payload: Any) -> None:
+        write_atomically(
+            join(self._items_folder, f"{item_id}.pickle"),
+            pickle.dumps(payload, pickle.HIGHEST_PROTOCOL),
+        )
+
+    def mark_ready(self, key: str, context: dict) -> None:
+        write_atomically(
+            join(self._folder, self.ready_filename),
+            json.dumps({"key": key, "context": context}).encode(),
+        )
+
+    def read_ready(self) -> dict | None:
+        try:
+            with open(join(self._folder, self.ready_filename)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def wait_until_ready(self, poll_seconds: float = 5) -> dict:
+        # a finished queue is left by a previous run so its context is only used
+        # if the queue is still the same after checking that it is unfinished
+        while True:
+            ready = self.read_ready()
+            if ready is not None:
+                try:
+                    finished = self.is_finished()
+                except FileNotFoundError:
+                    # the queue is being cleared
+                    finished = True
+                if not finished and self.read_ready() == ready:
+                    return ready["context"]
+            logger.info(f"Waiting for an unfinished queue in {self._folder}")
+            time.sleep(poll_seconds)
+
+    def get_item_ids(self) -> list[str]:
+        return sorted(
+            filename[: -len(".pickle")]
+            for filename in listdir(self._items_folder)
+            if filename.endswith(".pickle")
+        )
+
+    def get_done_ids(self) -> set[str]:
+        return {
+            filename[: -len(".json")]
+            for filename in listdir(self._done_folder)
+            if filename.endswith(".json")
+        }
+
+    def is_finished(self) -> bool:
+        return self.get_done_ids().issuperset(self.get_item_ids())
+
+    @staticmethod
+    def read_lease(path: str) -> tuple[str, float]:
+        with open(path) as f:
+            return f.read(), getmtime(path)
+
+    def acquire(self, item_id: str) -> bool:
+        path = join(self._leases_folder, item_id)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                lease = self.read_lease(path)
+                if time.time() - lease[1] < self._lease_seconds:
+                    return False
+                # only one worker can move an expired lease out of the way
+                stale_path = f"{path}.{self._worker_id}.stale"
+                rename(path, stale_path)
+            except FileNotFoundError:
+                return False
+            if self.read_lease(stale_path) != lease:
+                # another worker took over or renewed the lease after it was
+                # checked, so it is put back unless a third worker has claimed it
+                try:
+                    os.link(stale_path, path)
+                except FileExistsError:
+                    pass
+                remove(stale_path)
+                return False
+            remove(stale_path)
+            logger.warning(f"Taking over expired lease on {item_id}")
+            return self.acquire(item_id)
+        os.write(fd, self._worker_id.encode())
+        os.close(fd)
+        return True
+
+    def claim(self) -> tuple[str, Any] | None:
+        done_ids = self.get_done_ids()
+        for item_id in self.get_item_ids():
+            if item_id in done_ids or not self.acquire(item_id):
+                continue
+            if exists(join(self._done_folder, f"{item_id}.json")):
+                # completed just before its lease expired
+                remove(join(self._leases_folder, item_id))
+                continue
+            with open(join(self._items_folder, f"{item_id}.pickle"), "rb") as f:
+                return item_id, pickle.load(f)
+        return None
+
+    def renew(self, item_id: str) -> bool:
+        path = join(self._leases_folder, item_id)
+        try:
+            with open(path) as f:
+                if f.read() == self._worker_id:
+                    utime(path)
+                    return True
+        except FileNotFoundError:
+            pass
+        logger.warning(f"Lease on {item_id} was lost")
+        return False
+
+    @contextmanager
+    def heartbeat(self, item_id: str) -> Iterator[None]:
+        # the lease is renewed well before it expires for as long as the item is
+        # worked on, so a slow item is not taken over by another worker
+        stopped = threading.Event()
+
+        def renew():
+            while not stopped.wait(self._lease_seconds / 3):
+                if not self.renew(item_id):
+                    return
+
+        thread = threading.Thread(target=renew, name=f"lease-{item_id}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+
+    def complete(self, item_id: str, result: dict) -> None:
+        write_atomically(
+            join(self._done_folder, f"{item_id}.json"), json.dumps(result).encode()
+        )
+        try:
+            remove(join(self._leases_folder, item_id))
+        except FileNotFoundError:
+            pass
+
+    def get_results(self) -> dict[str, dict]:
+        results = {}
+        for item_id in sorted(self.get_done_ids()):
+            with open(join(self._done_folder, f"{item_id}.json")) as f:
+                results[item_id] = json.load(f)
+        return results
+
+    def work(
+        self,
+        function: Callable[[str, Any], dict],
+        poll_seconds: float = 5,
+    ) -> int:
+        # items leased by other workers are waited on in case their leases expire
+        no_items = 0
+        while not self.is_finished():
+            claimed = self.claim()
+            if claimed is None:
+                time.sleep(poll_seconds)
+                continue
+            item_id, payload = claimed
+            with self.heartbeat(item_id):
+                result = function(item_id, payload)
+            self.complete(item_id, result)
+            no_items += 1
+        logger.info(f"Worker {self._worker_id} completed {no_items} items")
+        return no_items
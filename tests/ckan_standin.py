@@ -0,0 +1,334 @@
+"""In-process stand-in for the parts of the HDX CKAN action API used by the
+scraper, so that publishing can be run end to end without network access"""
+
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from copy import deepcopy
+from email.parser import BytesParser
+from email.policy import HTTP
+from fnmatch import fnmatchcase
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+organizations = [
+    {
+        "id": "00547685-9ded-4d69-9ca5-47d5278ead7c",
+        "name": "oxford-poverty-human-development-initiative",
+    },
+    {"id": "40d10ece-49de-4791-9aed-e164f1d16dd1", "name": "hdx-hapi"},
+]
+
+
+class CKANError(Exception):
+    def __init__(self, status: int, type: str, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+        self.type = type
+        self.message = message
+
+
+def not_found(message: str) -> CKANError:
+    return CKANError(404, "Not Found Error", f"Not found: {message}")
+
+
+def merge(original: dict, update: dict) -> None:
+    # as CKAN's package_revise: dicts are merged recursively and lists of dicts
+    # are merged element by element with any extra elements appended
+    for key, value in update.items():
+        current = original.get(key)
+        if isinstance(value, dict) and isinstance(current, dict):
+            merge(current, value)
+        elif isinstance(value, list) and isinstance(current, list):
+            for i, element in enumerate(value):
+                if i >= len(current):
+                    current.append(deepcopy(element))
+                elif isinstance(element, dict) and isinstance(current[i], dict):
+                    merge(current[i], element)
+                else:
+                    current[i] = deepcopy(element)
+        else:
+            original[key] = deepcopy(value)
+
+
+def remove_path(package: dict, path: str) -> None:
+    *parents, last = path.split("__")
+    target = package
+    for part in parents:
+        target = target[int(part)] if isinstance(target, list) else target[part]
+    if isinstance(target, list):
+        del target[int(last)]
+    else:
+        target.pop(last, None)
+
+
+def get_field(package: dict, field: str) -> str:
+    if field == "organization":
+        for organization in organizations:
+            if organization["id"] == package.get("owner_org"):
+                return organization["name"]
+        return ""
+    if field == "dataset_type":
+        return package.get("type", "dataset")
+    return str(package.get(field, ""))
+
+
+def matches(package: dict, fq: str) -> bool:
+    # the part of Solr's syntax the scraper's filter queries use: field:value
+    # terms with wildcards, joined by AND binding tighter than OR
+    for clause in fq.replace("(", "").replace(")", "").split(" OR "):
+        terms = [term.split(":", 1) for term in clause.split(" AND ")]
+        if all(fnmatchcase(get_field(package, field), value) for field, value in terms):
+            return True
+    return False
+
+
+class CKANStandIn:
+    """Serves the CKAN actions the scraper calls from memory. Every call is counted
+    by action, as are the connections made. latency (seconds) is added to each call and failures maps an action
+    to the number of times it should fail with failure_status before succeeding."""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        failures: dict[str, int] | None = None,
+        failure_status: int = 500,
+    ) -> None:
+        self.latency = latency
+        self.failures = dict(failures or {})
+        self.failure_status = failure_status
+        self.calls = Counter()
+        self.connections = 0
+        self.uploads = []
+        self.unknown_actions = Counter()
+        self.packages = {}
+        self.showcases = {}
+        self.showcase_packages = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.url = None
+
+    def __enter__(self) -> "CKANStandIn":
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keeps connections alive so that clients can reuse them
+            protocol_version = "HTTP/1.1"
+            # otherwise each response waits on the client's delayed ACK
+            disable_nagle_algorithm = True
+
+            def setup(self) -> None:
+                super().setup()
+                with standin._lock:
+                    standin.connections += 1
+
+            def do_POST(self) -> None:
+                standin.handle(self)
+
+            def log_message(self, format: str, *args) -> None:
+                logger.debug(format % args)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        host, port = self._server.server_address
+        self.url = f"http://{host}:{port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def reset_counts(self) -> None:
+        self.calls = Counter()
+        self.connections = 0
+        self.uploads = []
+
+    @property
+    def upload_bytes(self) -> int:
+        return sum(size for _, size in self.uploads)
+
+    @staticmethod
+    def read_request(handler: BaseHTTPRequestHandler) -> tuple[dict, dict]:
+        length = int(handler.headers.get("Content-Length", 0))
+        body = handler.rfile.read(length)
+        content_type = handler.headers.get("Content-Type", "")
+        if not content_type.startswith("multipart/form-data"):
+            return (json.loads(body) if body else {}), {}
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        data = {}
+        files = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True)
+            filename = part.get_filename()
+            if filename:
+                files[name] = (filename, payload)
+            else:
+                data[name] = payload.decode("utf-8")
+        return data, files
+
+    def handle(self, handler: BaseHTTPRequestHandler) -> None:
+        action = handler.path.rstrip("/").rsplit("/", 1)[-1]
+        data, files = self.read_request(handler)
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[action] += 1
+            try:
+                if self.failures.get(action):
+                    self.failures[action] -= 1
+                    raise CKANError(
+                        self.failure_status,
+                        "Internal Error",
+                        f"Injected {action} failure",
+                    )
+                function = getattr(self, f"action_{action}", None)
+                if function is None:
+                    self.unknown_actions[action] += 1
+                    raise CKANError(400, "Bad Request", f"Unknown action {action}")
+                status = 200
+                response = {"success": True, "result": function(data, files)}
+            except CKANError as ex:
+                status = ex.status
+                response = {
+                    "success": False,
+                    "error": {"__type": ex.type, "message": ex.message},
+                }
+        body = json.dumps(response, default=str).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def get_package(self, id_or_name: str) -> dict:
+        package = self.packages.get(id_or_name)
+        if package:
+            return package
+        for package in self.packages.values():
+            if package["name"] == id_or_name:
+                return package
+        raise not_found(f"package {id_or_name}")
+
+    def prepare_resources(self, package: dict, files: dict) -> None:
+        for resource in package.get("resources", []):
+            resource.setdefault("id", str(uuid4()))
+            resource["package_id"] = package["id"]
+        for field, (filename, content) in files.items():
+            index = int(field.split("__")[2])
+            resource = package["resources"][index]
+            resource["url"] = (
+                f"{self.url}/dataset/{package['id']}/resource/{resource['id']}"
+                f"/download/{filename}"
+            )
+            self.uploads.append((filename, len(content)))
+
+    def action_organization_list_for_user(self, data: dict, files: dict) -> list:
+        return organizations
+
+    def action_package_show(self, data: dict, files: dict) -> dict:
+        return deepcopy(self.get_package(data["id"]))
+
+    def action_package_search(self, data: dict, files: dict) -> dict:
+        packages = [*self.packages.values(), *self.showcases.values()]
+        results = sorted(
+            (x for x in packages if matches(x, data.get("fq", "*:*"))),
+            key=lambda x: x["name"],
+        )
+        start = int(data.get("start", 0))
+        rows = int(data.get("rows", 10))
+        return {
+            "count": len(results),
+            "results": deepcopy(results[start : start + rows]),
+        }
+
+    def action_package_create(self, data: dict, files: dict) -> dict:
+        try:
+            self.get_package(data["name"])
+            raise CKANError(409, "Validation Error", "That URL is already in use.")
+        except CKANError as ex:
+            if ex.status != 404:
+                raise
+        package = deepcopy(data)
+        package["id"] = str(uuid4())
+        package["state"] = "active"
+        self.prepare_resources(package, files)
+        self.packages[package["id"]] = package
+        return deepcopy(package)
+
+    def action_package_revise(self, data: dict, files: dict) -> dict:
+        match = json.loads(data["match"])
+        package = self.get_package(match.get("id") or match["name"])
+        for path in json.loads(data.get("filter", "[]")):
+            if path.startswith("-"):
+                remove_path(package, path[1:])
+        merge(package, json.loads(data.get("update", "{}")))
+        self.prepare_resources(package, files)
+        return {"package": deepcopy(package)}
+
+    def action_package_resource_reorder(self, data: dict, files: dict) -> dict:
+        package = self.get_package(data["id"])
+        order = data["order"]
+        resources = package["resources"]
+        ordered = [x for id in order for x in resources if x["id"] == id]
+        ordered.extend(x for x in resources if x["id"] not in order)
+        package["resources"] = ordered
+        return {"id": package["id"], "order": [x["id"] for x in ordered]}
+
+    def action_package_create_default_resource_views(
+        self, data: dict, files: dict
+    ) -> list:
+        return []
+
+    def action_resource_view_create(self, data: dict, files: dict) -> dict:
+        return dict(data, id=str(uuid4()))
+
+    def get_showcase(self, id_or_name: str) -> dict:
+        showcase = self.showcases.get(id_or_name)
+        if showcase:
+            return showcase
+        for showcase in self.showcases.values():
+            if showcase["name"] == id_or_name:
+                return showcase
+        raise not_found(f"showcase {id_or_name}")
+
+    def action_ckanext_showcase_show(self, data: dict, files: dict) -> dict:
+        return deepcopy(self.get_showcase(data["id"]))
+
+    def action_ckanext_showcase_create(self, data: dict, files: dict) -> dict:
+        showcase = deepcopy(data)
+        showcase["id"] = str(uuid4())
+        showcase["type"] = "showcase"
+        self.showcases[showcase["id"]] = showcase
+        self.showcase_packages[showcase["id"]] = []
+        return deepcopy(showcase)
+
+    def action_ckanext_showcase_update(self, data: dict, files: dict) -> dict:
+        showcase = self.get_showcase(data.get("id") or data["name"])
+        merge(showcase, data)
+        return deepcopy(showcase)
+
+    def action_ckanext_showcase_package_list(self, data: dict, files: dict) -> list:
+        showcase = self.get_showcase(data["showcase_id"])
+        return [
+            deepcopy(self.packages[id]) for id in self.showcase_packages[showcase["id"]]
+        ]
+
+    def action_ckanext_showcase_package_association_create(
+        self, data: dict, files: dict
+    ) -> dict:
+        showcase = self.get_showcase(data["showcase_id"])
+        package = self.get_package(data["package_id"])
+        package_ids = self.showcase_packages[showcase["id"]]
+        if package["id"] not in package_ids:
+            package_ids.append(package["id"])
+        return {"showcase_id": showcase["id"], "package_id": package["id"]}
@@ -0,0 +1,54 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from hdx.scraper.ophi.admin1_matcher import Admin1Matcher
+
+
+class AdminOne:
+    def __init__(self):
+        self.calls = []
+
+    def get_pcode(self, countryiso3, name):
+        self.calls.append((countryiso3, name))
+        return f"{countryiso3[:2]}{len(name):02d}", True
+
+
+class SlowAdminOne(AdminOne):
+    def __init__(self):
+        super().__init__()
+        self.active = 0
+        self.most_active = 0
+
+    def get_pcode(self, countryiso3, name):
+        self.active += 1
+        self.most_active = max(self.most_active, self.active)
+        time.sleep(0.001)
+        self.active -= 1
+        return super().get_pcode(countryiso3, name)
+
+
+class TestAdmin1Matcher:
+    def test_match(self):
+        adminone = AdminOne()
+        matcher = Admin1Matcher(adminone)
+        pcodes = matcher.match(
+            [("AFG", "Kabul"), ("ETH", "Afar"), ("AFG", "Kabul"), ("AFG", "Balkh")]
+        )
+        assert pcodes[("AFG", "Kabul")] == "AF05"
+        assert pcodes[("ETH", "Afar")] == "ET04"
+        assert adminone.calls == [("AFG", "Balkh"), ("AFG", "Kabul"), ("ETH", "Afar")]
+        pcodes = matcher.match([("AFG", "Kabul"), ("ETH", "Amhara")])
+        assert pcodes[("ETH", "Amhara")] == "ET06"
+        assert adminone.calls[3:] == [("ETH", "Amhara")]
+        assert matcher.no_matched() == 4
+        assert matcher.match([("ETH", "Afar")]) == {("ETH", "Afar"): "ET04"}
+
+    def test_match_in_threads(self):
+        adminone = SlowAdminOne()
+        matcher = Admin1Matcher(adminone)
+        names = [("AFG", f"Name {i}") for i in range(20)]
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(matcher.match, [names] * 4))
+        assert adminone.most_active == 1
+        assert len(adminone.calls) == 20
+        assert all(result == results[0] for result in results)
@@ -0,0 +1,47 @@
+from os.path import exists, join
+
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.ophi.checkpoint import Checkpoint
+
+
+class TestCheckpoint:
+    def test_checkpoint(self):
+        with temp_dir("TestCheckpoint", delete_on_failure=False) as tempdir:
+            path = join(tempdir, "journal.jsonl")
+            checkpoint = Checkpoint(path, "abc")
+            assert checkpoint.is_done("global") is False
+            checkpoint.done("global", dataset_id="12", resource_ids=["34", "56"])
+            checkpoint.done("hapi")
+            with open(path, "a") as f:
+                f.write('{"inputs_hash": "abc", "step": "data')
+
+            checkpoint = Checkpoint(path, "abc")
+            assert checkpoint.is_done("global") is True
+            assert checkpoint.get("global") == {
+                "dataset_id": "12",
+                "resource_ids": ["34", "56"],
+            }
+            assert checkpoint.is_done("hapi") is True
+            assert checkpoint.is_done("dataset AFG") is False
+            checkpoint.done("dataset AFG", dataset_id="78")
+            checkpoint = Checkpoint(path, "abc")
+            assert checkpoint.get("dataset AFG") == {"dataset_id": "78"}
+
+            checkpoint = Checkpoint(path, "def")
+            assert checkpoint.is_done("global") is False
+            checkpoint = Checkpoint(path, "abc")
+            assert checkpoint.is_done("global") is False
+
+            # a completed run leaves nothing to resume
+            checkpoint.done("global", dataset_id="12")
+            checkpoint.complete()
+            assert checkpoint.is_done("global") is False
+            assert not exists(path)
+            checkpoint = Checkpoint(path, "abc")
+            assert checkpoint.is_done("global") is False
+
+    def test_no_journal(self):
+        checkpoint = Checkpoint(None, "abc")
+        checkpoint.done("global", dataset_id="12")
+        assert checkpoint.is_done("global") is True
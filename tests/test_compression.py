@@ -0,0 +1,82 @@
+import gzip
+from os import makedirs
+from os.path import join
+
+import pytest
+from hdx.api.configuration import Configuration
+from hdx.data.resource import Resource
+from hdx.utilities.path import temp_dir
+from hdx.utilities.useragent import UserAgent
+
+from hdx.scraper.ophi.compression import Compressor, compress_file
+
+
+class Dataset:
+    def __init__(self, paths):
+        self._resources = [Resource() for _ in paths]
+        for resource, path in zip(self._resources, paths):
+            resource.set_file_to_upload(path)
+
+    def get_resources(self):
+        return self._resources
+
+
+class TestCompression:
+    content = b"Country ISO3,MPI\nAFG,0.272\n" * 100
+
+    def write(self, tempdir):
+        path = join(tempdir, "global_mpi.csv")
+        with open(path, "wb") as f:
+            f.write(self.content)
+        return path
+
+    def test_gzip(self):
+        with temp_dir("TestCompressionGzip", delete_on_failure=False) as tempdir:
+            path = self.write(tempdir)
+            folder = join(tempdir, "copies")
+            makedirs(folder)
+            compressed_path = compress_file(path, "gzip", folder)
+            assert compressed_path == join(folder, "global_mpi.csv.gz")
+            with gzip.open(compressed_path, "rb") as f:
+                assert f.read() == self.content
+            # no timestamp so the same data gives the same bytes
+            with open(compressed_path, "rb") as f:
+                first = f.read()
+            compress_file(path, "gzip", folder)
+            with open(compressed_path, "rb") as f:
+                assert f.read() == first
+
+    def test_zstd(self):
+        zstandard = pytest.importorskip("zstandard")
+        with temp_dir("TestCompressionZstd", delete_on_failure=False) as tempdir:
+            path = self.write(tempdir)
+            compressed_path = compress_file(path, "zstd")
+            assert compressed_path == f"{path}.zst"
+            with open(compressed_path, "rb") as f:
+                reader = zstandard.ZstdDecompressor().stream_reader(f)
+                assert reader.read() == self.content
+
+    @pytest.fixture(scope="class")
+    def configuration(self):
+        UserAgent.set_global("test")
+        Configuration._create(hdx_read_only=True, hdx_site="prod")
+        return Configuration.read()
+
+    def test_compressor(self, configuration, monkeypatch):
+        monkeypatch.setattr(Resource, "_formats_dict", {"gzip": "gzip", "zst": "zst"})
+        with pytest.raises(ValueError):
+            Compressor("bzip2")
+        with temp_dir("TestCompressor", delete_on_failure=False) as tempdir:
+            path = self.write(tempdir)
+            compressor = Compressor("gzip")
+            assert compressor.format == "gzip"
+            assert compressor.submit(path) == f"{path}.gz"
+            compressor.wait(Dataset([path, f"{path}.gz"]))
+            with gzip.open(f"{path}.gz", "rb") as f:
+                assert f.read() == self.content
+            compressor.shutdown()
+        # a compression HDX has no format for fails before any work is done
+        monkeypatch.setattr(Resource, "_formats_dict", {"gzip": "gzip"})
+        pytest.importorskip("zstandard")
+        with pytest.raises(ValueError, match="HDX does not accept zst"):
+            Compressor("zstd")
@@ -0,0 +1,75 @@
+from os.path import join
+
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.ophi.delta import RowDelta
+
+
+class TestDelta:
+    def test_delta(self):
+        rows = {
+            ("AFG", "", "2022"): {"Country ISO3": "AFG", "MPI": 0.27},
+            ("AFG", "AF01", "2022"): {"Country ISO3": "AFG", "MPI": 0.1},
+            ("ETH", "", "2019"): {"Country ISO3": "ETH", "MPI": 0.37},
+        }
+        with temp_dir("TestDelta", delete_on_failure=False) as tempdir:
+            path = join(tempdir, "delta.pickle")
+            delta = RowDelta({}, path)
+            assert delta.has_previous() is False
+            changes = delta.compare("standardised_mpi", rows)
+            assert len(changes["added"]) == 3
+            delta.save()
+
+            delta = RowDelta({}, path)
+            assert delta.has_previous() is True
+            assert delta.compare("standardised_mpi", rows) == {
+                "added": [],
+                "removed": [],
+                "changed": [],
+            }
+            new_rows = dict(rows)
+            del new_rows[("ETH", "", "2019")]
+            new_rows[("AFG", "AF01", "2022")] = {"Country ISO3": "AFG", "MPI": 0.2}
+            new_rows[("AFG", "AF02", "2022")] = {"Country ISO3": "AFG", "MPI": 0.3}
+            changes = delta.compare("standardised_mpi", new_rows)
+            assert changes == {
+                "added": [{"Country ISO3": "AFG", "MPI": 0.3}],
+                "removed": [{"Country ISO3": "ETH", "MPI": 0.37}],
+                "changed": [{"Country ISO3": "AFG", "MPI": 0.2}],
+            }
+            assert delta.compare("standardised_trends", {})["added"] == []
+            assert delta.get_summary() == (
+                "standardised_mpi: 1 added, 1 removed, 1 changed; "
+                "standardised_trends: 0 added, 0 removed, 0 changed"
+            )
+
+            changes_path = join(tempdir, "changes.csv")
+            no_rows = delta.write_changes(
+                changes_path,
+                ["Country ISO3", "MPI"],
+                ["standardised_mpi", "standardised_trends"],
+            )
+            assert no_rows == 3
+            with open(changes_path) as f:
+                assert f.read() == (
+                    "Table,Change,Country ISO3,MPI\n"
+                    "standardised_mpi,added,AFG,0.3\n"
+                    "standardised_mpi,removed,ETH,0.37\n"
+                    "standardised_mpi,changed,AFG,0.2\n"
+                )
+
+            # the previous rows are kept until the run saves
+            delta = RowDelta({}, path)
+            assert delta.compare("standardised_mpi", rows)["added"] == []
+
+            # each table's rows are streamed back from its own part of the file
+            trend_rows = {("AFG", "2019"): {"Country ISO3": "AFG", "MPI": 0.3}}
+            delta.compare("standardised_trends", trend_rows)
+            delta.save()
+            delta = RowDelta({}, path)
+            assert delta.compare("standardised_mpi", {})["removed"] == list(
+                rows.values()
+            )
+            assert delta.compare("standardised_trends", {})["removed"] == [
+                {"Country ISO3": "AFG", "MPI": 0.3}
+            ]
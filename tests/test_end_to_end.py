@@ -0,0 +1,264 @@
+import logging
+import time
+from collections import Counter
+from os.path import exists, join
+
+import pytest
+from ckan_standin import CKANStandIn
+from hdx.api.configuration import Configuration
+from hdx.api.locations import Locations
+from hdx.data.vocabulary import Vocabulary
+from hdx.location.country import Country
+from hdx.utilities.path import script_dir_plus_file, temp_dir
+from hdx.utilities.useragent import UserAgent
+
+from hdx.scraper.ophi.__main__ import main
+from hdx.scraper.ophi.dataset_generator import DatasetGenerator
+from hdx.scraper.ophi.delta import RowDelta
+from hdx.scraper.ophi.pipeline import Pipeline
+from hdx.scraper.ophi.work_queue import WorkQueue
+
+logger = logging.getLogger(__name__)
+
+
+def run_main(standin: CKANStandIn, **kwargs) -> tuple[float, Counter]:
+    standin.reset_counts()
+    start = time.perf_counter()
+    try:
+        main(**kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        logger.info(
+            f"Run took {elapsed:.1f}s making {standin.calls.total()} API calls "
+            f"over {standin.connections} connections "
+            f"and uploading {len(standin.uploads)} files "
+            f"({standin.upload_bytes} bytes): {dict(standin.calls)}"
+        )
+    return elapsed, standin.calls
+
+
+class TestEndToEnd:
+    @pytest.fixture(scope="function")
+    def standin(self):
+        with CKANStandIn() as standin:
+            yield standin
+
+    @pytest.fixture(scope="function")
+    def configuration(self, standin):
+        UserAgent.set_global("test")
+        Configuration._create(
+            hdx_url=standin.url,
+            hdx_key="test-key",
+            hdx_read_only=False,
+            project_config_yaml=script_dir_plus_file(
+                join("config", "project_configuration.yaml"), Pipeline
+            ),
+        )
+        Locations.set_validlocations(
+            [
+                {"name": countryiso3.lower(), "title": countryiso3}
+                for countryiso3 in Country.countriesdata()["countries"]
+            ]
+        )
+        Vocabulary._approved_vocabulary = {
+            "tags": [{"name": tag} for tag in DatasetGenerator.tags],
+            "id": "b891512e-9516-4bf5-962a-7a289772a2a1",
+            "name": "approved",
+        }
+        return Configuration.read()
+
+    @pytest.fixture(scope="class")
+    def input_dir(self):
+        return join("tests", "fixtures", "input")
+
+    def test_publish(self, configuration, standin, input_dir):
+        _, calls = run_main(standin, use_saved=True, saved_dir=input_dir)
+        assert not standin.unknown_actions
+        names = sorted(x["name"] for x in standin.packages.values())
+        assert len(names) == 114
+        assert "global-mpi" in names
+        assert "hdx-hapi-poverty-rate" in names
+        assert "afghanistan-mpi" in names
+        assert calls["package_create"] == 114
+        # connections to HDX are kept alive and reused, so there is at most one
+        # for each thread calling HDX at the same time: the main thread and the
+        # one publishing the global and HAPI datasets
+        assert standin.connections <= 2
+        assert calls["ckanext_showcase_create"] == len(standin.showcases)
+        afghanistan = next(
+            x for x in standin.packages.values() if x["name"] == "afghanistan-mpi"
+        )
+        assert [x["name"] for x in afghanistan["resources"]] == [
+            "Afghanistan MPI and Partial Indices",
+            "Afghanistan MPI Trends Over Time",
+        ]
+        assert all("/download/" in x["url"] for x in afghanistan["resources"])
+        first_uploads = len(standin.uploads)
+        first_calls = calls.total()
+
+        # unchanged files are not uploaded again and no more calls are made
+        _, calls = run_main(
+            standin, use_saved=True, saved_dir=input_dir, call_budget=first_calls
+        )
+        assert calls["package_create"] == 0
+        assert standin.connections <= 2
+        # existing datasets and showcases were found by the prefetch searches
+        assert calls["package_search"] == 2
+        assert calls["package_show"] == 0
+        assert calls["ckanext_showcase_show"] == 0
+        assert len(standin.packages) == 114
+        assert first_uploads > 0
+        assert standin.uploads == []
+
+    def test_resume(self, configuration, standin, input_dir):
+        with temp_dir("TestEndToEndResume", delete_on_failure=False) as tempdir:
+            checkpoint_file = join(tempdir, "checkpoint.jsonl")
+            # 5xx errors are retried by the HDX session so fail with a 400
+            standin.failure_status = 400
+            standin.failures["ckanext_showcase_create"] = 1
+            with pytest.raises(Exception):
+                run_main(
+                    standin,
+                    use_saved=True,
+                    saved_dir=input_dir,
+                    checkpoint_file=checkpoint_file,
+                )
+            created = len(standin.packages)
+            assert created == 3
+
+            _, calls = run_main(
+                standin,
+                use_saved=True,
+                saved_dir=input_dir,
+                checkpoint_file=checkpoint_file,
+            )
+            # the global, HAPI and first country datasets are not published again
+            assert calls["package_create"] == 114 - created
+            assert calls["package_show"] == 114 - created
+            assert len(standin.packages) == 114
+            # a completed run is not resumed
+            assert not exists(checkpoint_file)
+
+    def test_delta(self, configuration, standin, input_dir):
+        with temp_dir("TestEndToEndDelta", delete_on_failure=False) as tempdir:
+            delta_file = join(tempdir, "delta.pickle")
+            run_main(
+                standin, use_saved=True, saved_dir=input_dir, delta_file=delta_file
+            )
+            # there is nothing to compare with on the first run
+            packages = {x["name"]: x for x in standin.packages.values()}
+            resource_names = [x["name"] for x in packages["global-mpi"]["resources"]]
+            assert "MPI Changes Since Previous Update" not in resource_names
+
+            # resources are uploaded from memory
+            run_main(
+                standin,
+                use_saved=True,
+                saved_dir=input_dir,
+                delta_file=delta_file,
+                in_memory=True,
+            )
+            packages = {x["name"]: x for x in standin.packages.values()}
+            resource_names = [x["name"] for x in packages["global-mpi"]["resources"]]
+            assert resource_names[-1] == "MPI Changes Since Previous Update"
+            resource_names = [
+                x["name"] for x in packages["hdx-hapi-poverty-rate"]["resources"]
+            ]
+            assert resource_names[-1] == "Poverty Rate Changes Since Previous Update"
+            # only the header rows of the two changes files are uploaded
+            assert sorted(filename for filename, _ in standin.uploads) == [
+                "global_mpi_changes.csv",
+                "hdx_hapi_poverty_rate_global_changes.csv",
+            ]
+
+    def test_delta_after_failure(self, configuration, standin, input_dir):
+        with temp_dir("TestEndToEndDeltaFailure", delete_on_failure=False) as tempdir:
+            delta_file = join(tempdir, "delta.pickle")
+            # a previous run that had no rows so every row is added
+            delta = RowDelta({}, delta_file)
+            for table in (
+                "standardised_mpi",
+                "standardised_trends",
+                "hapi_poverty_rate",
+            ):
+                delta.compare(table, {})
+            delta.save()
+
+            # a country fails after the global and HAPI datasets are published
+            standin.failure_status = 400
+            standin.failures["ckanext_showcase_create"] = 1
+            with pytest.raises(Exception):
+                run_main(
+                    standin,
+                    use_saved=True,
+                    saved_dir=input_dir,
+                    delta_file=delta_file,
+                )
+            changes_sizes = dict(standin.uploads)
+            assert changes_sizes["global_mpi_changes.csv"] > 1000
+            # the failed run's rows are not stored
+            delta = RowDelta({}, delta_file)
+            assert delta.compare("standardised_mpi", {})["removed"] == []
+
+            # so the rerun publishes the same changes rather than none
+            run_main(
+                standin, use_saved=True, saved_dir=input_dir, delta_file=delta_file
+            )
+            packages = {x["name"]: x for x in standin.packages.values()}
+            assert len(packages) == 114
+            uploads = dict(standin.uploads)
+            for filename in (
+                "global_mpi_changes.csv",
+                "hdx_hapi_poverty_rate_global_changes.csv",
+            ):
+                # an unchanged file is not uploaded again
+                assert (
+                    uploads.get(filename, changes_sizes[filename])
+                    == (changes_sizes[filename])
+                )
+            # the successful run's rows are stored
+            delta = RowDelta({}, delta_file)
+            assert delta.compare("standardised_mpi", {})["removed"]
+
+    def test_subset(self, configuration, standin, input_dir):
+        with temp_dir("TestEndToEndSubset", delete_on_failure=False) as tempdir:
+            sqlite_file = join(tempdir, "ophi.sqlite")
+            with open(sqlite_file, "w") as f:
+                f.write("all countries")
+            run_main(
+                standin,
+                use_saved=True,
+                saved_dir=input_dir,
+                countries=["AFG"],
+                sqlite_file=sqlite_file,
+            )
+            # only the country's dataset is published
+            assert [x["name"] for x in standin.packages.values()] == ["afghanistan-mpi"]
+            # and the database of every country is left alone
+            with open(sqlite_file) as f:
+                assert f.read() == "all countries"
+
+    def test_sharded(self, configuration, standin, input_dir):
+        with temp_dir("TestEndToEndSharded", delete_on_failure=False) as tempdir:
+            shard_folder = join(tempdir, "queue")
+            _, calls = run_main(
+                standin,
+                use_saved=True,
+                saved_dir=input_dir,
+                shard_folder=shard_folder,
+            )
+            assert calls["package_create"] == 114
+            results = WorkQueue(shard_folder).get_results()
+            # the global and HAPI datasets are published by the coordinator
+            assert len(results) == 112
+            assert all(result["fingerprint"] for result in results.values())
+
+            # a finished queue is not resumed so a rerun publishes the countries
+            _, calls = run_main(
+                standin,
+                use_saved=True,
+                saved_dir=input_dir,
+                shard_folder=shard_folder,
+            )
+            assert calls["package_revise"] == 114
+            assert len(WorkQueue(shard_folder).get_results()) == 112
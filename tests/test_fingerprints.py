@@ -0,0 +1,51 @@
+from datetime import UTC, datetime
+from os.path import join
+
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.ophi.fingerprints import Fingerprints
+
+
+class TestFingerprints:
+    def test_fingerprints(self):
+        rows = {
+            ("AFG", "", "2022"): {"Country ISO3": "AFG", "MPI": 0.27},
+            ("AFG", "AF01", "2022"): {"Country ISO3": "AFG", "MPI": 0.1},
+        }
+        trend_rows = {("AFG", "", "2015"): {"Country ISO3": "AFG", "MPI": 0.3}}
+        date_range = {
+            "start": datetime(2015, 1, 1, tzinfo=UTC),
+            "end": datetime(2022, 12, 31, tzinfo=UTC),
+        }
+        url = "https://ophi.org.uk/afg"
+        fingerprint = Fingerprints.calculate(
+            rows, trend_rows, date_range, url, "config"
+        )
+        reordered = dict(reversed(rows.items()))
+        assert Fingerprints.calculate(
+            reordered, trend_rows, date_range, url, "config"
+        ) == (fingerprint)
+        assert (
+            Fingerprints.calculate(rows, {}, date_range, url, "config") != fingerprint
+        )
+        assert Fingerprints.calculate(rows, trend_rows, date_range, None, "config") != (
+            fingerprint
+        )
+        # static metadata is published into every country dataset
+        assert Fingerprints.calculate(rows, trend_rows, date_range, url, "other") != (
+            fingerprint
+        )
+
+        with temp_dir("TestFingerprints", delete_on_failure=False) as tempdir:
+            path = join(tempdir, "fingerprints.json")
+            fingerprints = Fingerprints(path)
+            assert fingerprints.is_unchanged("AFG", fingerprint) is False
+            fingerprints.update("AFG", fingerprint)
+            fingerprints = Fingerprints(path)
+            assert fingerprints.is_unchanged("AFG", fingerprint) is True
+            assert fingerprints.is_unchanged("AFG", "changed") is False
+            assert fingerprints.is_unchanged("ETH", fingerprint) is False
+
+        fingerprints = Fingerprints(None)
+        fingerprints.update("AFG", fingerprint)
+        assert fingerprints.is_unchanged("AFG", fingerprint) is True
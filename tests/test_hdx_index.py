@@ -0,0 +1,60 @@
+from hdx.scraper.ophi.hdx_index import HDXIndex
+
+
+class Configuration:
+    def __init__(self, packages):
+        self.packages = packages
+        self.calls = []
+
+    def call_remoteckan(self, action, data=None, **kwargs):
+        self.calls.append((action, data))
+        if action == "package_search":
+            results = [
+                x
+                for x in self.packages
+                if (x.get("type") == "showcase") == ("showcase" in data["fq"])
+            ]
+            start = data["start"]
+            return {
+                "count": len(results),
+                "results": results[start : start + data["rows"]],
+            }
+        return {"live": data["id"]}
+
+
+class TestHDXIndex:
+    def test_hdx_index(self):
+        packages = [
+            {"id": "1", "name": "afghanistan-mpi", "resources": [{"id": "r1"}]},
+            {"id": "2", "name": "albania-mpi", "resources": []},
+            {"id": "3", "name": "angola-mpi", "resources": []},
+            {"id": "4", "name": "afghanistan-mpi-showcase", "type": "showcase"},
+        ]
+        configuration = Configuration(packages)
+        with HDXIndex(configuration, page_size=2) as index:
+            index.prefetch("organization:ophi", "name:*-mpi-showcase")
+            # two pages of datasets and one of showcases
+            assert index.searches == 3
+            dataset = configuration.call_remoteckan(
+                "package_show", {"id": "afghanistan-mpi"}
+            )
+            assert dataset == packages[0]
+            assert dataset is not packages[0]
+            # an entry only answers one read whether by name or id
+            assert configuration.call_remoteckan("package_show", {"id": "1"}) == {
+                "live": "1"
+            }
+            assert (
+                configuration.call_remoteckan("package_show", {"id": "2"})["name"]
+                == "albania-mpi"
+            )
+            showcase = configuration.call_remoteckan(
+                "ckanext_showcase_show", {"id": "afghanistan-mpi-showcase"}
+            )
+            assert showcase["id"] == "4"
+            assert configuration.call_remoteckan(
+                "package_show", {"id": "bahrain-mpi"}
+            ) == {"live": "bahrain-mpi"}
+            assert index.answered == 3
+        assert "call_remoteckan" not in vars(configuration)
+        assert [action for action, _ in configuration.calls].count("package_show") == 2
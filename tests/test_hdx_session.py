@@ -0,0 +1,26 @@
+import requests
+
+from hdx.scraper.ophi.hdx_session import configure_hdx_session
+
+
+class Configuration:
+    def __init__(self):
+        self.session = requests.Session()
+
+    def get_session(self):
+        return self.session
+
+
+class TestHDXSession:
+    def test_configure_hdx_session(self):
+        configuration = Configuration()
+        configure_hdx_session(configuration, pool_maxsize=2, retry_attempts=3)
+        session = configuration.session
+        adapter = session.get_adapter("https://data.humdata.org/api/action/x")
+        assert session.get_adapter("http://localhost") is adapter
+        assert adapter._pool_maxsize == 2
+        retries = adapter.max_retries
+        assert retries.total == 3
+        assert retries.backoff_jitter == 1
+        assert "POST" in retries.allowed_methods
+        assert 429 in retries.status_forcelist
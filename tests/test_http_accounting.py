@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+import requests
+from ckan_standin import CKANStandIn
+
+from hdx.scraper.ophi.http_accounting import HTTPAccounting, get_endpoint
+
+
+class TestHTTPAccounting:
+    def test_get_endpoint(self):
+        assert (
+            get_endpoint("GET", "https://example.org/a/b.csv?x=1")
+            == "GET example.org/a/b.csv"
+        )
+
+    def test_accounting(self):
+        with CKANStandIn() as standin:
+            url = f"{standin.url}/api/action/package_show"
+            with HTTPAccounting() as accounting:
+                requests.post(url, json={"id": "missing"})
+                accounting.stage("second")
+                with requests.Session() as session:
+                    for _ in range(2):
+                        session.post(url, json={"id": "missing"})
+            requests.post(url, json={"id": "missing"})
+        endpoint = get_endpoint("POST", url)
+        assert accounting.calls["start"] == {endpoint: 1}
+        assert accounting.calls["second"] == {endpoint: 2}
+        assert accounting.seconds["second"][endpoint] > 0
+        # requests made after exiting are not counted
+        assert accounting.total == 3
+        assert standin.calls["package_show"] == 4
+
+    def test_thread_stages(self):
+        with CKANStandIn() as standin:
+            url = f"{standin.url}/api/action/package_show"
+            with HTTPAccounting() as accounting:
+
+                def background():
+                    requests.post(url, json={"id": "missing"})
+                    accounting.stage("background")
+                    requests.post(url, json={"id": "missing"})
+
+                thread = threading.Thread(target=background)
+                thread.start()
+                thread.join()
+                requests.post(url, json={"id": "missing"})
+        endpoint = get_endpoint("POST", url)
+        # threads start in the main thread's stage
+        assert accounting.calls["start"] == {endpoint: 2}
+        assert accounting.calls["background"] == {endpoint: 1}
+
+    def test_budget(self):
+        with CKANStandIn() as standin:
+            url = f"{standin.url}/api/action/package_show"
+            with HTTPAccounting(2):
+                for _ in range(2):
+                    requests.post(url, json={"id": "missing"})
+            standin.reset_counts()
+            with pytest.raises(RuntimeError, match="call 3 exceeds budget of 2"):
+                with HTTPAccounting(2) as accounting:
+                    for _ in range(4):
+                        requests.post(url, json={"id": "missing"})
+            # the call beyond the budget is not sent
+            assert standin.calls["package_show"] == 2
+            assert accounting.total == 2
+            # a caller that swallows the error still fails the run at the end
+            with pytest.raises(RuntimeError, match="Tried to make 3 HTTP calls"):
+                with HTTPAccounting(2):
+                    for _ in range(3):
+                        try:
+                            requests.post(url, json={"id": "missing"})
+                        except RuntimeError:
+                            pass
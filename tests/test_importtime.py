@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Modules that pull in frictionless, ckanapi and the like and so should only be
+# imported once the pipeline actually runs
+heavy_modules = {
+    "ckanapi",
+    "frictionless",
+    "hdx.api.configuration",
+    "hdx.data.dataset",
+    "hdx.data.showcase",
+    "hdx.location.adminlevel",
+    "hdx.location.country",
+    "hdx.utilities.downloader",
+    "slugify",
+}
+
+
+def get_import_times(module: str) -> dict[str, int]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(sys.path)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        check=True,
+        env=env,
+        text=True,
+    )
+    import_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        import_times[name.strip()] = int(cumulative)
+    return import_times
+
+
+class TestImportTime:
+    @pytest.mark.parametrize(
+        "module",
+        (
+            "hdx.scraper.ophi.__main__",
+            "hdx.scraper.ophi.dataset_generator",
+            "hdx.scraper.ophi.hapi_dataset_generator",
+            "hdx.scraper.ophi.hapi_output",
+            "hdx.scraper.ophi.pipeline",
+            "hdx.scraper.ophi.watch",
+        ),
+    )
+    def test_no_heavy_imports(self, module):
+        import_times = get_import_times(module)
+        assert module in import_times
+        assert heavy_modules.isdisjoint(import_times)
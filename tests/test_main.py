@@ -1,5 +1,8 @@
+import gzip
+import json
 import logging
 from os.path import join
+from shutil import copyfile, copytree
 
 import pytest
 from hdx.api.configuration import Configuration
@@ -13,10 +16,12 @@ from hdx.utilities.path import script_dir_plus_file, temp_dir
 from hdx.utilities.retriever import Retrieve
 from hdx.utilities.useragent import UserAgent
 
+from hdx.scraper.ophi.compression import Compressor
 from hdx.scraper.ophi.dataset_generator import DatasetGenerator
 from hdx.scraper.ophi.hapi_dataset_generator import HAPIDatasetGenerator
 from hdx.scraper.ophi.hapi_output import HAPIOutput
 from hdx.scraper.ophi.pipeline import Pipeline
+from hdx.scraper.ophi.rowstore import RowBudget
 
 logger = logging.getLogger(__name__)
 
@@ -90,12 +95,10 @@ class TestOPHI:
                 adminone.setup_from_url()
 
                 pipeline = Pipeline(configuration, retriever, adminone)
-                mpi_national_path, mpi_subnational_path, trend_path = pipeline.process()
+                source_paths = pipeline.process()
                 dataset_generator = DatasetGenerator(
                     configuration,
-                    mpi_national_path,
-                    mpi_subnational_path,
-                    trend_path,
+                    source_paths,
                 )
 
                 standardised_global = pipeline.get_standardised_global()
@@ -515,3 +518,472 @@ class TestOPHI:
                     "title": "Afghanistan Multidimensional Poverty Index",
                     "url": "https://ophi.org.uk/media/45972/download",
                 }
+
+    def test_memory_budget(
+        self,
+        configuration,
+        fixtures_dir,
+        input_dir,
+    ):
+        with temp_dir(
+            "TestOPHIMemoryBudget",
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as tempdir:
+            with Download(user_agent="test") as downloader:
+                retriever = Retrieve(
+                    downloader,
+                    tempdir,
+                    input_dir,
+                    tempdir,
+                    save=False,
+                    use_saved=True,
+                )
+                adminone = AdminLevel(admin_level=1, retriever=retriever)
+                adminone.setup_from_url()
+
+                row_budget = RowBudget(500, tempdir)
+                pipeline = Pipeline(configuration, retriever, adminone, row_budget)
+                source_paths = pipeline.process()
+                dataset_generator = DatasetGenerator(
+                    configuration,
+                    source_paths,
+                )
+                standardised_global = pipeline.get_standardised_global()
+                standardised_global_trend = pipeline.get_standardised_global_trend()
+                standardised_countries = pipeline.get_standardised_countries()
+                standardised_countries_trend = (
+                    pipeline.get_standardised_countries_trend()
+                )
+                date_ranges = pipeline.get_date_ranges()
+                dataset_generator.write_resources(
+                    tempdir, standardised_global, standardised_global_trend
+                )
+                dataset_generator.generate_global_dataset(
+                    tempdir,
+                    standardised_global,
+                    standardised_global_trend,
+                    date_ranges["global"],
+                )
+                hapi_output = HAPIOutput(
+                    configuration,
+                    adminone,
+                    standardised_global,
+                    standardised_global_trend,
+                    row_budget,
+                )
+                rows = hapi_output.process("12", ["3456", "7890"])
+                hapi_dataset_generator = HAPIDatasetGenerator(configuration, rows)
+                hapi_dataset_generator.generate_poverty_rate_dataset(tempdir)
+                countryiso3 = "AFG"
+                dataset_generator.generate_dataset(
+                    tempdir,
+                    standardised_countries[countryiso3],
+                    standardised_countries_trend[countryiso3],
+                    countryiso3,
+                    Country.get_country_name_from_iso3(countryiso3),
+                    date_ranges[countryiso3],
+                )
+                assert row_budget.spills > 0
+                for filename in (
+                    "global_mpi.csv",
+                    "global_mpi_trends.csv",
+                    "hdx_hapi_poverty_rate_global.csv",
+                    "AFG_mpi.csv",
+                    "AFG_mpi_trends.csv",
+                ):
+                    expected_file = join(fixtures_dir, filename)
+                    actual_file = join(tempdir, filename)
+                    assert_files_same(expected_file, actual_file)
+                row_budget.cleanup()
+
+    def test_parse_cache(
+        self,
+        configuration,
+        input_dir,
+        monkeypatch,
+    ):
+        with temp_dir(
+            "TestOPHIParseCache",
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as tempdir:
+            with Download(user_agent="test") as downloader:
+                retriever = Retrieve(
+                    downloader,
+                    tempdir,
+                    input_dir,
+                    tempdir,
+                    save=False,
+                    use_saved=True,
+                )
+                adminone = AdminLevel(admin_level=1, retriever=retriever)
+                adminone.setup_from_url()
+
+                cache_folder = join(tempdir, "cache")
+                pipeline = Pipeline(
+                    configuration, retriever, adminone, cache_folder=cache_folder
+                )
+                pipeline.process()
+                standardised_global = pipeline.get_standardised_global()
+                standardised_global_trend = pipeline.get_standardised_global_trend()
+                date_ranges = pipeline.get_date_ranges()
+
+                def fail(*args):
+                    raise AssertionError("Parsed despite cache!")
+
+                pipeline = Pipeline(
+                    configuration, retriever, adminone, cache_folder=cache_folder
+                )
+                pipeline.read_sheet = fail
+                paths = pipeline.process()
+                assert pipeline.get_standardised_global() == standardised_global
+                assert (
+                    pipeline.get_standardised_global_trend()
+                    == standardised_global_trend
+                )
+                assert pipeline.get_date_ranges() == date_ranges
+
+                # upgrading a library that parsing depends on misses the cache
+                paths = tuple(paths.values())
+                layouts = configuration["datasetinfo"]["layouts"]
+                cache_path = pipeline.get_cache_path(paths, layouts)
+                monkeypatch.setattr(
+                    "hdx.scraper.ophi.pipeline.version", lambda name: "0.0.0"
+                )
+                assert pipeline.get_cache_path(paths, layouts) != cache_path
+
+    def test_countries(
+        self,
+        configuration,
+        fixtures_dir,
+        input_dir,
+    ):
+        with temp_dir(
+            "TestOPHICountries",
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as tempdir:
+            with Download(user_agent="test") as downloader:
+                retriever = Retrieve(
+                    downloader,
+                    tempdir,
+                    input_dir,
+                    tempdir,
+                    save=False,
+                    use_saved=True,
+                )
+                adminone = AdminLevel(admin_level=1, retriever=retriever)
+                adminone.setup_from_url()
+
+                pipeline = Pipeline(
+                    configuration, retriever, adminone, countries=["AFG", "eth"]
+                )
+                source_paths = pipeline.process()
+                standardised_global = pipeline.get_standardised_global()
+                standardised_global_trend = pipeline.get_standardised_global_trend()
+                standardised_countries = pipeline.get_standardised_countries()
+                standardised_countries_trend = (
+                    pipeline.get_standardised_countries_trend()
+                )
+                date_ranges = pipeline.get_date_ranges()
+                assert sorted(standardised_countries) == ["AFG", "ETH"]
+                assert {key[0] for key in standardised_global} == {"AFG", "ETH"}
+                assert {key[0] for key in standardised_global_trend} == {"AFG", "ETH"}
+                assert sorted(date_ranges) == ["AFG", "ETH", "global"]
+
+                dataset_generator = DatasetGenerator(
+                    configuration,
+                    source_paths,
+                )
+                countryiso3 = "AFG"
+                dataset_generator.generate_dataset(
+                    tempdir,
+                    standardised_countries[countryiso3],
+                    standardised_countries_trend[countryiso3],
+                    countryiso3,
+                    Country.get_country_name_from_iso3(countryiso3),
+                    date_ranges[countryiso3],
+                )
+                for filename in ("AFG_mpi.csv", "AFG_mpi_trends.csv"):
+                    expected_file = join(fixtures_dir, filename)
+                    actual_file = join(tempdir, filename)
+                    assert_files_same(expected_file, actual_file)
+
+    def test_releases(
+        self,
+        configuration,
+        input_dir,
+    ):
+        with temp_dir(
+            "TestOPHIReleases",
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as tempdir:
+            saved_dir = join(tempdir, "saved")
+            copytree(input_dir, saved_dir)
+            release = dict(configuration["datasetinfo"]["releases"][0], name="2024")
+            for filename in configuration["datasetinfo"]["filenames"].values():
+                copyfile(join(saved_dir, filename), join(saved_dir, f"2024-{filename}"))
+            with Download(user_agent="test") as downloader:
+                retriever = Retrieve(
+                    downloader,
+                    tempdir,
+                    saved_dir,
+                    tempdir,
+                    save=False,
+                    use_saved=True,
+                )
+                adminone = AdminLevel(admin_level=1, retriever=retriever)
+                adminone.setup_from_url()
+
+                pipeline = Pipeline(configuration, retriever, adminone)
+                paths = pipeline.process()
+                standardised_global = pipeline.get_standardised_global()
+                standardised_global_trend = pipeline.get_standardised_global_trend()
+                date_ranges = pipeline.get_date_ranges()
+
+                configuration["datasetinfo"]["releases"].append(release)
+                pipeline = Pipeline(configuration, retriever, adminone)
+                # the current release's workbooks are the ones published
+                assert pipeline.process() == paths
+                assert len(pipeline.get_input_paths()) == 6
+                # every row of the older release is already in the current one
+                assert pipeline.get_standardised_global() == standardised_global
+                assert (
+                    pipeline.get_standardised_global_trend()
+                    == standardised_global_trend
+                )
+                assert pipeline.get_date_ranges() == date_ranges
+
+                # an older release can be read with its own layouts and is
+                # checked by preflight, reusing its downloads
+                layouts = configuration["datasetinfo"]["layouts"]
+                columns = dict(
+                    layouts["mpi_national"]["columns"], survey="MPI data Survey"
+                )
+                layout = dict(layouts["mpi_national"], columns=columns)
+                release["layouts"] = {"mpi_national": layout}
+                pipeline = Pipeline(configuration, retriever, adminone)
+                with pytest.raises(ValueError) as ex:
+                    pipeline.preflight()
+                assert str(ex.value) == (
+                    "Layout preflight failed!\n"
+                    "Column MPI data Survey for layout 2024/mpi_national not found "
+                    "in sheet 1.1 National MPI Results (closest is mpi data source "
+                    "survey)"
+                )
+                release["layouts"] = {"mpi_national": layouts["mpi_national"]}
+                layouts_path = join(tempdir, "layouts.json")
+                pipeline = Pipeline(configuration, retriever, adminone)
+                pipeline.preflight(layouts_path)
+                with open(layouts_path) as f:
+                    assert sorted(json.load(f)) == sorted(
+                        [*layouts, "2024/mpi_national"]
+                    )
+                assert pipeline.process() == paths
+                assert len(pipeline.get_input_paths()) == 6
+                assert pipeline.get_standardised_global() == standardised_global
+
+    def test_preflight(self, configuration, input_dir, caplog):
+        with temp_dir(
+            "TestOPHIPreflight",
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as tempdir:
+            layouts_path = join(tempdir, "layouts.json")
+            with Download(user_agent="test") as downloader:
+                retriever = Retrieve(
+                    downloader,
+                    tempdir,
+                    input_dir,
+                    tempdir,
+                    save=False,
+                    use_saved=True,
+                )
+                # p-codes are not needed to check the layouts
+                adminone = AdminLevel(admin_level=1, retriever=retriever)
+                pipeline = Pipeline(configuration, retriever, adminone)
+                pipeline.preflight(layouts_path)
+                with open(layouts_path) as f:
+                    layouts = json.load(f)
+                assert sorted(layouts) == sorted(
+                    configuration["datasetinfo"]["layouts"]
+                )
+                assert "iso country code" in layouts["mpi_national"]["labels"]
+
+                # a header that changed but still has every column is logged
+                labels = layouts["mpi_national"]["labels"]
+                layouts["mpi_national"]["labels"] = [*labels[:-1], "old label"]
+                layouts["mpi_national"]["fingerprint"] = "old"
+                with open(layouts_path, "w") as f:
+                    json.dump(layouts, f)
+                pipeline = Pipeline(configuration, retriever, adminone)
+                with caplog.at_level(logging.WARNING):
+                    pipeline.preflight(layouts_path)
+                assert (
+                    "Header of sheet 1.1 National MPI Results for layout mpi_national "
+                    "changed" in caplog.text
+                )
+                assert "Removed: ['old label']" in caplog.text
+
+                layout = configuration["datasetinfo"]["layouts"]["mpi_subnational"]
+                layout["columns"]["admin1_name"] = "Subnational regions"
+                pipeline = Pipeline(configuration, retriever, adminone)
+                with pytest.raises(ValueError) as ex:
+                    pipeline.preflight(layouts_path)
+                assert str(ex.value) == (
+                    "Layout preflight failed!\n"
+                    "Column Subnational regions for layout mpi_subnational not "
+                    "found in sheet 5.1 MPI Region (closest is subnational region)"
+                )
+
+                layout["columns"]["admin1_name"] = "Subnational region"
+                layout["source"] = "mpi_regional"
+                pipeline = Pipeline(configuration, retriever, adminone)
+                with pytest.raises(ValueError) as ex:
+                    pipeline.preflight(layouts_path)
+                assert str(ex.value) == (
+                    "Layout preflight failed!\n"
+                    "Layout mpi_subnational reads source mpi_regional which is not "
+                    "in the release!"
+                )
+
+    def test_merge_release(self, configuration):
+        def add_rows(pipeline, rows):
+            for countryiso3, date_range, mpi in rows:
+                pipeline.add_row(
+                    countryiso3,
+                    "",
+                    "",
+                    date_range,
+                    {"Country ISO3": countryiso3, "MPI": mpi},
+                    pipeline._standardised_global,
+                    pipeline._standardised_countries,
+                    "test",
+                )
+
+        current = Pipeline(configuration, None, None)
+        add_rows(current, (("AFG", "2015-2016", "0.2"), ("ETH", "2019", "0.3")))
+        older = Pipeline(configuration, None, None)
+        add_rows(
+            older,
+            (
+                ("AFG", "2015-2016", "0.25"),
+                ("AFG", "2010-2011", "0.4"),
+                ("BDI", "2016-2017", "0.4"),
+            ),
+        )
+        current.merge_release("2024", older)
+        rows = current.get_standardised_global()
+        assert [
+            (key[0], key[3].year, row["MPI"]) for key, row in sorted(rows.items())
+        ] == [
+            ("AFG", 2010, "0.4"),
+            ("AFG", 2015, "0.2"),
+            ("BDI", 2016, "0.4"),
+            ("ETH", 2019, "0.3"),
+        ]
+        assert sorted(current.get_standardised_countries()) == ["AFG", "BDI", "ETH"]
+        assert len(current.get_standardised_countries()["AFG"]) == 2
+        date_ranges = current.get_date_ranges()
+        assert date_ranges["AFG"]["start"].year == 2010
+        assert date_ranges["global"]["start"] == date_ranges["AFG"]["start"]
+        assert date_ranges["global"]["end"] == date_ranges["ETH"]["end"]
+
+    def test_metadata_templates(self, configuration, monkeypatch):
+        from hdx.data.dataset import Dataset
+
+        dataset_generator = DatasetGenerator(configuration, None)
+        add_tags = Dataset.add_tags
+        calls = []
+
+        def count_add_tags(dataset, tags):
+            calls.append(tags)
+            return add_tags(dataset, tags)
+
+        monkeypatch.setattr(Dataset, "add_tags", count_add_tags)
+        afghanistan = dataset_generator.generate_dataset_metadata(
+            "Afghanistan Multidimensional Poverty Index", "Afghanistan MPI"
+        )
+        ethiopia = dataset_generator.generate_dataset_metadata(
+            "Ethiopia Multidimensional Poverty Index", "Ethiopia MPI"
+        )
+        assert len(calls) == 1
+        assert afghanistan["name"] == "afghanistan-mpi"
+        assert ethiopia["title"] == "Ethiopia Multidimensional Poverty Index"
+        assert afghanistan.get_tags() == DatasetGenerator.tags
+        # each dataset has its own copy of the template
+        afghanistan["tags"].append({"name": "extra"})
+        assert ethiopia.get_tags() == DatasetGenerator.tags
+
+        path = script_dir_plus_file(
+            join("config", "hdx_dataset_static.yaml"), DatasetGenerator
+        )
+        DatasetGenerator.update_from_static_metadata(afghanistan, path)
+        ethiopia.update_from_yaml(path)
+        for key in ("license_id", "methodology_other", "notes", "caveats"):
+            assert afghanistan[key] == ethiopia[key]
+
+    def test_compression(
+        self,
+        configuration,
+        fixtures_dir,
+        input_dir,
+    ):
+        with temp_dir(
+            "TestOPHICompression",
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as tempdir:
+            with Download(user_agent="test") as downloader:
+                retriever = Retrieve(
+                    downloader,
+                    tempdir,
+                    input_dir,
+                    tempdir,
+                    save=False,
+                    use_saved=True,
+                )
+                adminone = AdminLevel(admin_level=1, retriever=retriever)
+                adminone.setup_from_url()
+
+                pipeline = Pipeline(configuration, retriever, adminone)
+                source_paths = pipeline.process()
+                compressor = Compressor("gzip")
+                dataset_generator = DatasetGenerator(
+                    configuration,
+                    source_paths,
+                    compressor,
+                )
+                standardised_global = pipeline.get_standardised_global()
+                standardised_global_trend = pipeline.get_standardised_global_trend()
+                dataset_generator.write_resources(
+                    tempdir, standardised_global, standardised_global_trend
+                )
+                dataset = dataset_generator.generate_global_dataset(
+                    tempdir,
+                    standardised_global,
+                    standardised_global_trend,
+                    pipeline.get_date_ranges()["global"],
+                )
+                resources = dataset.get_resources()
+                assert [x["name"] for x in resources] == [
+                    "Global MPI and Partial Indices",
+                    "Global MPI Trends Over Time",
+                    "MPI and Partial Indices National Database",
+                    "MPI and Partial Indices Subnational Database",
+                    "Trends Over Time MPI Database",
+                    "Global MPI and Partial Indices (gzip)",
+                    "Global MPI Trends Over Time (gzip)",
+                ]
+                assert resources[5].get_format() == "gzip"
+                compressor.wait(dataset)
+                for resource, filename in (
+                    (resources[5], "global_mpi.csv"),
+                    (resources[6], "global_mpi_trends.csv"),
+                ):
+                    with gzip.open(resource.get_file_to_upload(), "rb") as f:
+                        with open(join(fixtures_dir, filename), "rb") as expected:
+                            assert f.read() == expected.read()
+                compressor.shutdown()
@@ -0,0 +1,73 @@
+from os import listdir, makedirs
+from os.path import dirname, exists, join
+
+import pytest
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.ophi.memory_folder import (
+    get_files_in_folder,
+    get_memory_tempdir,
+    get_resource_folder,
+    remove_files,
+)
+
+
+class Resource:
+    def __init__(self, path):
+        self._path = path
+
+    def get_file_to_upload(self):
+        return self._path
+
+
+class Dataset:
+    def __init__(self, paths):
+        self._resources = [Resource(path) for path in paths]
+
+    def get_resources(self):
+        return self._resources
+
+
+class TestMemoryFolder:
+    def test_get_memory_tempdir(self):
+        with temp_dir("TestMemoryFolder", delete_on_failure=False) as tempdir:
+            assert get_memory_tempdir(str(tempdir), 0) == str(tempdir)
+            assert get_memory_tempdir(join(tempdir, "missing"), 0) is None
+            assert get_memory_tempdir(str(tempdir), 2**62) is None
+
+    def test_get_resource_folder(self):
+        with temp_dir("TestMemoryFolderResources", delete_on_failure=False) as tempdir:
+            folder = join(tempdir, "batch")
+            memory = join(tempdir, "memory")
+            makedirs(memory)
+            with get_resource_folder(folder, False, "ophi", memory, 0) as path:
+                assert path == folder
+            with get_resource_folder(folder, True, "ophi", memory, 2**62) as path:
+                assert path == folder
+            with get_resource_folder(folder, True, "ophi", memory, 0) as path:
+                assert dirname(path) == memory
+                assert listdir(memory) == [path[len(memory) + 1 :]]
+            assert listdir(memory) == []
+            # a failed run leaves nothing in memory
+            with pytest.raises(ValueError):
+                with get_resource_folder(folder, True, "ophi", memory, 0) as path:
+                    with open(join(path, "AFG_mpi.csv"), "w") as f:
+                        f.write("a,b\n")
+                    raise ValueError
+            assert listdir(memory) == []
+
+    def test_remove_files(self):
+        with temp_dir("TestMemoryFolderRemove", delete_on_failure=False) as tempdir:
+            folder = join(tempdir, "batch")
+            saved_path = join(tempdir, "saved.xlsx")
+            paths = [join(folder, "AFG_mpi.csv"), join(folder, "AFG_mpi_trends.csv")]
+            dataset = Dataset([saved_path, *paths, None])
+            assert get_files_in_folder(dataset, folder) == paths
+            makedirs(folder)
+            for path in (saved_path, paths[0]):
+                with open(path, "w") as f:
+                    f.write("a,b\n")
+            # files that were never written are skipped
+            remove_files(get_files_in_folder(dataset, folder))
+            assert not exists(paths[0])
+            assert exists(saved_path)
@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+from os.path import exists, join
+
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.ophi.profiler import Profiler
+
+
+def work(n):
+    return sorted(str(i) for i in range(n))
+
+
+class TestProfiler:
+    def test_profiler(self):
+        with temp_dir("TestProfiler", delete_on_failure=False) as tempdir:
+            with Profiler(tempdir) as profiler:
+                work(10000)
+                profiler.stage("second")
+
+                def background():
+                    with profiler.thread_stage("background"):
+                        return work(10000)
+
+                with ThreadPoolExecutor(1, "publish") as executor:
+                    future = executor.submit(background)
+                    work(10000)
+                    future.result()
+            for filename in (
+                Profiler.pstats_filename,
+                Profiler.allocations_filename,
+                Profiler.collapsed_filename,
+                Profiler.stages_filename,
+            ):
+                assert exists(join(tempdir, filename))
+            with open(join(tempdir, Profiler.allocations_filename)) as f:
+                stages = [x for x in f if x.startswith("#####")]
+            assert [x.split()[1] for x in stages] == ["start", "second"]
+            # the background stage is timed without ending the main thread's
+            with open(join(tempdir, Profiler.stages_filename)) as f:
+                timings = [x.split(":")[0] for x in f.read().splitlines()]
+            assert timings == [
+                "MainThread start",
+                "publish_0 background",
+                "MainThread second",
+            ]
+            with open(join(tempdir, Profiler.collapsed_filename)) as f:
+                lines = f.read().splitlines()
+            assert any("work (test_profiler.py" in line for line in lines)
+
+    def test_disabled(self):
+        with Profiler(None) as profiler:
+            profiler.stage("ignored")
+        assert profiler.enabled is False
@@ -0,0 +1,26 @@
+import pytest
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.ophi.rowstore import RowBudget
+
+
+class TestRowStore:
+    def test_rowstore(self):
+        with temp_dir("TestRowStore", delete_on_failure=False) as tempdir:
+            budget = RowBudget(3, tempdir)
+            store = budget.new_store()
+            for i in (5, 1, 4, 2, 3, 6):
+                store[(i,)] = {"value": i}
+            assert budget.spills > 0
+            store[(4,)] = {"value": 40}
+            store[(2,)] = {"value": 20}
+            assert len(store) == 6
+            assert (7,) not in store
+            assert store[(1,)] == {"value": 1}
+            assert store[(4,)] == {"value": 40}
+            assert store[(2,)] == {"value": 20}
+            assert list(store) == [(i,) for i in range(1, 7)]
+            assert [x["value"] for x in store.values()] == [1, 20, 3, 40, 5, 6]
+            with pytest.raises(KeyError):
+                store[(7,)]
+            budget.cleanup()
@@ -0,0 +1,69 @@
+from datetime import UTC, datetime
+from os.path import join
+
+import pytest
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.ophi.rowstore import sorted_rows
+from hdx.scraper.ophi.shared_tables import SharedTables, write_tables
+
+
+def make_row(countryiso3, pcode, mpi, year):
+    start = datetime(year, 1, 1, tzinfo=UTC)
+    end = datetime(year, 12, 31, 23, 59, 59, 999999, tzinfo=UTC)
+    key = (countryiso3, pcode or "", "", start, end)
+    row = {
+        "Country ISO3": countryiso3,
+        "Admin 1 PCode": pcode,
+        "MPI": mpi,
+        "Survey": 2019 if countryiso3 == "ETH" else "DHS",
+        "Start Date": start,
+        "End Date": end,
+    }
+    return key, row
+
+
+class TestSharedTables:
+    def test_shared_tables(self):
+        rows = {
+            "AFG": dict(
+                [
+                    make_row("AFG", "AF02", "0.1000", 2022),
+                    make_row("AFG", None, "0.2720", 2022),
+                    make_row("AFG", "AF01", "", 2022),
+                ]
+            ),
+            "ETH": dict([make_row("ETH", None, "0.3670", 2019)]),
+        }
+        trend_rows = {"AFG": dict([make_row("AFG", None, "0.3000", 2015)])}
+        with temp_dir("TestSharedTables", delete_on_failure=False) as tempdir:
+            path = join(tempdir, "tables")
+            write_tables(
+                path, {"standardised_mpi": rows, "standardised_trends": trend_rows}
+            )
+            with SharedTables(path) as tables:
+                assert tables.get_countries("standardised_mpi") == ["AFG", "ETH"]
+                afg = tables.get_rows("standardised_mpi", "AFG")
+                assert len(afg) == 3
+                assert list(afg) == sorted(rows["AFG"])
+                assert dict(afg.items()) == rows["AFG"]
+                assert list(sorted_rows(afg)) == list(sorted_rows(rows["AFG"]))
+                key = ("AFG", "AF01", "", *list(afg)[1][3:])
+                assert afg[key]["MPI"] == ""
+                eth = tables.get_rows("standardised_mpi", "ETH")
+                assert dict(eth.items()) == rows["ETH"]
+                trends = tables.get_rows("standardised_trends", "AFG")
+                assert dict(trends.items()) == trend_rows["AFG"]
+                assert len(tables.get_rows("standardised_trends", "ETH")) == 0
+            with pytest.raises(ValueError):
+                afg.get_row(0)
+
+            with pytest.raises(ValueError):
+                write_tables(
+                    path,
+                    {
+                        "standardised_mpi": {
+                            "AFG": {("AFG",): {}, ("AFG", "AF01"): {"MPI": 1}}
+                        }
+                    },
+                )
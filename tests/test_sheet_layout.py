@@ -0,0 +1,96 @@
+from itertools import islice
+from os.path import join
+
+import pytest
+
+from hdx.scraper.ophi.sheet_layout import (
+    SheetLayout,
+    get_merged_ranges,
+    iter_header_rows,
+    merge_header_rows,
+)
+
+
+class TestSheetLayout:
+    layout = {
+        "source": "trend_over_time",
+        "sheet": "Trends",
+        "output": "trends",
+        "admin_level": 1,
+        "timepoints": ["t0", "t1"],
+        "columns": {
+            "country": "ISO country code",
+            "admin1_name": "Region",
+            "survey": "Source {timepoint} Survey",
+            "date_range": "Source {timepoint} Year",
+        },
+        "values": {"MPI": "MPI {timepoint} Range 0 to 1"},
+    }
+
+    def test_merge_header_rows(self):
+        header_rows = [
+            ["ISO\ncountry code", "Source", "Source"],
+            ["ISO\ncountry code", "Survey ", "Year"],
+        ]
+        assert merge_header_rows(header_rows) == [
+            "iso country code",
+            "source survey",
+            "source year",
+        ]
+
+    def test_iter_header_rows(self):
+        path = join("tests", "fixtures", "input", "subnational-results-mpi.xlsx")
+        merged_ranges = get_merged_ranges(path, "5.1 MPI Region")
+        assert (9, 5, 13, 5) in merged_ranges
+        with pytest.raises(KeyError):
+            get_merged_ranges(path, "Missing")
+        rows = iter_header_rows(path, "5.1 MPI Region")
+        header_rows = list(islice(rows, 4, 8))
+        rows.close()
+        # merged cells are filled across and down like a full read of the sheet
+        assert [row[4] for row in header_rows] == [
+            "MPI data source",
+            "MPI data source",
+            "Survey ",
+            "Survey ",
+        ]
+        assert header_rows[0][8:13] == ["Multidimensional poverty by region"] * 5
+
+    def test_sheet_layout(self):
+        layout = SheetLayout("trends_subnational", self.layout)
+        rows = iter(
+            [
+                ["Title", None, None, None, None, None, None, None],
+                ["ISO country code", "Region", "MPI", "Source", "Source"]
+                + ["MPI", "Source", "Source"],
+                [None, None, "t0", "t0", "t0", "t1", "t1", "t1"],
+                [None, None, "Range  0 to 1", "Survey", "Year"]
+                + ["Range 0 to 1", "Survey", "Year"],
+                ["AFG", "Kabul", 0.1, "DHS", "2015", 0.2, "MICS", "2022"],
+                ["AFG", "Kapisa", 0.3, "DHS", "2015", 0.4, "MICS", "2022"],
+            ]
+        )
+        labels, first_row = layout.read_header(rows)
+        assert first_row == ["AFG", "Kabul", 0.1, "DHS", "2015", 0.2, "MICS", "2022"]
+        assert next(rows)[1] == "Kapisa"
+        layout.compile(labels)
+        assert layout.country_index == 0
+        assert layout.admin1_name_index == 1
+        t0, t1 = layout.timepoint_columns
+        assert (t0.survey, t0.date_range, t0.values) == (3, 4, [("MPI", 2)])
+        assert (t1.survey, t1.date_range, t1.values) == (6, 7, [("MPI", 5)])
+
+        assert layout.find_missing(labels) == []
+        # a renamed column is reported with the closest label in the sheet
+        assert layout.find_missing(labels[:1] + ["regions"] + labels[2:6]) == [
+            ("Region", "regions"),
+            ("Source t1 Survey", "source t0 survey"),
+            ("Source t1 Year", "source t0 year"),
+        ]
+
+        with pytest.raises(ValueError):
+            layout.compile(labels[:6])
+        with pytest.raises(ValueError):
+            layout.read_header(iter([["Title"], [None]]))
+        with pytest.raises(ValueError):
+            SheetLayout("trends_subnational", dict(self.layout, output="trend"))
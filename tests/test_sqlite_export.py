@@ -0,0 +1,119 @@
+import sqlite3
+from datetime import UTC, datetime
+from os.path import exists, join
+
+import pytest
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.ophi.sqlite_export import SQLiteExport
+
+
+def make_row(countryiso3, admin1_code, admin1_name, mpi, year):
+    start_date = datetime(year, 1, 1, tzinfo=UTC)
+    end_date = datetime(year, 12, 31, tzinfo=UTC)
+    key = (countryiso3, admin1_code, admin1_name, start_date, end_date)
+    row = {
+        "Country ISO3": countryiso3,
+        "Admin 1 PCode": admin1_code,
+        "Admin 1 Name": admin1_name,
+        "MPI": mpi,
+        "Start Date": start_date,
+        "End Date": end_date,
+    }
+    return key, row
+
+
+class TestSQLiteExport:
+    def test_write(self):
+        configuration = {
+            "headers": [
+                "Country ISO3",
+                "Admin 1 PCode",
+                "Admin 1 Name",
+                "MPI",
+                "Start Date",
+                "End Date",
+            ],
+            "hapi_dataset": {
+                "resource": {
+                    "headers": [
+                        "location_code",
+                        "admin1_code",
+                        "admin_level",
+                        "mpi",
+                        "reference_period_start",
+                        "reference_period_end",
+                    ]
+                }
+            },
+        }
+        rows = dict(
+            (
+                make_row("ETH", "", "", "0.3670", 2019),
+                make_row("ETH", "ET01", "Tigray", "0.3953", 2019),
+                make_row("ETH", "ET04", "Oromia", "0.4151", 2019),
+                make_row("AFG", "", "", "0.2721", 2022),
+            )
+        )
+        trend_rows = dict(
+            (
+                make_row("ETH", "ET01", "Tigray", "0.4553", 2011),
+                make_row("ETH", "ET01", "Tigray", "0.3953", 2019),
+            )
+        )
+        hapi_rows = {
+            ("ETH", "", "", 2019): {
+                "location_code": "ETH",
+                "admin1_code": "",
+                "admin_level": 0,
+                "mpi": "0.3670",
+                "reference_period_start": datetime(2019, 1, 1, tzinfo=UTC),
+                "reference_period_end": datetime(2019, 12, 31, tzinfo=UTC),
+            }
+        }
+        with temp_dir("TestSQLiteExport", delete_on_failure=False) as tempdir:
+            path = join(tempdir, "ophi.sqlite")
+            for _ in range(2):
+                SQLiteExport(configuration, path).write(rows, trend_rows, hapi_rows)
+            connection = sqlite3.connect(path)
+            assert connection.execute(
+                "SELECT country_iso3, mpi FROM mpi_national ORDER BY country_iso3"
+            ).fetchall() == [("AFG", 0.2721), ("ETH", 0.367)]
+            assert connection.execute(
+                "SELECT country_iso3 FROM mpi_national WHERE mpi > 0.3"
+            ).fetchall() == [("ETH",)]
+            assert connection.execute(
+                "SELECT admin_1_pcode FROM mpi_subnational WHERE country_iso3 = 'ETH' "
+                "AND start_date >= '2010' AND end_date < '2020'"
+            ).fetchall() == [("ET01",), ("ET04",)]
+            assert connection.execute(
+                "SELECT COUNT(*) FROM mpi_trends WHERE admin_1_pcode = 'ET01'"
+            ).fetchone() == (2,)
+            assert connection.execute(
+                "SELECT reference_period_start FROM hapi_poverty_rate"
+            ).fetchall() == [("2019-01-01T00:00:00+00:00",)]
+            indexes = connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' ORDER BY name"
+            ).fetchall()
+            assert indexes == [
+                ("hapi_poverty_rate_index",),
+                ("mpi_national_index",),
+                ("mpi_subnational_index",),
+                ("mpi_trends_index",),
+            ]
+            assert connection.execute(
+                "SELECT admin_level, typeof(mpi), typeof(admin1_code) "
+                "FROM hapi_poverty_rate"
+            ).fetchall() == [(0, "real", "text")]
+            connection.close()
+            assert not exists(f"{path}.tmp")
+
+            # a failed export leaves the previous database in place
+            hapi_rows[("ETH", "", "", 2019)]["mpi"] = "n/a"
+            with pytest.raises(ValueError):
+                SQLiteExport(configuration, path).write(rows, trend_rows, hapi_rows)
+            connection = sqlite3.connect(path)
+            assert connection.execute(
+                "SELECT COUNT(*) FROM hapi_poverty_rate"
+            ).fetchone() == (1,)
+            connection.close()
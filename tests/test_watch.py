@@ -0,0 +1,131 @@
+import json
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from inspect import signature
+from os import utime
+from os.path import join
+
+import pytest
+import requests
+from hdx.utilities.path import temp_dir
+from hdx.utilities.useragent import UserAgent
+
+from hdx.scraper.ophi import watch as watch_module
+from hdx.scraper.ophi.__main__ import main
+from hdx.scraper.ophi.watch import Watcher, get_source_urls, watch
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def served_dir():
+    with temp_dir("TestWatch", delete_on_failure=False) as tempdir:
+        handler = partial(QuietHandler, directory=tempdir)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        host, port = server.server_address
+        yield tempdir, f"http://{host}:{port}"
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def write_file(path, text, mtime):
+    with open(path, "w") as f:
+        f.write(text)
+    utime(path, (mtime, mtime))
+
+
+class TestWatch:
+    def test_watcher(self, served_dir):
+        folder, url = served_dir
+        write_file(join(folder, "national.xlsx"), "national", 1700000000)
+        write_file(join(folder, "links.csv"), "links", 1700000000)
+        urls = [f"{url}/national.xlsx", f"{url}/links.csv"]
+        state_path = join(folder, "state.json")
+        metrics_path = join(folder, "metrics.json")
+        runs = []
+
+        def run():
+            runs.append(len(runs))
+            if len(runs) == 2:
+                raise ValueError("Failed run")
+
+        with requests.Session() as session:
+            watcher = Watcher(session, urls, run, state_path, metrics_path)
+            assert watcher.check_and_run() is True
+            assert watcher.check_and_run() is False
+            assert len(runs) == 1
+
+            # a failed run leaves the stored validators alone so is retried
+            write_file(join(folder, "links.csv"), "new links", 1700000100)
+            watcher.watch(0, max_checks=2)
+            assert len(runs) == 3
+            with open(metrics_path) as f:
+                metrics = json.load(f)
+            assert metrics["checks"] == 4
+            assert metrics["runs"] == 2
+            assert metrics["failed_runs"] == 1
+            assert metrics["changed"] == [f"{url}/links.csv"]
+            assert "last_run_error" not in metrics
+            assert metrics["last_run_seconds"] >= 0
+
+            # state and metrics carry over to a new watcher
+            watcher = Watcher(session, urls, run, state_path, metrics_path)
+            assert watcher.check_and_run() is False
+            assert watcher.metrics["checks"] == 5
+
+            # unreachable sources are recorded without running
+            watcher = Watcher(
+                session, [f"{url}/missing.csv"], run, state_path, metrics_path
+            )
+            assert watcher.check_and_run() is False
+            assert "404" in watcher.metrics["last_check_error"]
+            assert len(runs) == 3
+
+    def test_get_source_urls(self):
+        configuration = {
+            "datasetinfo": {
+                "releases": [
+                    {"name": "2025", "mpi_national": "a", "trend_over_time": "b"},
+                    {"name": "2024", "mpi_national": "c"},
+                ]
+            },
+            "showcaseinfo": {"urls": "d"},
+        }
+        assert get_source_urls(configuration) == ["a", "b", "c", "d"]
+
+    def test_watch_options(self, monkeypatch):
+        # every option of the pipeline can be given to watch
+        main_parameters = signature(main).parameters
+        watch_parameters = signature(watch).parameters
+        for name, parameter in main_parameters.items():
+            assert watch_parameters[name].default == parameter.default
+
+        class RunOnce:
+            def __init__(self, session, urls, run, state_path, metrics_path):
+                self._run = run
+
+            def watch(self, interval, max_checks):
+                self._run()
+
+        calls = []
+        monkeypatch.setattr(watch_module, "Watcher", RunOnce)
+        monkeypatch.setattr(watch_module, "get_source_urls", lambda x: [])
+        monkeypatch.setattr(watch_module, "main", lambda **kwargs: calls.append(kwargs))
+        monkeypatch.setattr(
+            "hdx.api.configuration.Configuration.read", staticmethod(lambda: {})
+        )
+        UserAgent.set_global("test")
+        watch(max_checks=1, countries=["AFG"], in_memory=True, call_budget=10)
+        assert len(calls) == 1
+        assert calls[0].keys() == main_parameters.keys()
+        assert calls[0]["countries"] == ["AFG"]
+        assert calls[0]["in_memory"] is True
+        assert calls[0]["call_budget"] == 10
+        assert calls[0]["save"] is False
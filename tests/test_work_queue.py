@@ -0,0 +1,163 @@
+import threading
+import time
+from os import listdir, utime
+from os.path import join
+
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.ophi.work_queue import WorkQueue
+
+
+def fill(queue, key, item_ids):
+    if not queue.reset(key):
+        for item_id in item_ids:
+            queue.add(item_id, {"item": item_id})
+        queue.mark_ready(key, {"batch": "abc"})
+
+
+class TestWorkQueue:
+    def test_claim_and_complete(self):
+        with temp_dir("TestWorkQueue", delete_on_failure=False) as tempdir:
+            queue = WorkQueue(tempdir, worker_id="one")
+            fill(queue, "hash", ["AFG", "ETH"])
+            assert queue.wait_until_ready() == {"batch": "abc"}
+            assert queue.claim() == ("AFG", {"item": "AFG"})
+            other = WorkQueue(tempdir, worker_id="two")
+            assert other.claim() == ("ETH", {"item": "ETH"})
+            assert other.claim() is None
+            queue.complete("AFG", {"result": 1})
+            assert not queue.is_finished()
+            other.complete("ETH", {"result": 2})
+            assert queue.is_finished()
+            assert queue.get_results() == {"AFG": {"result": 1}, "ETH": {"result": 2}}
+
+            # a finished queue starts afresh even for the same key
+            fill(queue, "hash", ["AFG", "ETH", "BDI"])
+            assert queue.get_results() == {}
+            assert queue.get_item_ids() == ["AFG", "BDI", "ETH"]
+            # an unfinished queue is resumed for the same key only
+            assert queue.claim() == ("AFG", {"item": "AFG"})
+            queue.complete("AFG", {"result": 1})
+            fill(queue, "hash", ["AFG", "ETH"])
+            assert queue.get_results() == {"AFG": {"result": 1}}
+            assert queue.get_item_ids() == ["AFG", "BDI", "ETH"]
+            fill(queue, "new hash", ["AFG", "ETH"])
+            assert queue.get_results() == {}
+            assert queue.get_item_ids() == ["AFG", "ETH"]
+
+    def test_expired_lease(self):
+        with temp_dir("TestWorkQueueLease", delete_on_failure=False) as tempdir:
+            crashed = WorkQueue(tempdir, lease_seconds=60, worker_id="crashed")
+            fill(crashed, "hash", ["AFG"])
+            assert crashed.claim()[0] == "AFG"
+            queue = WorkQueue(tempdir, lease_seconds=60, worker_id="live")
+            assert queue.claim() is None
+            utime(join(tempdir, "leases", "AFG"), (0, 0))
+            assert queue.claim() == ("AFG", {"item": "AFG"})
+            with open(join(tempdir, "leases", "AFG")) as f:
+                assert f.read() == "live"
+
+    def test_lease_taken_over_after_check(self):
+        with temp_dir("TestWorkQueueRace", delete_on_failure=False) as tempdir:
+            crashed = WorkQueue(tempdir, lease_seconds=60, worker_id="crashed")
+            fill(crashed, "hash", ["AFG"])
+            assert crashed.acquire("AFG")
+            path = join(tempdir, "leases", "AFG")
+            utime(path, (0, 0))
+            queue = WorkQueue(tempdir, lease_seconds=60, worker_id="slow")
+            read_lease = queue.read_lease
+            calls = []
+
+            def take_over_between(lease_path):
+                # another worker takes over the expired lease after this worker
+                # has checked it but before it is moved out of the way
+                lease = read_lease(lease_path)
+                if not calls:
+                    assert WorkQueue(tempdir, 60, worker_id="fast").acquire("AFG")
+                calls.append(lease_path)
+                return lease
+
+            queue.read_lease = take_over_between
+            assert queue.acquire("AFG") is False
+            with open(path) as f:
+                assert f.read() == "fast"
+            assert listdir(join(tempdir, "leases")) == ["AFG"]
+
+    def test_heartbeat(self):
+        with temp_dir("TestWorkQueueHeartbeat", delete_on_failure=False) as tempdir:
+            queue = WorkQueue(tempdir, lease_seconds=0.3, worker_id="slow")
+            fill(queue, "hash", ["AFG"])
+            other = WorkQueue(tempdir, lease_seconds=0.3, worker_id="other")
+
+            def process(item_id, payload):
+                # the lease would have expired twice over without renewal
+                for _ in range(6):
+                    time.sleep(0.1)
+                    assert other.claim() is None
+                return {"result": 1}
+
+            assert queue.work(process, 0.01) == 1
+            assert queue.get_results() == {"AFG": {"result": 1}}
+            assert not queue.renew("AFG")
+
+    def test_workers(self):
+        with temp_dir("TestWorkQueueWorkers", delete_on_failure=False) as tempdir:
+            item_ids = [f"C{i:02d}" for i in range(40)]
+            fill(WorkQueue(tempdir), "hash", item_ids)
+            processed = []
+            lock = threading.Lock()
+
+            def process(item_id, payload):
+                with lock:
+                    processed.append(item_id)
+                return {"worker": threading.current_thread().name}
+
+            threads = [
+                threading.Thread(
+                    target=WorkQueue(tempdir, worker_id=f"worker{i}").work,
+                    args=(process, 0.01),
+                    name=f"worker{i}",
+                )
+                for i in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert sorted(processed) == item_ids
+            assert sorted(WorkQueue(tempdir).get_results()) == item_ids
+
+    def test_worker_before_coordinator(self):
+        with temp_dir("TestWorkQueueEarly", delete_on_failure=False) as tempdir:
+            # a queue finished by a previous run
+            previous = WorkQueue(tempdir, worker_id="previous")
+            fill(previous, "old hash", ["AFG"])
+            previous.work(lambda item_id, payload: {"run": "old"}, 0.01)
+            results = {}
+
+            def work():
+                queue = WorkQueue(tempdir, worker_id="early")
+                context = queue.wait_until_ready(0.01)
+                results["context"] = context
+                results["items"] = queue.work(
+                    lambda item_id, payload: {"run": context["batch"]}, 0.01
+                )
+
+            thread = threading.Thread(target=work)
+            thread.start()
+            # the worker waits rather than taking the finished queue
+            time.sleep(0.1)
+            assert "context" not in results
+            coordinator = WorkQueue(tempdir, worker_id="coordinator")
+            assert not coordinator.reset("new hash")
+            time.sleep(0.1)
+            assert "context" not in results
+            for item_id in ("AFG", "ETH"):
+                coordinator.add(item_id, {"item": item_id})
+            coordinator.mark_ready("new hash", {"batch": "new"})
+            thread.join()
+            assert results == {"context": {"batch": "new"}, "items": 2}
+            assert coordinator.get_results() == {
+                "AFG": {"run": "new"},
+                "ETH": {"run": "new"},
+            }